@@ -5,6 +5,7 @@ from .models import (
     Item,
     Player,
     GameData,
+    LedgerEvent,
     Loan,
     LoanPayback,
     Round,
@@ -12,9 +13,28 @@ from .models import (
     Transaction,
     PlayerTransaction,
     PlayerTransactionItemAmount,
+    PlayerSnapshot,
+    delete_with_ledger,
 )
 
 
+class LedgerEntryAdmin(admin.ModelAdmin):
+    """Ledger rows are deleted one at a time by their delete(), which takes their changes back from the balances, so
+    the bulk delete action is turned off."""
+
+    def get_actions(self, request):
+        actions = super(LedgerEntryAdmin, self).get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+
+class CascadingDeleteAdmin(admin.ModelAdmin):
+    """The bulk delete action takes the changes of the ledger rows it cascades to back from the balances."""
+
+    def delete_queryset(self, request, queryset):
+        delete_with_ledger(queryset)
+
+
 class TransactionInline(admin.TabularInline):
     model = Transaction
     extra = 1
@@ -35,7 +55,7 @@ class TakerTransactionInline(admin.TabularInline):
 
 
 @admin.register(Player)
-class PlayerAdmin(admin.ModelAdmin):
+class PlayerAdmin(CascadingDeleteAdmin):
     inlines = [
         TransactionInline,
         GiverTransactionInline,
@@ -49,19 +69,19 @@ class ItemExchangeRateInline(admin.TabularInline):
     
     
 @admin.register(City)
-class CityAdmin(admin.ModelAdmin):
+class CityAdmin(CascadingDeleteAdmin):
     inlines = [
         ItemExchangeRateInline,
     ]
     
     
 @admin.register(ItemExchangeRate)
-class ItemExchangeRateAdmin(admin.ModelAdmin):
+class ItemExchangeRateAdmin(CascadingDeleteAdmin):
     list_display = ('city', 'round', 'buy_price', 'sell_price')
 
 
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(LedgerEntryAdmin):
     pass
 
 
@@ -71,14 +91,45 @@ class PlayerTransactionItemAmountInline(admin.TabularInline):
 
 
 @admin.register(PlayerTransaction)
-class PlayerTransactionAdmin(admin.ModelAdmin):
+class PlayerTransactionAdmin(LedgerEntryAdmin):
     inlines = [
         PlayerTransactionItemAmountInline,
     ]
 
 
-admin.site.register(Item)
+admin.site.register(Item, CascadingDeleteAdmin)
 admin.site.register(GameData)
-admin.site.register(Loan)
-admin.site.register(LoanPayback)
-admin.site.register(Round)
+admin.site.register(Loan, LedgerEntryAdmin)
+admin.site.register(LoanPayback, LedgerEntryAdmin)
+admin.site.register(Round, CascadingDeleteAdmin)
+
+
+@admin.register(LedgerEvent)
+class LedgerEventAdmin(admin.ModelAdmin):
+    list_display = ('sequence', 'kind', 'entry_id', 'player', 'money', 'item', 'item_amount', 'created_at')
+    list_filter = ('kind', )
+
+    # The ledger is append-only, the events are written by the ledger rows
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(PlayerSnapshot)
+class PlayerSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('player', 'sequence', 'money')
+
+    # The snapshots are written from the events
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,158 @@
+"""A good trading route of a game and a bound on every route, to check the balance of a market before it is played.
+
+A player visits one city in every round, sells there what is worth more sold than kept, then buys the item that is
+worth the most at the end per money spent. Loans are taken in the rounds where the money grows more than the
+interest, and are paid back after selling in the later round where that costs the least, or when the game ends.
+
+Prices don't depend on the traded amounts, so if items could be traded in fractions, what one unit of money or of an
+item held at the start of a round is worth at the end wouldn't depend on how many units are held. Those factors are
+computed by dynamic programming backwards over the rounds, in O(rounds x cities x items), and times the starting
+money they give an upper bound of the score of every route without loans. A loan is worth at most its amount times
+the factor of its round, and paying it back in a later round costs at least the payback times what money is worth
+after selling in the city of that round where it buys the least, so every loan adds at most the best difference of
+the two over the rounds it can be paid back in. The route is then played forwards greedily in whole items with the
+factors. Its score is achievable, but the leftover money of the rounding can make another route better, so it is a
+heuristic: the best score is between the route score and the upper bound.
+"""
+from collections import Counter
+
+from .exceptions import InvalidRequestException
+from .game_clock import get_game_clock
+from .loans import get_loan_table
+from .rates import get_rate_matrix
+
+
+def _round_factors(matrix, cities, round_number, next_cash, next_items):
+    """Return what a unit of money and of every item held at the start of the round is worth at the end, and what
+    money is worth in every city of the round with the item it buys there (None to keep the money)."""
+    cash_in_city = {}
+    for city_name in cities:
+        best = (next_cash, None)
+        for item_name, rate in matrix.round_rates(city_name, round_number).items():
+            if rate.buy_price and item_name in next_items and next_items[item_name] / rate.buy_price > best[0]:
+                best = (next_items[item_name] / rate.buy_price, item_name)
+        cash_in_city[city_name] = best
+    cash = max([next_cash] + [factor for factor, item_name in cash_in_city.values()])
+    items = dict(next_items)
+    for city_name in cities:
+        for item_name, rate in matrix.round_rates(city_name, round_number).items():
+            if rate.sell_price is not None and item_name in items:
+                items[item_name] = max(items[item_name], rate.sell_price * cash_in_city[city_name][0])
+    return cash, items, cash_in_city
+
+
+def solve(starting_money=None):
+    """Return a route of the current market found greedily with its rounds and its score, and the upper bound of the
+    score of every route.
+
+    The loan paybacks of the result are paid when the game ends, the ones paid earlier are in the rounds.
+
+    The route starts with the starting money of the players by default. It is the best one when its score reaches the
+    upper bound, see the module docstring.
+    """
+    from .models import STARTING_MONEY, Item
+    if starting_money is None:
+        starting_money = STARTING_MONEY
+    clock = get_game_clock()
+    if clock is None or not clock.last_round:
+        raise InvalidRequestException("There is no game to solve")
+    rounds = range(1, clock.last_round + 1)
+    matrix = get_rate_matrix()
+    cities = matrix.city_names
+    ending_prices = dict(Item.objects.values_list('name', 'ending_price'))
+
+    # factors[r] is what money and items held at the start of round r are worth at the end
+    factors = {clock.last_round + 1: (1.0, {item_name: float(price) for item_name, price in ending_prices.items()})}
+    cash_in_city = {}
+    for round_number in reversed(rounds):
+        next_cash, next_items = factors[round_number + 1]
+        cash, items, cash_in_city[round_number] = _round_factors(matrix, cities, round_number, next_cash, next_items)
+        factors[round_number] = (cash, items)
+
+    # What money is worth at the lowest in every round, after selling in a city, money kept to the end of the round
+    # loses as much by not buying
+    lowest_cash = {
+        round_number: min(cash for cash, item_name in cash_in_city[round_number].values())
+        for round_number in rounds if cash_in_city[round_number]
+    }
+
+    # loans[r] is the loan taken in round r and the round it is paid back in, None when the game ends
+    loans = {}
+    upper_bound = starting_money * factors[1][0]
+    loan_table = get_loan_table(clock)
+    for round_number in rounds:
+        amount = loan_table.amount(round_number)
+        options = [(loan_table.payback(amount, round_number, clock.last_round), None)] + [
+            (loan_table.payback(amount, round_number, payback_round) * lowest_cash[payback_round], payback_round)
+            for payback_round in range(round_number + 1, clock.last_round) if payback_round in lowest_cash
+        ]
+        cost, payback_round = min(options, key=lambda option: option[0])
+        if amount * factors[round_number][0] > cost:
+            loans[round_number] = (amount, payback_round)
+            upper_bound += amount * factors[round_number][0] - cost
+
+    money, holdings, route, outstanding = starting_money, Counter(), [], set(loans)
+    for round_number in rounds:
+        step = {'round': round_number, 'loan': 0, 'sold': {}, 'paid_back': 0, 'bought': {}}
+        if round_number in loans:
+            step['loan'] = loans[round_number][0]
+            money += step['loan']
+        next_cash, next_items = factors[round_number + 1]
+
+        def worth_in(city_name):
+            cash_factor = cash_in_city[round_number][city_name][0]
+            rates = matrix.round_rates(city_name, round_number)
+            worth = money * cash_factor
+            for item_name, amount in holdings.items():
+                kept = amount * next_items[item_name]
+                rate = rates.get(item_name)
+                sold = amount * rate.sell_price * cash_factor if rate is not None and rate.sell_price is not None else 0
+                worth += max(kept, sold)
+            return worth
+
+        city_name = max(cities, key=worth_in) if cities else None
+        if city_name is not None:
+            step['city'] = city_name
+            cash_factor, bought_item = cash_in_city[round_number][city_name]
+            rates = matrix.round_rates(city_name, round_number)
+            for item_name, amount in list(holdings.items()):
+                rate = rates.get(item_name)
+                if rate is None or rate.sell_price is None:
+                    continue
+                if rate.sell_price * cash_factor > next_items[item_name]:
+                    step['sold'][item_name] = {'amount': amount, 'price': rate.sell_price}
+                    money += amount * rate.sell_price
+                    del holdings[item_name]
+            for loan_round, (amount, payback_round) in loans.items():
+                if payback_round != round_number:
+                    continue
+                payback = loan_table.payback(amount, loan_round, round_number)
+                # Without enough money after selling, the loan is paid back when the game ends
+                if money >= payback:
+                    step['paid_back'] += payback
+                    money -= payback
+                    outstanding.remove(loan_round)
+            if bought_item is not None:
+                buy_price = rates[bought_item].buy_price
+                amount = money // buy_price
+                if amount:
+                    step['bought'][bought_item] = {'amount': amount, 'price': buy_price}
+                    money -= amount * buy_price
+                    holdings[bought_item] += amount
+        step['money'] = money
+        route.append(step)
+
+    items_value = sum(amount * ending_prices[item_name] for item_name, amount in holdings.items())
+    paybacks = sum(
+        loan_table.payback(loans[loan_round][0], loan_round, clock.last_round) for loan_round in outstanding
+    )
+    return {
+        'starting_money': starting_money,
+        'route_score': money + items_value - paybacks,
+        'upper_bound': int(upper_bound),
+        'final_money': money,
+        'final_items': {item_name: amount for item_name, amount in holdings.items() if amount},
+        'items_value': items_value,
+        'loan_paybacks': paybacks,
+        'rounds': route,
+    }
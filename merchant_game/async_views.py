@@ -0,0 +1,104 @@
+"""Async versions of the hot read-only endpoints, routed instead of the DRF views in ASGI mode.
+
+Django runs every sync view of an ASGI worker in one shared thread, so a slow query holds up every other request.
+These views run their queries in a thread pool instead, and the API check answers from the event loop. They render the
+same JSON as the DRF views, other methods and requests for the browsable API or with a `format` are passed on to the
+DRF views.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse
+from rest_framework import exceptions, permissions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
+
+from . import views
+from .game_clock import get_game_clock
+from .models import City
+from .rates import get_rate_matrix
+from .serializers import GameDataSerializer, ItemExchangeRateSerializer, PlayerListSerializer
+
+
+def _json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status)
+
+
+def _passed_to_drf(request):
+    return request.method != 'GET' or 'format' in request.GET or 'text/html' in request.META.get('HTTP_ACCEPT', '')
+
+
+def _has_credentials(request):
+    return 'HTTP_AUTHORIZATION' in request.META or settings.SESSION_COOKIE_NAME in request.COOKIES
+
+
+def _authentication_error(request, required):
+    """Authenticate the request with the authentication classes of the API like the DRF views do.
+
+    Returns the error response if the credentials are invalid, or if there are none and authentication is required.
+    """
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        authenticated = permissions.IsAuthenticated().has_permission(drf_request, None)
+    except exceptions.AuthenticationFailed as ex:
+        return _json_response(ex.detail if isinstance(ex.detail, (list, dict)) else {'detail': ex.detail}, status=403)
+    if required and not authenticated:
+        return _json_response({'detail': exceptions.NotAuthenticated.default_detail}, status=403)
+    return None
+
+
+def async_read_view(drf_view, authentication_required=False):
+    """Turn the blocking read function into an async view that authenticates and runs it in the thread pool."""
+    def decorator(read):
+        async def view(request, *args, **kwargs):
+            if _passed_to_drf(request):
+                return await sync_to_async(drf_view)(request, *args, **kwargs)
+
+            def run():
+                try:
+                    error = _authentication_error(request, authentication_required)
+                    return error if error is not None else read(request, *args, **kwargs)
+                finally:
+                    close_old_connections()
+            return await sync_to_async(run, thread_sensitive=False)()
+        return view
+    return decorator
+
+
+async def api_check(request):
+    if _passed_to_drf(request) or _has_credentials(request):
+        return await sync_to_async(views.api_check)(request)
+    return _json_response({'api_root': reverse('api', request=request)})
+
+
+@async_read_view(views.CityViewSet.as_view({'get': 'current_rates'}), authentication_required=True)
+def city_current_rates(request, pk):
+    clock = get_game_clock()
+    city_rates = get_rate_matrix().round_rates(pk, clock.current_round) if clock else {}
+    if not city_rates and not City.objects.filter(pk=pk).exists():
+        return _json_response({'detail': exceptions.NotFound.default_detail}, status=404)
+    return _json_response({
+        item_name: ItemExchangeRateSerializer().to_representation(rate)
+        for item_name, rate in city_rates.items()
+    })
+
+
+@async_read_view(views.GameDataViewSet.as_view({'get': 'list'}))
+def game_data_list(request):
+    return _json_response(GameDataSerializer(views.GameDataViewSet.queryset.all(), many=True).data)
+
+
+@async_read_view(views.GameDataViewSet.as_view({'get': 'retrieve'}))
+def game_data_detail(request, pk):
+    game_data = views.GameDataViewSet.queryset.filter(pk=pk).first() if pk.isdigit() else None
+    if game_data is None:
+        return _json_response({'detail': exceptions.NotFound.default_detail}, status=404)
+    return _json_response(GameDataSerializer(game_data).data)
+
+
+@async_read_view(views.PlayerViewSet.as_view({'get': 'list'}))
+def player_list(request):
+    players = views.PlayerViewSet(action='list').get_queryset()
+    return _json_response(PlayerListSerializer(players, many=True, context={'request': request}).data)
@@ -5,3 +5,9 @@ class InvalidRequestException(exceptions.APIException):
     status_code = exceptions.status.HTTP_400_BAD_REQUEST
     default_detail = "The request is missing keys."
     default_code = "missing"
+
+
+class TradeException(exceptions.APIException):
+    status_code = exceptions.status.HTTP_400_BAD_REQUEST
+    default_detail = "The trade is not possible."
+    default_code = "trade"
@@ -0,0 +1,75 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+_cache = {}
+
+
+class GameClock:
+    """Round arithmetic of a game, computed from the GameData row and the number of rounds without queries."""
+
+    def __init__(self, game_data, last_round):
+        self.game_data = game_data
+        self.last_round = last_round
+
+    @property
+    def round_duration_in_seconds(self):
+        return self.game_data.round_duration * 60
+
+    @property
+    def elapsed_seconds(self):
+        return (timezone.now() - self.game_data.starting_time).total_seconds()
+
+    @property
+    def current_round(self):
+        elapsed_seconds = self.elapsed_seconds
+        return (
+            int(elapsed_seconds / self.round_duration_in_seconds) + 1
+            if elapsed_seconds <= self.last_round * self.round_duration_in_seconds
+            else self.last_round
+        )
+
+    @property
+    def round_remaining_seconds(self):
+        return (
+            self.round_duration_in_seconds - (
+                self.elapsed_seconds - self.round_duration_in_seconds * (self.current_round - 1)
+            )
+        )
+
+    def round_starting_time(self, number):
+        return self.game_data.starting_time + timedelta(seconds=self.round_duration_in_seconds * (number - 1))
+
+    def round_ending_time(self, number):
+        return self.round_starting_time(number + 1)
+
+
+def _cached(key, load):
+    value, expires = _cache.get(key, (None, 0))
+    if expires <= time.monotonic():
+        value = load()
+        _cache[key] = (value, time.monotonic() + settings.MERCHANT_GAME_CACHE_TTL)
+    return value
+
+
+def get_last_round():
+    """Return the number of the last round, cached for MERCHANT_GAME_CACHE_TTL seconds."""
+    from .models import Round
+    return _cached('last_round', lambda: Round.objects.aggregate(Max('number'))['number__max'])
+
+
+def get_game_clock():
+    """Return the clock of the current game, or None before any GameData exists.
+
+    The GameData row is cached for MERCHANT_GAME_CACHE_TTL seconds, writing GameData or saving Round invalidates it.
+    """
+    from .models import GameData
+    game_data = _cached('game_data', lambda: GameData.objects.last())
+    return GameClock(game_data, get_last_round()) if game_data is not None else None
+
+
+def invalidate():
+    _cache.clear()
@@ -0,0 +1,107 @@
+import http.client
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# The queries are only known when the server sends the Server-Timing header, see MERCHANT_GAME_SERVER_TIMING
+Result = namedtuple('Result', ['status', 'content', 'seconds', 'queries'])
+
+QUERIES_PATTERN = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+# Shown when requests of a benchmark failed on SQLite
+SQLITE_LOCK_WARNING = "SQLite can't lock single rows, concurrent writers fail instead of waiting"
+
+
+def _accepts_connections(port):
+    try:
+        socket.create_connection(('127.0.0.1', port), timeout=1).close()
+    except OSError:
+        return False
+    return True
+
+
+@contextmanager
+def local_server(arguments, port, env=None):
+    """Run the server command in the project directory until the port accepts connections, stop it on exit."""
+    if _accepts_connections(port):
+        raise RuntimeError("Port {} is already in use".format(port))
+    server = subprocess.Popen(
+        arguments,
+        cwd=settings.BASE_DIR,
+        env=dict(os.environ, **(env or {})),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError("{} exited with {}".format(' '.join(arguments), server.returncode))
+            if _accepts_connections(port):
+                break
+            if time.monotonic() > deadline:
+                raise RuntimeError("{} didn't start listening on {}".format(' '.join(arguments), port))
+            time.sleep(0.2)
+        yield server
+    finally:
+        server.terminate()
+        server.wait()
+
+
+class Client:
+    """A keep-alive HTTP client of a local server that measures its requests. Not thread safe, use one per thread."""
+
+    def __init__(self, port, token=None):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        self.token = token
+
+    def request(self, method, path, data=None, headers=None):
+        """Send the request and return its Result, the content is the decoded JSON body or None."""
+        headers = dict({'Accept': 'application/json'}, **(headers or {}))
+        if self.token is not None:
+            headers['Authorization'] = 'Bearer {}'.format(self.token)
+        body = None
+        if data is not None:
+            body = json.dumps(data)
+            headers['Content-Type'] = 'application/json'
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            return Result(None, None, time.perf_counter() - started, None)
+        seconds = time.perf_counter() - started
+        try:
+            content = json.loads(content) if content else None
+        except ValueError:
+            content = None
+        queries = QUERIES_PATTERN.search(response.getheader('Server-Timing', ''))
+        return Result(response.status, content, seconds, int(queries.group(1)) if queries else None)
+
+    def close(self):
+        self.connection.close()
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def latency_summary(latencies):
+    """Format the mean and the percentiles of the latencies, given in seconds, in milliseconds."""
+    latencies = sorted(latency * 1000 for latency in latencies)
+    return "mean {:.2f}, p50 {:.2f}, p95 {:.2f}, p99 {:.2f}".format(
+        statistics.mean(latencies),
+        percentile(latencies, 0.5),
+        percentile(latencies, 0.95),
+        percentile(latencies, 0.99),
+    )
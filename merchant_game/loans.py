@@ -0,0 +1,139 @@
+from django.db.transaction import atomic, on_commit
+
+from .exceptions import InvalidRequestException
+from .game_clock import get_game_clock
+from .metrics import record_ledger_entries
+
+_cache = {}
+
+
+def payback_amount(loan_amount, loan_round, payback_round, loan_interest):
+    """Return what paying back a loan costs: the loan plus the interest of every round since it was taken."""
+    return loan_amount + (payback_round - loan_round) * int(loan_amount * loan_interest / 100)
+
+
+class LoanTable:
+    """The loan of every round of a game and what paying it back costs in every round from then on.
+
+    Loans taken before the loans of the game data changed keep their amount, their paybacks are computed.
+    """
+
+    def __init__(self, starting_loan, loan_increase, loan_interest, last_round):
+        self.starting_loan = starting_loan
+        self.loan_increase = loan_increase
+        self.loan_interest = loan_interest
+        rounds = range(1, last_round + 1)
+        self.amounts = {loan_round: self._amount(loan_round) for loan_round in rounds}
+        self.paybacks = {
+            (loan_round, payback_round): payback_amount(amount, loan_round, payback_round, loan_interest)
+            for loan_round, amount in self.amounts.items()
+            for payback_round in range(loan_round, last_round + 1)
+        }
+
+    def _amount(self, loan_round):
+        return self.starting_loan + (loan_round - 1) * self.loan_increase
+
+    def amount(self, loan_round):
+        """Return the loan of the round."""
+        amount = self.amounts.get(loan_round)
+        return amount if amount is not None else self._amount(loan_round)
+
+    def payback(self, loan_amount, loan_round, payback_round):
+        """Return what paying back the loan taken in loan_round costs in payback_round."""
+        if self.amounts.get(loan_round) == loan_amount:
+            amount = self.paybacks.get((loan_round, payback_round))
+            if amount is not None:
+                return amount
+        return payback_amount(loan_amount, loan_round, payback_round, self.loan_interest)
+
+
+def get_loan_table(clock=None):
+    """Return the loan table of the game of the clock, the current one by default.
+
+    It is built again when the loans of the game data or the number of rounds change.
+    """
+    if clock is None:
+        clock = get_game_clock()
+    game_data = clock.game_data
+    key = (game_data.pk, game_data.starting_loan, game_data.loan_increase, game_data.loan_interest, clock.last_round)
+    table = _cache.get(key)
+    if table is None:
+        _cache.clear()
+        table = _cache[key] = LoanTable(
+            game_data.starting_loan, game_data.loan_increase, game_data.loan_interest, clock.last_round or 0,
+        )
+    return table
+
+
+def issue_loans(player_codes=None, round_number=None):
+    """Give the loan of the round, the current one by default, to the players, every player by default.
+
+    Players that took the loan of the round already are skipped. The existing loans are looked up with one query
+    and the new ones are inserted with another, so the loans taken at the start of a round don't need a request per
+    player. Returns the created loans and the codes of the skipped players. Raises InvalidRequestException for
+    unknown players or rounds, and IntegrityError if a loan of the round is taken while they are issued.
+    """
+    from .models import Loan, Player
+    clock = get_game_clock()
+    if clock is None or not clock.last_round:
+        raise InvalidRequestException("There is no game to issue loans in")
+    if round_number is None:
+        round_number = clock.current_round
+    if not 1 <= round_number <= clock.last_round:
+        raise InvalidRequestException("round should be between 1 and {}".format(clock.last_round))
+    amount = get_loan_table(clock).amount(round_number)
+    with atomic():
+        if player_codes is None:
+            player_codes = list(Player.objects.order_by('code').values_list('code', flat=True))
+        else:
+            player_codes = list(dict.fromkeys(player_codes))
+            known_codes = set(Player.objects.filter(code__in=player_codes).values_list('code', flat=True))
+            unknown_codes = [code for code in player_codes if code not in known_codes]
+            if unknown_codes:
+                raise InvalidRequestException("Unknown players: {}".format(', '.join(unknown_codes)))
+        indebted_codes = set(
+            Loan.objects.filter(round=round_number, player__in=player_codes).values_list('player', flat=True)
+        )
+        loans = Loan.create_in_bulk([
+            Loan(player_id=code, round_id=round_number, amount=amount)
+            for code in player_codes if code not in indebted_codes
+        ])
+    return loans, [code for code in player_codes if code in indebted_codes]
+
+
+def settle_loans():
+    """Pay back every outstanding loan in the current round and return the created paybacks.
+
+    The paybacks are computed in memory and inserted with a single query, loans that have been repaid already are
+    skipped. The player balances and the ledger events are updated in the same transaction. Nothing is paid back
+    before the GameData exists.
+    """
+    from .models import LedgerEvent, Loan, LoanPayback
+    clock = get_game_clock()
+    if clock is None:
+        return []
+    current_round = clock.current_round
+    table = get_loan_table(clock)
+    with atomic():
+        outstanding = (
+            Loan.objects
+            .select_for_update(of=('self',))
+            .filter(payback__isnull=True)
+            .values_list('id', 'player', 'round', 'amount')
+        )
+        paybacks, player_codes = [], []
+        for loan_id, player_code, loan_round, amount in outstanding:
+            payback = LoanPayback(
+                loan_id=loan_id,
+                round_id=current_round,
+                payback_amount=table.payback(amount, loan_round, current_round),
+            )
+            paybacks.append(payback)
+            player_codes.append(player_code)
+        paybacks = LoanPayback.insert_in_bulk(paybacks)
+        LedgerEvent.apply(LedgerEvent.LOAN_PAYBACK, [
+            (payback.pk, {player_code: -payback.payback_amount}, {})
+            for payback, player_code in zip(paybacks, player_codes)
+        ])
+        on_commit(lambda: record_ledger_entries(paybacks))
+    return paybacks
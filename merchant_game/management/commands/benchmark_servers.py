@@ -0,0 +1,85 @@
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from merchant_game.game_clock import get_game_clock
+from merchant_game.load_testing import Client, latency_summary, local_server
+from merchant_game.models import City
+from rest_framework_simplejwt.tokens import AccessToken
+
+BENCHMARK_USERNAME = 'bench'
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the sync (gunicorn, scout.wsgi) and the async (gunicorn with uvicorn workers, scout.asgi) stacks. "
+        "Starts each on a local port and measures the requests/s and latency of the hot read-only endpoints"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help="Number of requests per endpoint")
+        parser.add_argument('--concurrency', type=int, default=16, help="Number of clients sending in parallel")
+        parser.add_argument('--workers', type=int, default=2, help="Number of server worker processes")
+        parser.add_argument('--port', type=int, default=8765, help="Local port of the servers")
+
+    def handle(self, *args, **options):
+        city = City.objects.order_by('name').first()
+        if city is None or get_game_clock() is None:
+            raise CommandError("There is no game to request, run populate and create the game data first")
+
+        User.objects.filter(username=BENCHMARK_USERNAME).delete()
+        user = User.objects.create_user(BENCHMARK_USERNAME)
+        token = str(AccessToken.for_user(user))
+        endpoints = [
+            '/merchant_game/api/check/',
+            '/merchant_game/api/game-data/',
+            '/merchant_game/api/players/',
+            '/merchant_game/api/cities/{}/current_rates/'.format(city.name),
+        ]
+        gunicorn = shutil.which('gunicorn')
+        if gunicorn is None:
+            raise CommandError("gunicorn is not installed")
+        port = options['port']
+        bind = ['--bind', '127.0.0.1:{}'.format(port), '--workers', str(options['workers'])]
+        stacks = [
+            ('sync', [gunicorn, 'scout.wsgi'] + bind),
+            ('async', [gunicorn, 'scout.asgi', '-c', 'scout/gunicorn_asgi.py'] + bind),
+        ]
+        try:
+            for stack, arguments in stacks:
+                with local_server(arguments, port):
+                    for path in endpoints:
+                        self._benchmark(stack, path, port, token, options['requests'], options['concurrency'])
+        except RuntimeError as ex:
+            raise CommandError(str(ex))
+        finally:
+            User.objects.filter(username=BENCHMARK_USERNAME).delete()
+
+    def _benchmark(self, stack, path, port, token, requests, concurrency):
+        def send(count):
+            client = Client(port, token)
+            try:
+                return [client.request('GET', path) for _ in range(count)]
+            finally:
+                client.close()
+
+        counts = [
+            requests // concurrency + (1 if number < requests % concurrency else 0) for number in range(concurrency)
+        ]
+        # Warm up the caches of the workers before measuring
+        send(concurrency)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = [result for batch in executor.map(send, counts) for result in batch]
+        elapsed = time.perf_counter() - started
+
+        errors = sum(1 for result in results if result.status != 200)
+        self.stdout.write("{:<5} {:<55} {:>8.1f} requests/s, errors: {}, latency ms: {}".format(
+            stack,
+            path,
+            len(results) / elapsed,
+            errors,
+            latency_summary([result.seconds for result in results]),
+        ))
@@ -0,0 +1,81 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from merchant_game.exceptions import TradeException
+from merchant_game.load_testing import SQLITE_LOCK_WARNING, latency_summary
+from merchant_game.models import ItemExchangeRate, Player, PlayerBalance, PlayerInventory
+from merchant_game.trading import execute_trade
+
+BENCHMARK_PLAYER_CODE = 'bench'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the latency of the locked trade pipeline. "
+        "Runs buy/sell pairs of a temporary player from parallel threads and checks nothing was overspent"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trades', type=int, default=1000, help="Number of trades to execute")
+        parser.add_argument('--threads', type=int, default=4, help="Number of threads trading in parallel")
+
+    def handle(self, *args, **options):
+        rate = (
+            ItemExchangeRate.objects
+            .filter(buy_price__isnull=False, sell_price__isnull=False)
+            .select_related('item')
+            .first()
+        )
+        if rate is None:
+            raise CommandError("There are no exchange rates to trade with, run populate first")
+
+        Player.objects.filter(code=BENCHMARK_PLAYER_CODE).delete()
+        player = Player(code=BENCHMARK_PLAYER_CODE)
+        player.save()
+
+        def trade(number):
+            started = time.perf_counter()
+            try:
+                execute_trade(player, rate, 1 if number % 2 == 0 else -1)
+                outcome = 'executed'
+            except TradeException:
+                outcome = 'rejected'
+            except DatabaseError:
+                outcome = 'failed'
+            finally:
+                connection.close()
+            return time.perf_counter() - started, outcome
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            results = list(executor.map(trade, range(options['trades'])))
+        elapsed = time.perf_counter() - started
+
+        ledger_money = PlayerBalance.from_ledger([player.code])[player.code]
+        ledger_items = PlayerInventory.from_ledger([player.code])[(player.code, rate.item_id)]
+        consistent = (ledger_money, ledger_items) == (player.money, player.items.get(rate.item_id, 0))
+        Player.objects.filter(code=BENCHMARK_PLAYER_CODE).delete()
+
+        outcomes = [outcome for latency, outcome in results]
+        self.stdout.write(
+            "trades: {}, executed: {}, rejected: {}, failed: {}, threads: {}, throughput: {:.1f} trades/s".format(
+                len(results),
+                outcomes.count('executed'),
+                outcomes.count('rejected'),
+                outcomes.count('failed'),
+                options['threads'],
+                len(results) / elapsed,
+            )
+        )
+        self.stdout.write("latency ms: {}".format(latency_summary([latency for latency, outcome in results])))
+        if outcomes.count('failed') and connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                "{} trades failed. {}".format(outcomes.count('failed'), SQLITE_LOCK_WARNING)
+            ))
+        if ledger_money < 0 or ledger_items < 0 or not consistent:
+            raise CommandError("The trades left an inconsistent state: money {}, {} {}".format(
+                ledger_money, rate.item_id, ledger_items,
+            ))
+        self.stdout.write(self.style.SUCCESS("Stored balance and inventory match the ledger"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from merchant_game.models import Player, PlayerBalance, PlayerInventory, PlayerSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays the money and items of every player from the ledger events, starting from their latest snapshot, "
+        "and compares them with the stored balances and inventories"
+    )
+
+    def handle(self, *args, **options):
+        stored_money = dict(PlayerBalance.objects.values_list('player', 'money'))
+        stored_items = {}
+        for code, item, amount in PlayerInventory.objects.exclude(amount=0).values_list('player', 'item', 'amount'):
+            stored_items.setdefault(code, {})[item] = amount
+
+        codes = list(Player.objects.order_by('code').values_list('code', flat=True))
+        drifted = 0
+        for code in codes:
+            money, items = PlayerSnapshot.state(code)
+            if money != stored_money.get(code) or items != stored_items.get(code, {}):
+                drifted += 1
+                self.stdout.write("'{}' stored: {} money and {}, replayed: {} money and {}".format(
+                    code, stored_money.get(code), stored_items.get(code, {}), money, items,
+                ))
+        if drifted:
+            raise CommandError("{} players differ from their ledger events".format(drifted))
+        self.stdout.write(self.style.SUCCESS("All {} players match their ledger events".format(len(codes))))
@@ -0,0 +1,158 @@
+import random
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import Sum
+from merchant_game.models import (
+    ItemExchangeRate,
+    Player,
+    PlayerTransaction,
+    PlayerTransactionItemAmount,
+    Transaction,
+)
+
+# The migration adding the ledger indexes and the one before it
+BEFORE_MIGRATION = ('merchant_game', '0032_ledgerevent_playersnapshot')
+INDEX_MIGRATION = ('merchant_game', '0033_ledger_indexes')
+INSERT_BATCH_SIZE = 5000
+
+# The queries of PlayerBalance.from_ledger, PlayerInventory.from_ledger and the player detail, for a player and a rate
+QUERIES = [
+    ("money traded by a player", lambda code, rate: (
+        Transaction.objects.filter(player__in=[code]).values_list('player').annotate(Sum('price')).order_by()
+    )),
+    ("items traded by a player", lambda code, rate: (
+        Transaction.objects.filter(player__in=[code])
+        .values_list('player', 'exchange_rate__item').annotate(Sum('item_amount')).order_by()
+    )),
+    ("money given by a player", lambda code, rate: (
+        PlayerTransaction.objects.filter(giver__in=[code]).values_list('giver').annotate(Sum('money')).order_by()
+    )),
+    ("money taken by a player", lambda code, rate: (
+        PlayerTransaction.objects.filter(taker__in=[code]).values_list('taker').annotate(Sum('money')).order_by()
+    )),
+    ("items given by a player", lambda code, rate: (
+        PlayerTransactionItemAmount.objects.filter(transaction__giver__in=[code])
+        .values_list('transaction__giver', 'item').annotate(Sum('amount')).order_by()
+    )),
+    ("transactions of a player", lambda code, rate: (
+        Transaction.objects.filter(player__in=[code]).only('id', 'player')
+    )),
+    ("rates of a city in a round", lambda code, rate: (
+        ItemExchangeRate.objects.filter(city=rate.city_id, round=rate.round_id)
+    )),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the query plans and timings of the ledger aggregation queries before and after the ledger indexes. "
+        "Creates a throwaway test database, fills it with generated players and transactions, measures the queries "
+        "without the indexes, migrates and measures them again"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transactions', type=int, default=100000, help="Number of generated trades")
+        parser.add_argument('--players', type=int, default=1000, help="Number of generated players")
+        parser.add_argument('--repeat', type=int, default=50, help="Number of timed runs of every query")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the generated data")
+
+    def handle(self, *args, **options):
+        random_generator = random.Random(options['seed'])
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self._index_migration(unapply=True)
+            self._fill(random_generator, options['players'], options['transactions'])
+            before = self._measure("before", random_generator, options['repeat'])
+            started = time.perf_counter()
+            self._index_migration(unapply=False)
+            self.stdout.write("Migrating to {} took {:.1f} s".format(INDEX_MIGRATION[1], time.perf_counter() - started))
+            after = self._measure("after", random_generator, options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write("{:<30} {:>10} {:>10}".format("query", "before ms", "after ms"))
+        for name, query in QUERIES:
+            self.stdout.write("{:<30} {:>10.3f} {:>10.3f}".format(name, before[name], after[name]))
+
+    @staticmethod
+    def _index_migration(unapply):
+        """Take back or apply only the operations of the index migration.
+
+        Migrating the app back would also drop the tables of the later migrations, which populate writes to.
+        """
+        loader = MigrationLoader(connection)
+        migration = loader.get_migration(*INDEX_MIGRATION)
+        state = loader.project_state(BEFORE_MIGRATION)
+        with connection.schema_editor() as schema_editor:
+            if unapply:
+                migration.unapply(state, schema_editor)
+            else:
+                migration.apply(state, schema_editor)
+
+    def _fill(self, random_generator, player_count, transaction_count):
+        call_command('populate', stdout=StringIO())
+        rates = list(ItemExchangeRate.objects.filter(buy_price__isnull=False, sell_price__isnull=False))
+        codes = ['{:06d}'.format(number) for number in range(player_count)]
+        Player.objects.bulk_create((Player(code=code) for code in codes), batch_size=INSERT_BATCH_SIZE)
+
+        # The rows are inserted without their ledger events, only the ledger tables are measured
+        transactions = []
+        for _ in range(transaction_count):
+            rate = random_generator.choice(rates)
+            item_amount = random_generator.choice([-3, -2, -1, 1, 2, 3])
+            price = -item_amount * (rate.buy_price if item_amount > 0 else rate.sell_price)
+            transactions.append(Transaction(
+                player_id=random_generator.choice(codes), exchange_rate=rate, item_amount=item_amount, price=price,
+            ))
+        Transaction.objects.bulk_create(transactions, batch_size=INSERT_BATCH_SIZE)
+        PlayerTransaction.objects.bulk_create(
+            (
+                PlayerTransaction(
+                    giver_id=random_generator.choice(codes),
+                    taker_id=random_generator.choice(codes),
+                    money=random_generator.randint(0, 50),
+                )
+                for _ in range(transaction_count // 10)
+            ),
+            batch_size=INSERT_BATCH_SIZE,
+        )
+        PlayerTransactionItemAmount.objects.bulk_create(
+            (
+                PlayerTransactionItemAmount(
+                    transaction_id=transaction_id,
+                    item_id=random_generator.choice(rates).item_id,
+                    amount=random_generator.randint(1, 3),
+                )
+                for transaction_id in PlayerTransaction.objects.values_list('id', flat=True)
+                if random_generator.random() < 0.5
+            ),
+            batch_size=INSERT_BATCH_SIZE,
+        )
+        self.stdout.write("Generated {} players, {} trades and {} player transactions".format(
+            player_count, transaction_count, transaction_count // 10,
+        ))
+
+    def _measure(self, label, random_generator, repeat):
+        """Print the plan of every query and return their mean duration in milliseconds, keyed by name."""
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        codes = list(Player.objects.values_list('code', flat=True))
+        rates = list(ItemExchangeRate.objects.all())
+        durations = {}
+        for name, query in QUERIES:
+            self.stdout.write(self.style.MIGRATE_HEADING("{} - {}".format(label, name)))
+            self.stdout.write(query(codes[0], rates[0]).explain())
+            elapsed = 0
+            for _ in range(repeat):
+                queryset = query(random_generator.choice(codes), random_generator.choice(rates))
+                started = time.perf_counter()
+                list(queryset)
+                elapsed += time.perf_counter() - started
+            durations[name] = elapsed * 1000 / repeat
+        return durations
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+from merchant_game import price_schedules
+
+# The generated names are numbered with five digits
+MAX_COUNT = 99999
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a market of cities, items and exchange rates of every round with a seeded random generator, for "
+        "stress tests and capacity planning. The rates are inserted in batches while they are generated. "
+        "Removes pre-existing data like populate"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cities', type=int, default=50, help="Number of cities")
+        parser.add_argument('--items', type=int, default=10, help="Number of items")
+        parser.add_argument('--rounds', type=int, default=20, help="Number of rounds")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the prices")
+        parser.add_argument(
+            '--not-traded',
+            type=float,
+            default=0.1,
+            help="Probability that an item can't be bought, and separately sold, in a city in a round",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=price_schedules.INSERT_BATCH_SIZE,
+            help="Number of exchange rates inserted at once",
+        )
+
+    def handle(self, *args, **options):
+        for option in ('cities', 'items', 'rounds'):
+            if not 1 <= options[option] <= MAX_COUNT:
+                raise CommandError("The number of {} should be between 1 and {}".format(option, MAX_COUNT))
+        if not 0 <= options['not_traded'] <= 1:
+            raise CommandError("--not-traded should be a probability between 0 and 1")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size should be positive")
+
+        schedule = price_schedules.generate(
+            options['cities'], options['items'], options['rounds'], options['seed'], options['not_traded'],
+        )
+        started = time.perf_counter()
+        try:
+            installed = price_schedules.install(schedule, options['batch_size'])
+        except IntegrityError as ex:
+            raise CommandError("Generating the market failed: {}".format(ex))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            "Successfully generated {} cities, {} items, {} rounds and {} exchange rates in {:.1f} s, "
+            "{:.0f} rates/s".format(
+                options['cities'], options['items'], options['rounds'], installed, elapsed, installed / elapsed,
+            )
+        ))
+        warning = price_schedules.extra_rounds_warning(schedule)
+        if warning:
+            self.stdout.write(self.style.WARNING(warning))
@@ -0,0 +1,213 @@
+import random
+import shutil
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from merchant_game.load_testing import SQLITE_LOCK_WARNING, Client, latency_summary, local_server
+from merchant_game.models import City, GameData, Player, Round
+
+API = '/merchant_game/api/'
+PLAYER_CODE_PREFIX = 'LT'
+USERNAME = 'loadtest'
+PASSWORD = 'loadtest'
+# Seconds the server caches the game clock, the rounds are switched by moving the starting time of the game
+SERVER_CACHE_TTL = 1
+
+
+class Merchant:
+    """A player of the load test, sends the requests of a player and records their results by endpoint."""
+
+    def __init__(self, code, port, random_generator, polls):
+        self.code = code
+        self.client = Client(port)
+        self.random = random_generator
+        self.polls = polls
+        self.payback_paths = []
+        self.results = []
+
+    def call(self, endpoint, method, path, data=None):
+        result = self.client.request(method, path, data)
+        self.results.append((endpoint, result))
+        return result
+
+    def log_in(self):
+        result = self.call('token_obtain_pair', 'POST', API + 'token/', {'username': USERNAME, 'password': PASSWORD})
+        if result.status != 200:
+            raise CommandError("Logging in failed with {}: {}".format(result.status, result.content))
+        self.client.token = result.content['access']
+
+    def play_round(self, round_number, city_names, player_codes):
+        self.call('gamedata-list', 'GET', API + 'game-data/')
+        city_path = '{}cities/{}/'.format(API, self.random.choice(city_names))
+        rates = {}
+        for _ in range(self.polls):
+            rates = self.call('city-current-rates', 'GET', city_path + 'current_rates/').content or {}
+        player = self.call('player-detail', 'GET', '{}players/{}/'.format(API, self.code)).content or {}
+        money = player.get('money', 0)
+
+        for item_name, amount in player.get('items', {}).items():
+            if amount > 0 and rates.get(item_name, {}).get('sell_price') is not None:
+                result = self.call('city-sell', 'POST', city_path + 'sell/', {
+                    'player': self.code, 'item': item_name, 'amount': amount,
+                })
+                if result.status == 200:
+                    money += amount * rates[item_name]['sell_price']
+        buyable = sorted(item_name for item_name, rate in rates.items() if rate['buy_price'] is not None)
+        if buyable:
+            item_name = self.random.choice(buyable)
+            amount = min(money // rates[item_name]['buy_price'], self.random.randint(1, 5))
+            if amount > 0:
+                self.call('city-buy', 'POST', city_path + 'buy/', {
+                    'player': self.code, 'item': item_name, 'amount': amount,
+                })
+
+        if round_number <= 3 and self.random.random() < 0.5:
+            result = self.call('loan-list', 'POST', API + 'loans/', {'player': self.code, 'round': round_number})
+            if result.status == 201:
+                self.payback_paths.append(urlsplit(result.content['pay_back_loan']).path)
+        if round_number >= 4 and self.payback_paths:
+            self.call('loan-pay-back-loan', 'POST', self.payback_paths.pop())
+
+        other = self.random.choice([code for code in player_codes if code != self.code])
+        if self.random.random() < 0.3:
+            self.call('player-gift', 'POST', '{}players/{}/gift/'.format(API, self.code), {
+                'taker': other, 'money': self.random.randint(1, 10),
+            })
+        if self.random.random() < 0.05:
+            self.call('player-rob', 'POST', '{}players/{}/rob/'.format(API, self.code), {
+                'robbed': other, 'rob_money': True,
+            })
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays a full game against a local server: runs populate, creates players that log in, poll the rates, "
+        "trade, gift, rob and take and pay back loans in every round, then ends the game. "
+        "Reports the throughput, latency and queries of every endpoint. "
+        "Changes the game data and removes its players afterwards, don't run it on the database of a live game"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=20, help="Number of players playing in parallel")
+        parser.add_argument('--polls', type=int, default=5, help="Number of rate polls of a player in a round")
+        parser.add_argument('--workers', type=int, default=2, help="Number of server worker processes")
+        parser.add_argument('--port', type=int, default=8765, help="Local port of the server")
+        parser.add_argument('--asgi', action='store_true', help="Serve scout.asgi with uvicorn workers")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the decisions of the players")
+        parser.add_argument(
+            '--no-server-timing', action='store_true',
+            help="Serve without the Server-Timing header, the report leaves out the queries of the endpoints",
+        )
+
+    def handle(self, *args, **options):
+        if not 2 <= options['players'] <= 9999:
+            raise CommandError("The number of players should be between 2 and 9999")
+        gunicorn = shutil.which('gunicorn')
+        if gunicorn is None:
+            raise CommandError("gunicorn is not installed")
+        port = options['port']
+        if options['asgi']:
+            arguments = [gunicorn, 'scout.asgi', '-c', 'scout/gunicorn_asgi.py']
+        else:
+            arguments = [gunicorn, 'scout.wsgi']
+        arguments += ['--bind', '127.0.0.1:{}'.format(port), '--workers', str(options['workers'])]
+
+        call_command('populate', stdout=self.stdout)
+        # The game the server plays is the last GameData, like in game_clock
+        game_data = GameData.objects.last()
+        original_starting_time = game_data.starting_time if game_data else None
+        if game_data is None:
+            game_data = GameData.objects.create()
+        self._clean_up()
+        User.objects.create_user(USERNAME, password=PASSWORD, is_staff=True)
+        player_codes = ['{}{:04d}'.format(PLAYER_CODE_PREFIX, number) for number in range(options['players'])]
+        for code in player_codes:
+            Player(code=code).save()
+        city_names = list(City.objects.order_by('name').values_list('name', flat=True))
+        round_numbers = list(Round.objects.order_by('number').values_list('number', flat=True))
+        merchants = [
+            Merchant(code, port, random.Random('{}-{}'.format(options['seed'], code)), options['polls'])
+            for code in player_codes
+        ]
+
+        env = {'MERCHANT_GAME_CACHE_TTL': str(SERVER_CACHE_TTL)}
+        if not options['no_server_timing']:
+            # The query counts of the report are read from the Server-Timing header
+            env['MERCHANT_GAME_SERVER_TIMING'] = 'True'
+        try:
+            with local_server(arguments, port, env), ThreadPoolExecutor(max_workers=len(merchants)) as executor:
+                # The waits for the round switches are left out of the measured time
+                started = time.perf_counter()
+                list(executor.map(Merchant.log_in, merchants))
+                elapsed = time.perf_counter() - started
+                for round_number in round_numbers:
+                    self._start_round(game_data, round_number)
+                    started = time.perf_counter()
+                    list(executor.map(
+                        lambda merchant: merchant.play_round(round_number, city_names, player_codes), merchants
+                    ))
+                    elapsed += time.perf_counter() - started
+                started = time.perf_counter()
+                merchants[0].call('end', 'POST', API + 'end/')
+                elapsed += time.perf_counter() - started
+        except RuntimeError as ex:
+            raise CommandError(str(ex))
+        finally:
+            for merchant in merchants:
+                merchant.client.close()
+            self._clean_up()
+            if original_starting_time is None:
+                game_data.delete()
+            else:
+                GameData.objects.filter(pk=game_data.pk).update(starting_time=original_starting_time)
+
+        self._report([result for merchant in merchants for result in merchant.results], elapsed)
+
+    @staticmethod
+    def _clean_up():
+        Player.objects.filter(code__startswith=PLAYER_CODE_PREFIX).delete()
+        User.objects.filter(username=USERNAME).delete()
+
+    @staticmethod
+    def _start_round(game_data, round_number):
+        """Move the starting time of the game so the round has just started, then wait for the server to see it."""
+        starting_time = timezone.now() - timedelta(minutes=game_data.round_duration * (round_number - 1), seconds=1)
+        GameData.objects.filter(pk=game_data.pk).update(starting_time=starting_time)
+        time.sleep(SERVER_CACHE_TTL + 0.5)
+
+    def _report(self, results, elapsed):
+        results_by_endpoint = defaultdict(list)
+        for endpoint, result in results:
+            results_by_endpoint[endpoint].append(result)
+        self.stdout.write("requests: {}, seconds: {:.1f}, throughput: {:.1f} requests/s".format(
+            len(results), elapsed, len(results) / elapsed,
+        ))
+        for endpoint, endpoint_results in sorted(results_by_endpoint.items()):
+            queries = [result.queries for result in endpoint_results if result.queries is not None]
+            self.stdout.write(
+                "{:<20} requests: {:>5}, {:>7.1f}/s, rejected: {:>4}, errors: {:>3}, queries: {}, "
+                "latency ms: {}".format(
+                    endpoint,
+                    len(endpoint_results),
+                    len(endpoint_results) / elapsed,
+                    sum(1 for result in endpoint_results if result.status is not None and 400 <= result.status < 500),
+                    sum(1 for result in endpoint_results if result.status is None or result.status >= 500),
+                    "mean {:.1f}, max {}".format(sum(queries) / len(queries), max(queries)) if queries else "-",
+                    latency_summary([result.seconds for result in endpoint_results]),
+                )
+            )
+        errors = sum(1 for endpoint, result in results if result.status is None or result.status >= 500)
+        if errors and connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING("{} requests failed. {}".format(errors, SQLITE_LOCK_WARNING)))
+        elif errors:
+            raise CommandError("{} requests failed".format(errors))
+        else:
+            self.stdout.write(self.style.SUCCESS("Every request succeeded or was rejected by the game rules"))
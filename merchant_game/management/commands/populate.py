@@ -1,5 +1,8 @@
-from django.core.management.base import BaseCommand
-from merchant_game.models import City, ItemExchangeRate, Item, Round
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+from merchant_game import price_schedules
 
 STOCK_DATA = {
     "Budapest": {
@@ -255,36 +258,47 @@ STOCK_DATA = {
 }
 
 
+STOCK_ENDING_PRICES = {
+    "mercury": 16,
+    "sulfur": 20,
+    "crystal": 18,
+    "gem": 14,
+    "wood": 15,
+    "ore": 11,
+}
+
+
 class Command(BaseCommand):
-    help = "Populates the database with some basic data. Removes pre-existing data"
+    help = (
+        "Populates the database with the cities, items and exchange rates of a price schedule, the stock prices by "
+        "default. Removes pre-existing data"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--schedule',
+            help="CSV or JSON file of the prices. The CSV has a city, round, item, buy_price and sell_price column "
+                 "and an optional ending_price column, the JSON has the prices in the shape of STOCK_DATA under "
+                 "\"prices\" and the ending prices under \"ending_prices\". An empty price means not traded",
+        )
 
     def handle(self, *args, **options):
-        ItemExchangeRate.objects.all().delete()
-        City.objects.all().delete()
-        Item.objects.all().delete()
-        for city_name in ["Budapest", "Szeged", "Debrecen", "Sopron", "Eger"]:
-            city = City(name=city_name)
-            city.save()
-        for item_name, ending_price in zip(
-                ["mercury", "sulfur", "crystal", "gem", "wood", "ore"],
-                [16, 20, 18, 14, 15, 11],
-        ):
-            item = Item(name=item_name, ending_price=ending_price)
-            item.save()
-        if Round.objects.all().count() == 0:
-            for i in range(1, 7):
-                r = Round()
-                r.save()
-        for city in City.objects.all():
-            for r in Round.objects.order_by("number"):
-                for item in Item.objects.all():
-                    ier = ItemExchangeRate(
-                        city=city,
-                        round=r,
-                        item=item,
-                        buy_price=STOCK_DATA[city.name][r.number][item.name][0],
-                        sell_price=STOCK_DATA[city.name][r.number][item.name][1],
-                    )
-                    ier.save()
+        started = time.perf_counter()
+        try:
+            if options['schedule']:
+                schedule = price_schedules.load(options['schedule'])
+            else:
+                schedule = price_schedules.from_nested(STOCK_DATA, STOCK_ENDING_PRICES)
+            installed = price_schedules.install(schedule)
+        except (OSError, ValueError, IntegrityError) as ex:
+            raise CommandError("Populating failed: {}".format(ex))
 
-        self.stdout.write(self.style.SUCCESS("Successfully populated tables"))
+        self.stdout.write(self.style.SUCCESS(
+            "Successfully populated tables with {} cities, {} items, {} rounds and {} exchange rates in "
+            "{:.2f} s".format(
+                len(schedule.cities), len(schedule.items), schedule.rounds, installed, time.perf_counter() - started,
+            )
+        ))
+        warning = price_schedules.extra_rounds_warning(schedule)
+        if warning:
+            self.stdout.write(self.style.WARNING(warning))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from merchant_game.models import PlayerBalance
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the stored player balances from the ledger tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help="Only compare the stored balances with the ledger, fail if they differ",
+        )
+
+    def handle(self, *args, **options):
+        ledger_money = PlayerBalance.from_ledger()
+        stored_money = dict(PlayerBalance.objects.values_list('player', 'money'))
+        drifted = {
+            code: (stored_money.get(code), money)
+            for code, money in ledger_money.items()
+            if stored_money.get(code) != money
+        }
+        for code, (stored, money) in sorted(drifted.items()):
+            self.stdout.write("'{}' stored balance: {}, ledger: {}".format(code, stored, money))
+
+        if options['check']:
+            if drifted:
+                raise CommandError("{} player balances differ from the ledger".format(len(drifted)))
+            self.stdout.write(self.style.SUCCESS("All {} player balances match the ledger".format(len(ledger_money))))
+            return
+
+        PlayerBalance.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            "Successfully rebuilt {} player balances, {} were fixed".format(len(ledger_money), len(drifted))
+        ))
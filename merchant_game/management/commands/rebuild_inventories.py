@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from merchant_game.models import PlayerInventory
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the stored player inventories from the ledger tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help="Only compare the stored inventories with the ledger, fail if they differ",
+        )
+
+    def handle(self, *args, **options):
+        ledger_amounts = PlayerInventory.from_ledger()
+        stored_amounts = {
+            (code, item): amount
+            for code, item, amount in PlayerInventory.objects.values_list('player', 'item', 'amount')
+        }
+        drifted = {
+            key: (stored_amounts.get(key, 0), ledger_amounts.get(key, 0))
+            for key in set(ledger_amounts) | set(stored_amounts)
+            if stored_amounts.get(key, 0) != ledger_amounts.get(key, 0)
+        }
+        for (code, item), (stored, amount) in sorted(drifted.items()):
+            self.stdout.write("'{}' stored {}: {}, ledger: {}".format(code, item, stored, amount))
+
+        if options['check']:
+            if drifted:
+                raise CommandError("{} player inventory items differ from the ledger".format(len(drifted)))
+            self.stdout.write(self.style.SUCCESS(
+                "All {} player inventory items match the ledger".format(len(ledger_amounts))
+            ))
+            return
+
+        PlayerInventory.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            "Successfully rebuilt {} player inventory items, {} were fixed".format(len(ledger_amounts), len(drifted))
+        ))
@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from merchant_game.arbitrage import solve
+from merchant_game.exceptions import InvalidRequestException
+
+
+def _trades(traded):
+    return ', '.join(
+        "{} {} for {}".format(trade['amount'], item_name, trade['price']) for item_name, trade in traded.items()
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Finds a trading route of the market with the loans of the game data greedily and prints its rounds, its "
+        "score and the upper bound of the score of every route, to check the balance of the exchange rates before "
+        "a game"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--money', type=int, default=None, help="Starting money, the one of the players by default")
+
+    def handle(self, *args, **options):
+        if options['money'] is not None and options['money'] < 0:
+            raise CommandError("--money shouldn't be lower than 0")
+        started = time.perf_counter()
+        try:
+            route = solve(options['money'])
+        except InvalidRequestException as ex:
+            raise CommandError(ex.detail)
+        elapsed = time.perf_counter() - started
+
+        for step in route['rounds']:
+            actions = []
+            if step['loan']:
+                actions.append("loan {}".format(step['loan']))
+            if step['sold']:
+                actions.append("sell " + _trades(step['sold']))
+            if step['paid_back']:
+                actions.append("pay back {}".format(step['paid_back']))
+            if step['bought']:
+                actions.append("buy " + _trades(step['bought']))
+            self.stdout.write("Round {} in {}: {}, money {}".format(
+                step['round'], step.get('city', '-'), '; '.join(actions) or "hold", step['money'],
+            ))
+        self.stdout.write("Items at the end: {}, worth {}".format(
+            ', '.join("{} {}".format(amount, item_name) for item_name, amount in route['final_items'].items()) or "-",
+            route['items_value'],
+        ))
+        self.stdout.write("Loans paid back at the end: {}".format(route['loan_paybacks']))
+        self.stdout.write(self.style.SUCCESS(
+            "Route score from {} money: {}, no route scores more than {}, found in {:.2f} s".format(
+                route['starting_money'], route['route_score'], route['upper_bound'], elapsed,
+            )
+        ))
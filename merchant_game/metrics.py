@@ -0,0 +1,92 @@
+"""Prometheus metrics of the game and of the requests.
+
+Gunicorn forks several workers, so set the prometheus_multiproc_dir environment variable to an empty directory
+before starting it: every worker then writes its metrics there and /metrics adds up the metrics of all of them.
+Without it the metrics are kept in the memory of the process serving /metrics.
+"""
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+
+from .game_clock import get_game_clock
+
+TRADE_LABELS = ['city', 'item', 'round', 'action']
+
+TRADES = Counter('merchant_game_trades', "Executed buys and sells", TRADE_LABELS)
+TRADED_ITEMS = Counter('merchant_game_traded_items', "Items bought and sold", TRADE_LABELS)
+TRADED_MONEY = Counter('merchant_game_traded_money', "Money paid for bought and received for sold items", TRADE_LABELS)
+PLAYER_TRANSACTIONS = Counter('merchant_game_player_transactions', "Gifts and robberies between players", ['kind'])
+PLAYER_TRANSACTION_MONEY = Counter(
+    'merchant_game_player_transaction_money', "Money given or robbed between players", ['kind'],
+)
+PLAYER_TRANSACTION_ITEMS = Counter(
+    'merchant_game_player_transaction_items', "Items given or robbed between players", ['kind'],
+)
+LOANS_ISSUED = Counter('merchant_game_loans_issued', "Loans taken, by the round of the loan", ['round'])
+LOAN_MONEY_ISSUED = Counter('merchant_game_loan_money_issued', "Money lent, by the round of the loan", ['round'])
+LOANS_REPAID = Counter('merchant_game_loans_repaid', "Loans paid back, by the round of the payback", ['round'])
+LOAN_MONEY_REPAID = Counter(
+    'merchant_game_loan_money_repaid', "Money paid back with interest, by the round of the payback", ['round'],
+)
+REQUEST_DURATION = Histogram(
+    'merchant_game_request_duration_seconds', "Duration of the requests, by route name and method",
+    ['route', 'method'],
+    buckets=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+)
+
+
+def record_ledger_entries(entries):
+    """Count the trades, loans and paybacks among the created ledger entries."""
+    from .models import Loan, LoanPayback, Transaction
+    for entry in entries:
+        if isinstance(entry, Transaction):
+            rate = entry.cached_exchange_rate
+            labels = (rate.city_id, rate.item_id, rate.round_id, 'buy' if entry.item_amount >= 0 else 'sell')
+            TRADES.labels(*labels).inc()
+            TRADED_ITEMS.labels(*labels).inc(abs(entry.item_amount))
+            TRADED_MONEY.labels(*labels).inc(abs(entry.price))
+        elif isinstance(entry, Loan):
+            LOANS_ISSUED.labels(entry.round_id).inc()
+            LOAN_MONEY_ISSUED.labels(entry.round_id).inc(entry.amount)
+        elif isinstance(entry, LoanPayback):
+            LOANS_REPAID.labels(entry.round_id).inc()
+            LOAN_MONEY_REPAID.labels(entry.round_id).inc(entry.payback_amount)
+
+
+def record_player_transaction(kind, money, items):
+    """Count a gift or a robbery, items is a dict of item names and amounts."""
+    PLAYER_TRANSACTIONS.labels(kind).inc()
+    PLAYER_TRANSACTION_MONEY.labels(kind).inc(money)
+    PLAYER_TRANSACTION_ITEMS.labels(kind).inc(sum(items.values()))
+
+
+class GameCollector:
+    """Gauges of the game, read when the metrics are collected."""
+
+    def collect(self):
+        from .models import Player
+        players = GaugeMetricFamily('merchant_game_active_players', "Players in the game")
+        players.add_metric([], Player.objects.count())
+        yield players
+        clock = get_game_clock()
+        if clock is not None:
+            current_round = GaugeMetricFamily('merchant_game_current_round', "Round of the game being played")
+            current_round.add_metric([], clock.current_round)
+            yield current_round
+            remaining = GaugeMetricFamily(
+                'merchant_game_round_remaining_seconds', "Seconds left of the round being played",
+            )
+            remaining.add_metric([], clock.round_remaining_seconds)
+            yield remaining
+
+
+def generate_metrics():
+    """Return the content type and the text of the metrics of every worker."""
+    registry = CollectorRegistry()
+    registry.register(GameCollector())
+    if 'prometheus_multiproc_dir' in os.environ:
+        MultiProcessCollector(registry)
+        return CONTENT_TYPE_LATEST, generate_latest(registry)
+    return CONTENT_TYPE_LATEST, generate_latest(REGISTRY) + generate_latest(registry)
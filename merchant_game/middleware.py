@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from whitenoise.middleware import WhiteNoiseMiddleware as SyncWhiteNoiseMiddleware
+
+from . import metrics, timing
+
+
+def mark_as_coroutine_function(middleware):
+    """Mark the middleware instance as a coroutine function for Django, like MiddlewareMixin does, so the async
+    middleware chain awaits it instead of running it in a thread."""
+    middleware._is_coroutine = asyncio.coroutines._is_coroutine
+
+
+def _route_name(request):
+    resolver_match = getattr(request, 'resolver_match', None)
+    return resolver_match.url_name if resolver_match is not None and resolver_match.url_name else 'unresolved'
+
+
+class AsyncCapableMiddleware:
+    """Base of the middlewares that run on the event loop in ASGI mode, instead of in a thread like sync ones.
+
+    Subclasses implement `call` for the sync middleware chain and the coroutine `acall` for the async one.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            mark_as_coroutine_function(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+        return self.call(request)
+
+
+class RequestMetricsMiddleware(AsyncCapableMiddleware):
+    """Observes the duration of every request in the Prometheus histogram of its route."""
+
+    def call(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        metrics.REQUEST_DURATION.labels(_route_name(request), request.method).observe(time.perf_counter() - started)
+        return response
+
+    async def acall(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        metrics.REQUEST_DURATION.labels(_route_name(request), request.method).observe(time.perf_counter() - started)
+        return response
+
+
+class ServerTimingMiddleware(AsyncCapableMiddleware):
+    """Times every request and reports it in a Server-Timing header, turned on by MERCHANT_GAME_SERVER_TIMING.
+
+    The header has the queries and the SQL time, the serializer time, the view time and the total time. The timings
+    are also aggregated by route for the stats endpoint. Queries are counted on every connection, so the queries that
+    views run in other threads are included.
+    """
+
+    def __init__(self, get_response):
+        if not settings.MERCHANT_GAME_SERVER_TIMING:
+            raise MiddlewareNotUsed()
+        super(ServerTimingMiddleware, self).__init__(get_response)
+        connection_created.connect(timing.install_query_timer)
+        for connection in connections.all():
+            timing.install_query_timer(None, connection)
+        if self.is_async:
+            # A sync process_view would be run in a thread on every request
+            self.process_view = self._async_process_view
+
+    def call(self, request):
+        request_timing, token = timing.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            timing.finish_request(request_timing, token)
+        return self._report(request, response, request_timing)
+
+    async def acall(self, request):
+        request_timing, token = timing.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timing.finish_request(request_timing, token)
+        return self._report(request, response, request_timing)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timing.start_view()
+
+    async def _async_process_view(self, request, view_func, view_args, view_kwargs):
+        timing.start_view()
+
+    @staticmethod
+    def _report(request, response, request_timing):
+        timing.record(_route_name(request), request.method, request_timing)
+        response['Server-Timing'] = request_timing.server_timing()
+        return response
+
+
+class WhiteNoiseMiddleware(SyncWhiteNoiseMiddleware):
+    """WhiteNoise that can also run in an async middleware chain.
+
+    The WhiteNoise middleware is sync only, in ASGI mode Django would run every view behind it through a new event
+    loop thread. Finding a static file is a dictionary lookup, so it's done on the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super(WhiteNoiseMiddleware, self).__init__(get_response, *args, **kwargs)
+        if asyncio.iscoroutinefunction(get_response):
+            mark_as_coroutine_function(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return super(WhiteNoiseMiddleware, self).__call__(request)
+
+    async def __acall__(self, request):
+        response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
@@ -0,0 +1,40 @@
+# Generated by Django 3.1.4 on 2026-10-18 15:54
+
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_player_balances(apps, schema_editor):
+    Player = apps.get_model('merchant_game', 'Player')
+    PlayerBalance = apps.get_model('merchant_game', 'PlayerBalance')
+    money = {code: 1000 for code in Player.objects.values_list('code', flat=True)}
+    for model_name, player_field, amount_field, sign in (
+        ('Transaction', 'player', 'price', 1),
+        ('PlayerTransaction', 'giver', 'money', -1),
+        ('PlayerTransaction', 'taker', 'money', 1),
+        ('Loan', 'player', 'amount', 1),
+        ('LoanPayback', 'loan__player', 'payback_amount', -1),
+    ):
+        rows = apps.get_model('merchant_game', model_name).objects.values_list(player_field)
+        for code, amount in rows.annotate(Sum(amount_field)).order_by():
+            money[code] += sign * amount
+    PlayerBalance.objects.bulk_create(PlayerBalance(player_id=code, money=amount) for code, amount in money.items())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant_game', '0029_loanpayback'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerBalance',
+            fields=[
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='merchant_game.player')),
+                ('money', models.BigIntegerField(default=1000)),
+            ],
+        ),
+        migrations.RunPython(fill_player_balances, migrations.RunPython.noop),
+    ]
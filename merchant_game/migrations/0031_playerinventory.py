@@ -0,0 +1,48 @@
+# Generated by Django 3.1.4 on 2026-10-18 15:55
+
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_player_inventories(apps, schema_editor):
+    PlayerInventory = apps.get_model('merchant_game', 'PlayerInventory')
+    amounts = {}
+    for model_name, player_field, item_field, amount_field, sign in (
+        ('Transaction', 'player', 'exchange_rate__item', 'item_amount', 1),
+        ('PlayerTransactionItemAmount', 'transaction__giver', 'item', 'amount', -1),
+        ('PlayerTransactionItemAmount', 'transaction__taker', 'item', 'amount', 1),
+    ):
+        rows = apps.get_model('merchant_game', model_name).objects.values_list(player_field, item_field)
+        for code, item, amount in rows.annotate(Sum(amount_field)).order_by():
+            amounts[(code, item)] = amounts.get((code, item), 0) + sign * amount
+    PlayerInventory.objects.bulk_create(
+        PlayerInventory(player_id=code, item_id=item, amount=amount) for (code, item), amount in amounts.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant_game', '0030_playerbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerInventory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.BigIntegerField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='merchant_game.item')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory', to='merchant_game.player')),
+            ],
+            options={
+                'verbose_name_plural': 'Player inventories',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='playerinventory',
+            constraint=models.UniqueConstraint(fields=('player', 'item'), name='player_inventory_item'),
+        ),
+        migrations.RunPython(fill_player_inventories, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 3.1.4 on 2026-10-18 16:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def fill_ledger_events(apps, schema_editor):
+    """Append the events of the existing ledger rows. Their order across the tables is not known, the loans come
+    first and the paybacks last so no player is in debt of a loan that doesn't exist yet."""
+    LedgerEvent = apps.get_model('merchant_game', 'LedgerEvent')
+    events = []
+    for model_name, kind, player_field, money_field, item_field, amount_field, sign in (
+        ('Loan', 'loan', 'player', 'amount', None, None, 1),
+        ('Transaction', 'trade', 'player', 'price', 'exchange_rate__item', 'item_amount', 1),
+        ('PlayerTransaction', 'player_transaction', 'giver', 'money', None, None, -1),
+        ('PlayerTransaction', 'player_transaction', 'taker', 'money', None, None, 1),
+        ('PlayerTransactionItemAmount', 'player_transaction_item', 'transaction__giver', None, 'item', 'amount', -1),
+        ('PlayerTransactionItemAmount', 'player_transaction_item', 'transaction__taker', None, 'item', 'amount', 1),
+        ('LoanPayback', 'loan_payback', 'loan__player', 'payback_amount', None, None, -1),
+    ):
+        fields = [field for field in (money_field, item_field, amount_field) if field is not None]
+        for row in apps.get_model('merchant_game', model_name).objects.order_by('id').values('id', player_field, *fields):
+            money = sign * row[money_field] if money_field else 0
+            item_amount = sign * row[amount_field] if amount_field else 0
+            if money or item_amount:
+                events.append(LedgerEvent(
+                    kind=kind,
+                    entry_id=row['id'],
+                    player_id=row[player_field],
+                    money=money,
+                    item_id=row[item_field] if item_field else None,
+                    item_amount=item_amount,
+                ))
+    LedgerEvent.objects.bulk_create(events)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant_game', '0031_playerinventory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.BigIntegerField()),
+                ('money', models.BigIntegerField()),
+                ('items', models.JSONField(default=dict)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='merchant_game.player')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerEvent',
+            fields=[
+                ('sequence', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('trade', 'Trade'), ('player_transaction', 'Player transaction'), ('player_transaction_item', 'Player transaction item'), ('loan', 'Loan'), ('loan_payback', 'Loan payback')], max_length=30)),
+                ('entry_id', models.IntegerField(blank=True, null=True)),
+                ('money', models.BigIntegerField(default=0)),
+                ('item_amount', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='merchant_game.item')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='merchant_game.player')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='playersnapshot',
+            constraint=models.UniqueConstraint(fields=('player', 'sequence'), name='player_snapshot_sequence'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerevent',
+            index=models.Index(fields=['player', 'sequence'], name='ledger_event_player_sequence'),
+        ),
+        migrations.RunPython(fill_ledger_events, migrations.RunPython.noop),
+    ]
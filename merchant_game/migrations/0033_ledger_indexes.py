@@ -0,0 +1,83 @@
+# Generated by Django 3.1.4 on 2026-10-18 16:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant_game', '0032_ledgerevent_playersnapshot'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='itemexchangerate',
+            name='city_item_exchange',
+        ),
+        migrations.AlterField(
+            model_name='itemexchangerate',
+            name='city',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='rates', to='merchant_game.city'),
+        ),
+        migrations.AlterField(
+            model_name='ledgerevent',
+            name='player',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='events', to='merchant_game.player'),
+        ),
+        migrations.AlterField(
+            model_name='loan',
+            name='player',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='loans', to='merchant_game.player'),
+        ),
+        migrations.AlterField(
+            model_name='playerinventory',
+            name='player',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='inventory', to='merchant_game.player'),
+        ),
+        migrations.AlterField(
+            model_name='playersnapshot',
+            name='player',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='merchant_game.player'),
+        ),
+        migrations.AlterField(
+            model_name='playertransaction',
+            name='giver',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='giving_transactions', to='merchant_game.player'),
+        ),
+        migrations.AlterField(
+            model_name='playertransaction',
+            name='taker',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='taking_transactions', to='merchant_game.player'),
+        ),
+        migrations.AlterField(
+            model_name='playertransactionitemamount',
+            name='transaction',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='merchant_game.playertransaction'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='player',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='merchant_game.player'),
+        ),
+        migrations.AddIndex(
+            model_name='playertransaction',
+            index=models.Index(fields=['giver', 'money'], name='player_transaction_giver'),
+        ),
+        migrations.AddIndex(
+            model_name='playertransaction',
+            index=models.Index(fields=['taker', 'money'], name='player_transaction_taker'),
+        ),
+        migrations.AddIndex(
+            model_name='playertransactionitemamount',
+            index=models.Index(fields=['transaction', 'item', 'amount'], name='player_transaction_item'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['player', 'exchange_rate', 'item_amount', 'price'], name='transaction_player_ledger'),
+        ),
+        migrations.AddConstraint(
+            model_name='itemexchangerate',
+            constraint=models.UniqueConstraint(fields=('city', 'round', 'item'), name='city_item_exchange'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.4 on 2026-10-18 17:46
+
+from django.db import migrations, models
+
+
+def create_version(apps, schema_editor):
+    apps.get_model('merchant_game', 'ExchangeRateVersion').objects.create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant_game', '0033_ledger_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRateVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.4 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchant_game', '0034_exchangerateversion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledgerevent',
+            name='entry_id',
+            field=models.IntegerField(),
+        ),
+    ]
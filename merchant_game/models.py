@@ -1,7 +1,26 @@
-from django.db import models
-from django.db.models import Max, Sum
+from collections import Counter
+from functools import reduce
+from itertools import islice
+from operator import or_
+
+from django.conf import settings
+from django.db import connection, models
+from django.db.models import Case, Count, F, Max, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.deletion import Collector
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete
+from django.db.transaction import atomic, on_commit
+from django.dispatch import receiver
 from django.utils import timezone
 
+from . import game_clock, loans, metrics, rates
+
+STARTING_MONEY = 1000
+# Number of balance or inventory rows changed by a single UPDATE statement
+BULK_UPDATE_BATCH_SIZE = 100
+# Number of rows inserted by a single query when the ledger events are rebuilt
+BULK_INSERT_BATCH_SIZE = 1000
+
 
 class Item(models.Model):
     name = models.CharField(max_length=20, primary_key=True)
@@ -10,6 +29,9 @@ class Item(models.Model):
     def __str__(self):
         return "{}".format(self.name)
 
+    def delete(self, *args, **kwargs):
+        return delete_with_ledger([self])
+
 
 class Player(models.Model):
     code = models.CharField(max_length=6, primary_key=True, blank=False)
@@ -17,43 +39,485 @@ class Player(models.Model):
     def __str__(self):
         return "{}".format(self.code)
 
+    def save(self, *args, **kwargs):
+        with atomic():
+            super(Player, self).save(*args, **kwargs)
+            if not PlayerBalance.objects.filter(player=self).exists():
+                PlayerBalance.rebuild([self.code])
+
+    def delete(self, *args, **kwargs):
+        return delete_with_ledger([self])
+
     @property
     def money(self):
-        money = 1000
-        price_sum = self.transactions.values('price').aggregate(Sum('price'))['price__sum']
-        giving_sum = self.giving_transactions.values('money').aggregate(Sum('money'))['money__sum']
-        taking_sum = self.taking_transactions.values('money').aggregate(Sum('money'))['money__sum']
-        loans = self.loans.values('amount').aggregate(Sum('amount'))['amount__sum']
-        loan_paybacks = sum([loan.payback.payback_amount for loan in self.loans.all() if hasattr(loan, 'payback')])
-        money += price_sum if price_sum is not None else 0
-        money -= giving_sum if giving_sum is not None else 0
-        money += taking_sum if taking_sum is not None else 0
-        money += loans if loans is not None else 0
-        money -= loan_paybacks
+        money = PlayerBalance.objects.filter(player=self).values_list('money', flat=True).first()
+        if money is None:
+            money = PlayerBalance.rebuild([self.code])[self.code]
         return money
 
     @property
     def items(self):
-        traded_items = {
-            item['exchange_rate__item']: item['amount']
-            for item
-            in self.transactions.values('exchange_rate__item').annotate(amount=Sum('item_amount'))
-        }
-        given_items = {
-            item['items__item']: item['amount']
-            for item
-            in self.giving_transactions.values('items__item').annotate(amount=Sum('items__amount'))
-        }
-        received_items = {
-            item['items__item']: item['amount']
-            for item
-            in self.taking_transactions.values('items__item').annotate(amount=Sum('items__amount'))
-        }
-        return {
-            key: traded_items.get(key, 0) - given_items.get(key, 0) + received_items.get(key, 0)
-            for key
-            in set(traded_items) | set(given_items) | set(received_items) if key is not None
-        }
+        return {inventory.item_id: inventory.amount for inventory in self.inventory.all()}
+
+
+class PlayerBalance(models.Model):
+    player = models.OneToOneField(Player, on_delete=models.CASCADE, primary_key=True, related_name='balance')
+    money = models.BigIntegerField(default=STARTING_MONEY)
+
+    def __str__(self):
+        return "'{player}' has {money} money".format(player=self.player_id, money=self.money)
+
+    @staticmethod
+    def from_ledger(player_codes=None):
+        """Recompute the money of the players from the ledger tables, keyed by player code."""
+        players = Player.objects.all()
+        if player_codes is not None:
+            players = players.filter(code__in=player_codes)
+        money = {code: STARTING_MONEY for code in players.values_list('code', flat=True)}
+        for model, player_field, amount_field, sign in (
+            (Transaction, 'player', 'price', 1),
+            (PlayerTransaction, 'giver', 'money', -1),
+            (PlayerTransaction, 'taker', 'money', 1),
+            (Loan, 'player', 'amount', 1),
+            (LoanPayback, 'loan__player', 'payback_amount', -1),
+        ):
+            rows = model.objects.all()
+            if player_codes is not None:
+                rows = rows.filter(**{player_field + '__in': money})
+            for code, amount in rows.values_list(player_field).annotate(Sum(amount_field)).order_by():
+                money[code] += sign * amount
+        return money
+
+    @classmethod
+    def rebuild(cls, player_codes=None):
+        """Overwrite the stored balances with the ones derived from the ledger."""
+        money = cls.from_ledger(player_codes)
+        with atomic():
+            balances = cls.objects.all()
+            if player_codes is not None:
+                balances = balances.filter(player__in=money)
+            balances.delete()
+            cls.objects.bulk_create(cls(player_id=code, money=amount) for code, amount in money.items())
+        return money
+
+    @classmethod
+    def apply(cls, deltas):
+        """Add the money deltas, keyed by player code, to the stored balances.
+
+        Call it after the ledger rows are written: a player without a balance row gets it rebuilt from the ledger,
+        which already contains the change.
+        """
+        codes = [code for code, delta in deltas.items() if delta]
+        updated = 0
+        for start in range(0, len(codes), BULK_UPDATE_BATCH_SIZE):
+            batch = codes[start:start + BULK_UPDATE_BATCH_SIZE]
+            updated += cls.objects.filter(player__in=batch).update(money=F('money') + Case(
+                *(When(player=code, then=Value(deltas[code])) for code in batch),
+                output_field=models.BigIntegerField(),
+            ))
+        if updated < len(codes):
+            stored = set(cls.objects.filter(player__in=codes).values_list('player', flat=True))
+            cls.rebuild([code for code in codes if code not in stored])
+
+
+class PlayerInventory(models.Model):
+    # The player_inventory_item constraint indexes the player
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='inventory', db_index=False)
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    amount = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Player inventories"
+        constraints = [
+            models.UniqueConstraint(fields=["player", "item"], name="player_inventory_item")
+        ]
+
+    def __str__(self):
+        return "'{player}' has {amount} {item}".format(player=self.player_id, amount=self.amount, item=self.item_id)
+
+    @staticmethod
+    def from_ledger(player_codes=None):
+        """Recompute the items of the players from the ledger tables, keyed by (player code, item name)."""
+        amounts = Counter()
+        for model, player_field, item_field, amount_field, sign in (
+            (Transaction, 'player', 'exchange_rate__item', 'item_amount', 1),
+            (PlayerTransactionItemAmount, 'transaction__giver', 'item', 'amount', -1),
+            (PlayerTransactionItemAmount, 'transaction__taker', 'item', 'amount', 1),
+        ):
+            rows = model.objects.all()
+            if player_codes is not None:
+                rows = rows.filter(**{player_field + '__in': player_codes})
+            for code, item, amount in rows.values_list(player_field, item_field).annotate(Sum(amount_field)).order_by():
+                amounts[(code, item)] += sign * amount
+        return amounts
+
+    @classmethod
+    def rebuild(cls, player_codes=None):
+        """Overwrite the stored inventories with the ones derived from the ledger."""
+        amounts = cls.from_ledger(player_codes)
+        with atomic():
+            inventories = cls.objects.all()
+            if player_codes is not None:
+                inventories = inventories.filter(player__in=player_codes)
+            inventories.delete()
+            cls.objects.bulk_create(
+                cls(player_id=code, item_id=item, amount=amount) for (code, item), amount in amounts.items()
+            )
+        return amounts
+
+    @classmethod
+    def apply(cls, deltas):
+        """Add the item deltas, keyed by (player code, item name), to the stored inventories.
+
+        An item a player has no row of yet has an amount of 0, its row is inserted with the delta. Call it while the
+        balances of the players are locked, like LedgerEvent.apply does, so no other change inserts the same rows.
+        """
+        keys = [key for key, delta in deltas.items() if delta]
+        updated = 0
+        for start in range(0, len(keys), BULK_UPDATE_BATCH_SIZE):
+            batch = keys[start:start + BULK_UPDATE_BATCH_SIZE]
+            updated += cls.objects.filter(reduce(or_, (Q(player=code, item=item) for code, item in batch))).update(
+                amount=F('amount') + Case(
+                    *(When(player=code, item=item, then=Value(deltas[(code, item)])) for code, item in batch),
+                    output_field=models.BigIntegerField(),
+                )
+            )
+        if updated < len(keys):
+            codes = {code for code, item in keys}
+            stored = set(cls.objects.filter(player__in=codes).values_list('player', 'item'))
+            cls.objects.bulk_create(
+                cls(player_id=code, item_id=item, amount=deltas[(code, item)])
+                for code, item in keys if (code, item) not in stored
+            )
+
+
+class LedgerEvent(models.Model):
+    """An append-only record of how a ledger row changed the money and items of a player.
+
+    Saving a ledger row appends an event for every player and item it changes, editing or deleting it appends the
+    difference as another event of the same row, the events are never changed. The sequence numbers of the events
+    of a player follow the order their transactions commit, see apply().
+    """
+    TRADE = 'trade'
+    PLAYER_TRANSACTION = 'player_transaction'
+    PLAYER_TRANSACTION_ITEM = 'player_transaction_item'
+    LOAN = 'loan'
+    LOAN_PAYBACK = 'loan_payback'
+    KIND_CHOICES = [
+        (TRADE, "Trade"),
+        (PLAYER_TRANSACTION, "Player transaction"),
+        (PLAYER_TRANSACTION_ITEM, "Player transaction item"),
+        (LOAN, "Loan"),
+        (LOAN_PAYBACK, "Loan payback"),
+    ]
+
+    sequence = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    # The id of the ledger row in the table of its kind
+    entry_id = models.IntegerField()
+    # The ledger_event_player_sequence index indexes the player
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='events', db_index=False)
+    money = models.BigIntegerField(default=0)
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, blank=True, null=True)
+    item_amount = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["player", "sequence"], name="ledger_event_player_sequence")
+        ]
+
+    def __str__(self):
+        return "#{sequence} {kind} {entry_id}: '{player}' {money:+d} money, {item_amount:+d} {item}".format(
+            sequence=self.sequence,
+            kind=self.kind,
+            entry_id=self.entry_id,
+            player=self.player_id,
+            money=self.money,
+            item_amount=self.item_amount,
+            item=self.item_id,
+        )
+
+    @classmethod
+    def apply(cls, kind, changes):
+        """Apply the changes of ledger rows to the balances and inventories and append their events.
+
+        changes is a list of (ledger row id, money deltas, item deltas) triples, the deltas are keyed like the ones of
+        LedgerEntry. The balance rows of the players are locked first, in the order of the player codes like
+        trading.lock_balances does, so no other transaction can append events of the same players until this one
+        commits. Call it after the ledger rows are written.
+        """
+        money_deltas, item_deltas, events = Counter(), Counter(), []
+        for entry_id, entry_money_deltas, entry_item_deltas in changes:
+            money_deltas.update(entry_money_deltas)
+            item_deltas.update(entry_item_deltas)
+            entry_money = {code: delta for code, delta in entry_money_deltas.items() if delta}
+            for (code, item), amount in sorted(entry_item_deltas.items()):
+                if amount:
+                    events.append(cls(
+                        kind=kind, entry_id=entry_id, player_id=code, money=entry_money.pop(code, 0),
+                        item_id=item, item_amount=amount,
+                    ))
+            events.extend(
+                cls(kind=kind, entry_id=entry_id, player_id=code, money=amount)
+                for code, amount in sorted(entry_money.items())
+            )
+        if not events:
+            return []
+        player_codes = sorted({event.player_id for event in events})
+        locked = PlayerBalance.objects.select_for_update().filter(player__in=player_codes).order_by('player')
+        list(locked.values_list('player', flat=True))
+        PlayerBalance.apply(money_deltas)
+        PlayerInventory.apply(item_deltas)
+        events = cls.objects.bulk_create(events)
+        PlayerSnapshot.take_due(player_codes)
+        return events
+
+    @classmethod
+    def rebuild(cls):
+        """Replace every event with one event of every ledger row and drop the snapshots.
+
+        Only for resets that remove ledger rows without their events, like populate: the order of the rows across the
+        tables is not known, the loans come first and the paybacks last.
+        """
+        def events():
+            for model, kind, player_field, money_field, item_field, amount_field, sign in (
+                (Loan, cls.LOAN, 'player', 'amount', None, None, 1),
+                (Transaction, cls.TRADE, 'player', 'price', 'exchange_rate__item', 'item_amount', 1),
+                (PlayerTransaction, cls.PLAYER_TRANSACTION, 'giver', 'money', None, None, -1),
+                (PlayerTransaction, cls.PLAYER_TRANSACTION, 'taker', 'money', None, None, 1),
+                (PlayerTransactionItemAmount, cls.PLAYER_TRANSACTION_ITEM, 'transaction__giver', None, 'item', 'amount',
+                 -1),
+                (PlayerTransactionItemAmount, cls.PLAYER_TRANSACTION_ITEM, 'transaction__taker', None, 'item', 'amount',
+                 1),
+                (LoanPayback, cls.LOAN_PAYBACK, 'loan__player', 'payback_amount', None, None, -1),
+            ):
+                fields = [field for field in (money_field, item_field, amount_field) if field is not None]
+                for row in model.objects.order_by('id').values('id', player_field, *fields).iterator():
+                    money = sign * row[money_field] if money_field else 0
+                    item_amount = sign * row[amount_field] if amount_field else 0
+                    if money or item_amount:
+                        yield cls(
+                            kind=kind,
+                            entry_id=row['id'],
+                            player_id=row[player_field],
+                            money=money,
+                            item_id=row[item_field] if item_field else None,
+                            item_amount=item_amount,
+                        )
+
+        with atomic():
+            PlayerSnapshot.objects.all().delete()
+            cls.objects.all().delete()
+            rebuilt = events()
+            while True:
+                batch = list(islice(rebuilt, BULK_INSERT_BATCH_SIZE))
+                if not batch:
+                    break
+                cls.objects.bulk_create(batch)
+
+
+class PlayerSnapshot(models.Model):
+    """The money and items of a player right after the event with the sequence number.
+
+    A snapshot is taken every MERCHANT_GAME_SNAPSHOT_INTERVAL events of a player, so the state of a player at any
+    point is the latest snapshot before it plus a short scan of the events after the snapshot.
+    """
+    # The player_snapshot_sequence constraint indexes the player
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='snapshots', db_index=False)
+    sequence = models.BigIntegerField()
+    money = models.BigIntegerField()
+    items = models.JSONField(default=dict)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["player", "sequence"], name="player_snapshot_sequence")
+        ]
+
+    def __str__(self):
+        return "'{player}' after #{sequence}: {money} money and {items}".format(
+            player=self.player_id, sequence=self.sequence, money=self.money, items=self.items,
+        )
+
+    @classmethod
+    def take_due(cls, player_codes):
+        """Snapshot the players with at least MERCHANT_GAME_SNAPSHOT_INTERVAL events since their latest snapshot.
+
+        The snapshot is copied from the stored balance and inventory, call it while their rows are locked and
+        already contain the changes of the events.
+        """
+        latest = cls.objects.filter(player=OuterRef('player')).order_by('-sequence').values('sequence')[:1]
+        due = dict(
+            LedgerEvent.objects
+            .filter(player__in=player_codes, sequence__gt=Coalesce(Subquery(latest), Value(0)))
+            .values('player')
+            .annotate(events=Count('sequence'), last_sequence=Max('sequence'))
+            .filter(events__gte=settings.MERCHANT_GAME_SNAPSHOT_INTERVAL)
+            .values_list('player', 'last_sequence')
+        )
+        if not due:
+            return []
+        items = {code: {} for code in due}
+        inventories = PlayerInventory.objects.filter(player__in=due).values_list('player', 'item', 'amount')
+        for code, item, amount in inventories:
+            if amount:
+                items[code][item] = amount
+        return cls.objects.bulk_create(
+            cls(player_id=code, sequence=due[code], money=money, items=items[code])
+            for code, money in PlayerBalance.objects.filter(player__in=due).values_list('player', 'money')
+        )
+
+    @classmethod
+    def state(cls, player_code, sequence=None):
+        """Return the money and the items of the player right after the event with the sequence number, or now."""
+        snapshots = cls.objects.filter(player=player_code).order_by('-sequence')
+        events = LedgerEvent.objects.filter(player=player_code)
+        if sequence is not None:
+            snapshots = snapshots.filter(sequence__lte=sequence)
+            events = events.filter(sequence__lte=sequence)
+        snapshot = snapshots.first()
+        money, items = STARTING_MONEY, Counter()
+        if snapshot is not None:
+            money, items = snapshot.money, Counter(snapshot.items)
+            events = events.filter(sequence__gt=snapshot.sequence)
+        for event_money, item, item_amount in events.values_list('money', 'item', 'item_amount'):
+            money += event_money
+            if item is not None:
+                items[item] += item_amount
+        return money, {item: amount for item, amount in items.items() if amount}
+
+
+class LedgerEntry(models.Model):
+    """A row that moves money or items of players. Saving or deleting it keeps PlayerBalance and
+    PlayerInventory up to date and appends its LedgerEvent records.
+    """
+    # The kind of the LedgerEvent records of the row
+    event_kind = None
+
+    class Meta:
+        abstract = True
+
+    def money_deltas(self):
+        """Return how the row changes the money of the players, keyed by player code."""
+        return {}
+
+    def item_deltas(self):
+        """Return how the row changes the items of the players, keyed by (player code, item name)."""
+        return {}
+
+    def save(self, *args, **kwargs):
+        with atomic():
+            money_deltas, item_deltas = Counter(), Counter()
+            adding = self._state.adding
+            if not adding:
+                stored = type(self).objects.filter(pk=self.pk).first()
+                if stored is not None:
+                    money_deltas.subtract(stored.money_deltas())
+                    item_deltas.subtract(stored.item_deltas())
+            super(LedgerEntry, self).save(*args, **kwargs)
+            money_deltas.update(self.money_deltas())
+            item_deltas.update(self.item_deltas())
+            LedgerEvent.apply(self.event_kind, [(self.pk, money_deltas, item_deltas)])
+            if adding:
+                on_commit(lambda: metrics.record_ledger_entries([self]))
+
+    @classmethod
+    def insert_in_bulk(cls, entries):
+        """Insert the entries without applying their changes and return them with their ids.
+
+        A single query inserts them on databases that return the ids of bulk inserts, like PostgreSQL. On SQLite a
+        second query reads their ids back: it lets one transaction write at a time and its ids only grow, so the
+        entries have the last ids of the table until the transaction ends. Other databases insert them one by one.
+        Call it in a transaction.
+        """
+        if connection.features.can_return_rows_from_bulk_insert:
+            return cls.objects.bulk_create(entries)
+        entries = list(entries)
+        if not entries:
+            return entries
+        if connection.vendor == 'sqlite':
+            cls.objects.bulk_create(entries)
+            ids = list(cls.objects.order_by('-pk').values_list('pk', flat=True)[:len(entries)])
+            for entry, pk in zip(entries, reversed(ids)):
+                entry.pk = pk
+            return entries
+        for entry in entries:
+            # Skip the save() of the subclasses that fills the computed fields and of LedgerEntry that applies them
+            super(LedgerEntry, entry).save(force_insert=True)
+        return entries
+
+    @classmethod
+    def create_in_bulk(cls, entries):
+        """Insert the entries, see insert_in_bulk(), and apply their changes to the balances and inventories.
+
+        Unlike save(), it doesn't fill the computed fields, the entries have to be complete.
+        """
+        with atomic():
+            entries = cls.insert_in_bulk(entries)
+            LedgerEvent.apply(
+                cls.event_kind, [(entry.pk, entry.money_deltas(), entry.item_deltas()) for entry in entries],
+            )
+            on_commit(lambda: metrics.record_ledger_entries(entries))
+        return entries
+
+    def delete(self, *args, **kwargs):
+        return delete_with_ledger([self])
+
+
+def _collected_rows(collector):
+    """Yield the model and the rows of everything the collector deletes, the rows it deletes with a query too."""
+    for model, rows in collector.data.items():
+        yield model, rows
+    for queryset in collector.fast_deletes:
+        if queryset.model is LoanPayback:
+            queryset = queryset.select_related('loan')
+        elif queryset.model is PlayerTransactionItemAmount:
+            queryset = queryset.select_related('transaction')
+        yield queryset.model, queryset
+
+
+def delete_with_ledger(objects):
+    """Delete the objects and what they cascade to, and take the changes of the deleted ledger rows back from the
+    balances and inventories with their events. Returns what QuerySet.delete() returns.
+
+    The cascade is collected before anything is deleted, so the ledger rows the database deletes without their
+    delete(), like the payback of a deleted loan or the trades of a deleted exchange rate, are taken back too.
+    Deleting items deletes their events and inventories as well, so then the balances, inventories and events are
+    rebuilt from the ledger like after populate.
+    """
+    objects = list(objects)
+    if not objects:
+        return 0, {}
+    with atomic():
+        collector = Collector(using=objects[0]._state.db or 'default')
+        collector.collect(objects)
+        deleted_models = set(collector.data) | {queryset.model for queryset in collector.fast_deletes}
+        changes = {}
+        if Item not in deleted_models:
+            deleted_codes = {player.code for player in collector.data.get(Player, ())}
+            for model, rows in _collected_rows(collector):
+                if not issubclass(model, LedgerEntry):
+                    continue
+                for row in rows:
+                    # The items of a player transaction are collected as rows of their own
+                    item_deltas = row.item_deltas() if model is not PlayerTransaction else {}
+                    changes.setdefault(model.event_kind, []).append((
+                        row.pk,
+                        {code: -delta for code, delta in row.money_deltas().items() if code not in deleted_codes},
+                        {key: -delta for key, delta in item_deltas.items() if key[0] not in deleted_codes},
+                    ))
+        result = collector.delete()
+        if Item in deleted_models:
+            PlayerBalance.rebuild()
+            PlayerInventory.rebuild()
+            LedgerEvent.rebuild()
+        for kind, kind_changes in changes.items():
+            LedgerEvent.apply(kind, kind_changes)
+    if deleted_models & {Item, ItemExchangeRate}:
+        rates.invalidate()
+    if Round in deleted_models:
+        game_clock.invalidate()
+    return result
 
 
 class City(models.Model):
@@ -65,6 +529,9 @@ class City(models.Model):
     def __str__(self):
         return self.name
 
+    def delete(self, *args, **kwargs):
+        return delete_with_ledger([self])
+
 
 class Round(models.Model):
     number = models.AutoField(primary_key=True)
@@ -72,9 +539,17 @@ class Round(models.Model):
     def __str__(self):
         return "Round {}".format(self.number)
 
+    def save(self, *args, **kwargs):
+        super(Round, self).save(*args, **kwargs)
+        game_clock.invalidate()
+
+    def delete(self, *args, **kwargs):
+        return delete_with_ledger([self])
+
 
 class ItemExchangeRate(models.Model):
-    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='rates')
+    # The city_item_exchange constraint indexes the city, and the city and the round together
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='rates', db_index=False)
     round = models.ForeignKey(Round, on_delete=models.CASCADE)
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     buy_price = models.IntegerField(blank=True, null=True)
@@ -82,21 +557,48 @@ class ItemExchangeRate(models.Model):
 
     class Meta:
         constraints = [
-            models.UniqueConstraint(fields=["item", "city", "round"], name="city_item_exchange")
+            models.UniqueConstraint(fields=["city", "round", "item"], name="city_item_exchange")
         ]
 
     def __str__(self):
         return (
             "{city}, round: {round}, "
             "{item} buy_price={buy_price}, sell_price={sell_price}".format(
-                city=self.city.name,
-                round=self.round.number,
-                item=self.item.name,
+                city=self.city_id,
+                round=self.round_id,
+                item=self.item_id,
                 buy_price=self.buy_price,
                 sell_price=self.sell_price,
             )
         )
 
+    def save(self, *args, **kwargs):
+        super(ItemExchangeRate, self).save(*args, **kwargs)
+        rates.invalidate()
+
+    def delete(self, *args, **kwargs):
+        return delete_with_ledger([self])
+
+
+class ExchangeRateVersion(models.Model):
+    """The version of the exchange rates, a single row bumped by every change of the rates, see rates.invalidate().
+
+    The workers read it to know whether their rate matrix is still up to date, instead of reading every rate.
+    """
+    number = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return "Exchange rates version {}".format(self.number)
+
+
+class GameDataQuerySet(models.QuerySet):
+
+    def update(self, **kwargs):
+        """Update the rows and invalidate the game clock, like GameData.save does."""
+        result = super(GameDataQuerySet, self).update(**kwargs)
+        game_clock.invalidate()
+        return result
+
 
 class GameData(models.Model):
     starting_time = models.DateTimeField(default=timezone.now)
@@ -105,37 +607,41 @@ class GameData(models.Model):
     loan_increase = models.IntegerField(verbose_name="Loan increase in each round", default=100)
     loan_interest = models.IntegerField(verbose_name="Loan interest rate (%)", default=10)
 
+    objects = GameDataQuerySet.as_manager()
+
     @property
     def last_round(self):
-        return Round.objects.all().aggregate(Max('number'))['number__max']
+        return game_clock.get_last_round()
 
     @property
     def current_round(self):
-        return (
-            int(self._elapsed_time / self._round_duration_in_seconds) + 1
-            if self._elapsed_time <= self.last_round * self._round_duration_in_seconds
-            else self.last_round
-        )
+        return self.clock.current_round
 
     @property
     def round_remaining_seconds(self):
-        return (
-            self._round_duration_in_seconds - (
-                self._elapsed_time - self._round_duration_in_seconds * (self.current_round - 1)
-            )
-        )
+        return self.clock.round_remaining_seconds
 
     @property
-    def _elapsed_time(self):
-        return (timezone.now() - self.starting_time).total_seconds()
+    def clock(self):
+        return game_clock.GameClock(self, self.last_round)
+
+    def save(self, *args, **kwargs):
+        super(GameData, self).save(*args, **kwargs)
+        game_clock.invalidate()
 
-    @property
-    def _round_duration_in_seconds(self):
-        return self.round_duration * 60
 
+@receiver(post_delete, sender=GameData)
+def invalidate_game_clock(sender, **kwargs):
+    """Invalidate the game clock after a GameData is deleted, by GameData.delete or by a queryset like the bulk delete
+    of the admin."""
+    game_clock.invalidate()
 
-class Loan(models.Model):
-    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='loans')
+
+class Loan(LedgerEntry):
+    event_kind = LedgerEvent.LOAN
+
+    # The player_loan_round constraint indexes the player
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='loans', db_index=False)
     round = models.ForeignKey(Round, on_delete=models.CASCADE)
     amount = models.IntegerField(default=0, editable=False)
 
@@ -146,50 +652,77 @@ class Loan(models.Model):
 
     @property
     def get_amount(self):
-        game_data = GameData.objects.last()
-        return game_data.starting_loan + (self.round.number - 1) * game_data.loan_increase
+        return loans.get_loan_table().amount(self.round_id)
+
+    def money_deltas(self):
+        return {self.player_id: self.amount}
 
     def save(self, *args, **kwargs):
         self.amount = self.get_amount
         super(Loan, self).save(*args, **kwargs)
 
 
-class LoanPayback(models.Model):
+class LoanPayback(LedgerEntry):
+    event_kind = LedgerEvent.LOAN_PAYBACK
+
     loan = models.OneToOneField(Loan, on_delete=models.CASCADE, related_name='payback')
     payback_amount = models.IntegerField(default=0, editable=False)
     round = models.ForeignKey(Round, on_delete=models.CASCADE, editable=None)
 
+    def money_deltas(self):
+        return {self.loan.player_id: -self.payback_amount}
+
+    def set_payback_amount(self):
+        """Set the round to the current one and the payback amount to what paying back the loan costs in it."""
+        clock = game_clock.get_game_clock()
+        self.round_id = clock.current_round
+        self.payback_amount = loans.get_loan_table(clock).payback(self.loan.amount, self.loan.round_id, self.round_id)
+
     def save(self, *args, **kwargs):
-        game_data = GameData.objects.last()
-        self.round = Round.objects.get(number=game_data.current_round)
-        self.payback_amount = (
-                self.loan.amount +
-                (self.round.number - self.loan.round.number) * int(self.loan.amount * game_data.loan_interest / 100)
-        )
+        self.set_payback_amount()
         super(LoanPayback, self).save(*args, **kwargs)
 
 
-class Transaction(models.Model):
-    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='transactions')
+class Transaction(LedgerEntry):
+    event_kind = LedgerEvent.TRADE
+
+    # The transaction_player_ledger index indexes the player
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='transactions', db_index=False)
     exchange_rate = models.ForeignKey(ItemExchangeRate, on_delete=models.CASCADE, related_name='city_transactions')
     item_amount = models.BigIntegerField()
     price = models.BigIntegerField(editable=False)
 
+    class Meta:
+        indexes = [
+            # Covers the sums of the money and of the items of a player in PlayerBalance and PlayerInventory
+            models.Index(fields=["player", "exchange_rate", "item_amount", "price"], name="transaction_player_ledger")
+        ]
+
     @property
     def get_price(self):
         return -1 * self.item_amount * self.rate
 
     @property
     def rate(self):
-        return self.exchange_rate.buy_price if self.item_amount >= 0 else self.exchange_rate.sell_price
+        exchange_rate = self.cached_exchange_rate
+        return exchange_rate.buy_price if self.item_amount >= 0 else exchange_rate.sell_price
 
     @property
     def item(self):
-        return self.exchange_rate.item.name
+        return self.cached_exchange_rate.item_id
+
+    @property
+    def cached_exchange_rate(self):
+        """The exchange rate without a query: the related instance when it is loaded, otherwise the rate matrix."""
+        if not Transaction.exchange_rate.is_cached(self):
+            exchange_rate = rates.get_rate_matrix().get_by_id(self.exchange_rate_id)
+            if exchange_rate is not None:
+                return exchange_rate
+        return self.exchange_rate
 
     def __str__(self):
         return "'{player}' {action} {item_amount} {item} for {price} ({rate} per {item})".format(
-            player=self.player.code,
+            player=self.player_id,
             action="bought" if self.item_amount >= 0 else "sold",
             item_amount=self.item_amount,
             item=self.item,
@@ -197,16 +730,32 @@ class Transaction(models.Model):
             rate=self.rate,
         )
 
+    def money_deltas(self):
+        return {self.player_id: self.price}
+
+    def item_deltas(self):
+        return {(self.player_id, self.cached_exchange_rate.item_id): self.item_amount}
+
     def save(self, *args, **kwargs):
         self.price = self.get_price
         super(Transaction, self).save(*args, **kwargs)
 
 
-class PlayerTransaction(models.Model):
-    giver = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='giving_transactions')
-    taker = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='taking_transactions')
+class PlayerTransaction(LedgerEntry):
+    event_kind = LedgerEvent.PLAYER_TRANSACTION
+
+    # The player_transaction_giver and player_transaction_taker indexes index the players
+    giver = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='giving_transactions', db_index=False)
+    taker = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='taking_transactions', db_index=False)
     money = models.BigIntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # Cover the sums of the money given and taken by a player in PlayerBalance
+            models.Index(fields=["giver", "money"], name="player_transaction_giver"),
+            models.Index(fields=["taker", "money"], name="player_transaction_taker"),
+        ]
+
     def __str__(self):
         return "'{giver}' gave '{taker}' {money} money and {items}".format(
             giver=self.giver.code,
@@ -215,8 +764,58 @@ class PlayerTransaction(models.Model):
             items={item.item.name: item.amount for item in self.items.all()}
         )
 
+    def money_deltas(self):
+        deltas = Counter()
+        deltas[self.giver_id] -= self.money
+        deltas[self.taker_id] += self.money
+        return deltas
+
+    def item_deltas(self):
+        deltas = Counter()
+        for item in self.items.all():
+            deltas[(self.giver_id, item.item_id)] -= item.amount
+            deltas[(self.taker_id, item.item_id)] += item.amount
+        return deltas
+
+    @classmethod
+    def create_with_items(cls, giver, taker, money, items):
+        """Insert the transaction, then its items, a dict of item names and amounts, with a single query, and apply
+        them to the balances and inventories as one change with one set of ledger events.
+        """
+        with atomic():
+            transaction = cls(giver=giver, taker=taker, money=money)
+            # The items are applied together with the transaction below, skip LedgerEntry.save
+            super(LedgerEntry, transaction).save()
+            PlayerTransactionItemAmount.objects.bulk_create(
+                PlayerTransactionItemAmount(transaction=transaction, item_id=item_name, amount=amount)
+                for item_name, amount in items.items()
+            )
+            item_deltas = Counter()
+            for item_name, amount in items.items():
+                item_deltas[(giver.code, item_name)] -= amount
+                item_deltas[(taker.code, item_name)] += amount
+            LedgerEvent.apply(cls.event_kind, [(transaction.pk, transaction.money_deltas(), item_deltas)])
+        return transaction
+
+
+class PlayerTransactionItemAmount(LedgerEntry):
+    event_kind = LedgerEvent.PLAYER_TRANSACTION_ITEM
 
-class PlayerTransactionItemAmount(models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     amount = models.BigIntegerField(default=0)
-    transaction = models.ForeignKey(PlayerTransaction, on_delete=models.CASCADE, related_name='items')
+    # The player_transaction_item index indexes the transaction
+    transaction = models.ForeignKey(
+        PlayerTransaction, on_delete=models.CASCADE, related_name='items', db_index=False,
+    )
+
+    class Meta:
+        indexes = [
+            # Covers the sums of the items given and taken by a player in PlayerInventory
+            models.Index(fields=["transaction", "item", "amount"], name="player_transaction_item")
+        ]
+
+    def item_deltas(self):
+        return {
+            (self.transaction.giver_id, self.item_id): -self.amount,
+            (self.transaction.taker_id, self.item_id): self.amount,
+        }
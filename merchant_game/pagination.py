@@ -0,0 +1,11 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class LedgerPagination(CursorPagination):
+    """Pages of ledger rows in the order of their ids. The cursor points past the last row of a page, so the pages
+    stay stable while rows are added and a page costs the same however deep it is."""
+    ordering = 'id'
+    page_size = settings.MERCHANT_GAME_LEDGER_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,270 @@
+"""Price schedules: the cities, the items with their ending prices and the exchange rates of every round of a game.
+
+A schedule is loaded from a file by its extension, see LOADERS, or built in code, and written to the database by
+install(). The rates of a schedule are an iterable of Rate tuples that is read once, so they can be generated or read
+from a file lazily.
+"""
+import csv
+import json
+import os
+import random
+from collections import namedtuple
+from itertools import islice
+
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.transaction import atomic
+
+from . import game_clock, rates as rate_cache
+
+Rate = namedtuple('Rate', ['city', 'round', 'item', 'buy_price', 'sell_price'])
+
+# Number of exchange rates inserted by a single query
+INSERT_BATCH_SIZE = 1000
+
+
+class PriceSchedule:
+
+    def __init__(self, cities, items, rounds, rates):
+        """cities is a list of city names, items a dict of item names and ending prices (None for the default),
+        rounds the number of rounds and rates an iterable of Rate tuples."""
+        self.cities = cities
+        self.items = items
+        self.rounds = rounds
+        self.rates = rates
+
+
+def _price(value, description):
+    """Return the price in a file, None or an empty string means the item is not traded."""
+    if value is None or value == '':
+        return None
+    try:
+        price = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("{}: {!r} is not a price".format(description, value))
+    if price < 0:
+        raise ValueError("{}: the price can't be negative".format(description))
+    return price
+
+
+def check_rate(rate):
+    """Raise ValueError if the rate breaks the conventions of the game: items are sold for at most their buy price."""
+    if rate.round < 1:
+        raise ValueError("{} {}: the rounds start at 1".format(rate.city, rate.round))
+    if rate.buy_price is not None and rate.sell_price is not None and rate.sell_price > rate.buy_price:
+        raise ValueError("{} round {} {}: the sell price {} is higher than the buy price {}".format(
+            rate.city, rate.round, rate.item, rate.sell_price, rate.buy_price,
+        ))
+    return rate
+
+
+def from_nested(prices, ending_prices=None):
+    """Build a schedule from a dict of city names, round numbers, item names and (buy price, sell price) pairs, the
+    shape of STOCK_DATA in populate. Raise ValueError naming the city, round and item of a malformed entry."""
+    ending_prices = ending_prices or {}
+    if not isinstance(ending_prices, dict):
+        raise ValueError("The ending prices should be an object of item names and prices")
+    schedule_rates = []
+    items = {}
+    for city_name, rounds in prices.items():
+        if not isinstance(rounds, dict):
+            raise ValueError("{}: the prices should be an object of round numbers".format(city_name))
+        for round_number, round_prices in rounds.items():
+            try:
+                round_number = int(round_number)
+            except (TypeError, ValueError):
+                raise ValueError("{}: {!r} is not a round".format(city_name, round_number))
+            if not isinstance(round_prices, dict):
+                raise ValueError("{} round {}: the prices should be an object of item names".format(
+                    city_name, round_number,
+                ))
+            for item_name, pair in round_prices.items():
+                description = "{} round {} {}".format(city_name, round_number, item_name)
+                if not isinstance(pair, (list, tuple)) or len(pair) != 2:
+                    raise ValueError("{}: {!r} is not a [buy price, sell price] pair".format(description, pair))
+                buy_price, sell_price = pair
+                schedule_rates.append(check_rate(Rate(
+                    city_name,
+                    round_number,
+                    item_name,
+                    _price(buy_price, description),
+                    _price(sell_price, description),
+                )))
+                items.setdefault(item_name, _price(ending_prices.get(item_name), item_name))
+    return PriceSchedule(
+        list(prices),
+        items,
+        max((rate.round for rate in schedule_rates), default=0),
+        schedule_rates,
+    )
+
+
+def load_json(path):
+    """Load a JSON object with the prices in the shape of STOCK_DATA under "prices" and the ending prices of the
+    items under "ending_prices"."""
+    with open(path) as schedule_file:
+        data = json.load(schedule_file)
+    if not isinstance(data, dict) or not isinstance(data.get('prices'), dict):
+        raise ValueError("The JSON schedule has no \"prices\" object")
+    return from_nested(data['prices'], data.get('ending_prices'))
+
+
+CSV_COLUMNS = ['city', 'round', 'item', 'buy_price', 'sell_price']
+
+
+def _read_csv(path):
+    with open(path, newline='') as schedule_file:
+        reader = csv.DictReader(schedule_file)
+        missing = [column for column in CSV_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError("The CSV schedule has no {} column".format(', '.join(missing)))
+        for line_number, row in enumerate(reader, start=2):
+            description = "line {}".format(line_number)
+            try:
+                round_number = int(row['round'])
+            except (TypeError, ValueError):
+                raise ValueError("{}: {!r} is not a round".format(description, row['round']))
+            yield row, check_rate(Rate(
+                row['city'],
+                round_number,
+                row['item'],
+                _price(row['buy_price'], description),
+                _price(row['sell_price'], description),
+            ))
+
+
+def load_csv(path):
+    """Load a CSV file with a city, round, item, buy_price and sell_price column and a row for every rate. An empty
+    price means the item is not traded. An optional ending_price column sets the ending price of the item.
+
+    The file is read twice, first for the cities and the items, then for the rates while they are installed.
+    """
+    cities, items, rounds = {}, {}, 0
+    for row, rate in _read_csv(path):
+        cities.setdefault(rate.city, None)
+        ending_price = _price(row.get('ending_price'), rate.item)
+        if items.get(rate.item) is None:
+            items[rate.item] = ending_price
+        rounds = max(rounds, rate.round)
+    return PriceSchedule(list(cities), items, rounds, (rate for row, rate in _read_csv(path)))
+
+
+def generate(city_count, item_count, round_count, seed=0, not_traded=0.1):
+    """Generate a market with a seeded random generator, the rates are generated lazily while they are installed.
+
+    Every item has a base price, every city a price level, and the prices of an item in a city drift from round to
+    round. Items are sold for up to a quarter less than their buy price, buying and selling are not possible in a
+    city with the probability not_traded each. The ending price of an item is its base price.
+    """
+    random_generator = random.Random(seed)
+    cities = ['city{:05d}'.format(number) for number in range(1, city_count + 1)]
+    base_prices = {'item{:05d}'.format(number): random_generator.randint(5, 50) for number in range(1, item_count + 1)}
+    city_levels = [random_generator.uniform(0.7, 1.3) for _ in cities]
+
+    def generate_rates():
+        for city_name, city_level in zip(cities, city_levels):
+            trends = dict.fromkeys(base_prices, 1.0)
+            for round_number in range(1, round_count + 1):
+                for item_name, base_price in base_prices.items():
+                    trends[item_name] = min(2.0, max(0.5, trends[item_name] * random_generator.uniform(0.85, 1.15)))
+                    buy_price = max(1, round(base_price * city_level * trends[item_name]))
+                    sell_price = buy_price - random_generator.randint(0, buy_price // 4)
+                    yield Rate(
+                        city_name,
+                        round_number,
+                        item_name,
+                        None if random_generator.random() < not_traded else buy_price,
+                        None if random_generator.random() < not_traded else sell_price,
+                    )
+
+    return PriceSchedule(cities, base_prices, round_count, generate_rates())
+
+
+LOADERS = {
+    '.csv': load_csv,
+    '.json': load_json,
+}
+
+
+def load(path):
+    """Load the schedule with the loader of the file extension, raise ValueError for unknown extensions."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in LOADERS:
+        raise ValueError("Unknown schedule format {!r}, the known ones are {}".format(
+            extension, ', '.join(sorted(LOADERS)),
+        ))
+    return LOADERS[extension](path)
+
+
+def install(schedule, batch_size=INSERT_BATCH_SIZE):
+    """Replace the cities, items and exchange rates with the schedule in one transaction and return the number of
+    inserted rates.
+
+    Missing rounds are created, existing ones are kept. Removing the items removes the trades and the traded items
+    of the players too, so their balances, inventories and ledger events are rebuilt. The rates are
+    inserted in batches while they are read and the old ones are deleted in batches, so memory doesn't grow with
+    their number.
+    """
+    from .models import City, Item, ItemExchangeRate, LedgerEvent, PlayerBalance, PlayerInventory, Round
+    with atomic():
+        # Deleting loads the deleted rows to cascade, a batch at a time
+        while True:
+            rate_ids = list(ItemExchangeRate.objects.values_list('id', flat=True)[:batch_size])
+            if not rate_ids:
+                break
+            ItemExchangeRate.objects.filter(id__in=rate_ids).delete()
+        City.objects.all().delete()
+        Item.objects.all().delete()
+        City.objects.bulk_create(City(name=city_name) for city_name in schedule.cities)
+        Item.objects.bulk_create(
+            Item(name=item_name) if ending_price is None else Item(name=item_name, ending_price=ending_price)
+            for item_name, ending_price in schedule.items.items()
+        )
+        existing_rounds = set(Round.objects.values_list('number', flat=True))
+        Round.objects.bulk_create(
+            Round(number=number) for number in range(1, schedule.rounds + 1) if number not in existing_rounds
+        )
+        # Round numbers are set explicitly, move the sequence of the primary key past them
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Round]):
+                cursor.execute(sql)
+
+        installed = 0
+        exchange_rates = (
+            ItemExchangeRate(
+                city_id=rate.city,
+                round_id=rate.round,
+                item_id=rate.item,
+                buy_price=rate.buy_price,
+                sell_price=rate.sell_price,
+            )
+            for rate in schedule.rates
+        )
+        while True:
+            batch = list(islice(exchange_rates, batch_size))
+            if not batch:
+                break
+            ItemExchangeRate.objects.bulk_create(batch)
+            installed += len(batch)
+
+        PlayerBalance.rebuild()
+        PlayerInventory.rebuild()
+        LedgerEvent.rebuild()
+    # Bulk inserts skip the save() of the models that invalidates the caches
+    rate_cache.invalidate()
+    game_clock.invalidate()
+    return installed
+
+
+def extra_rounds_warning(schedule):
+    """Return the warning about the rounds after the last round of the installed schedule, or None if there are none.
+
+    install() keeps them, so the game goes on with rounds without rates.
+    """
+    from .models import Round
+    extra_rounds = Round.objects.filter(number__gt=schedule.rounds).count()
+    if not extra_rounds:
+        return None
+    return "{} rounds after the last round of the schedule are kept, the game lasts until the last one".format(
+        extra_rounds,
+    )
@@ -0,0 +1,94 @@
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.db.transaction import atomic
+
+# The primary key of the ExchangeRateVersion row
+VERSION_ID = 1
+
+_cache = {}
+
+
+class RateMatrix:
+    """Every exchange rate of the game in memory, keyed by (city name, round number, item name) and by id.
+
+    The version is the number of the ExchangeRateVersion row read before the rates, so every worker that loaded the
+    same rates has the same version.
+    """
+
+    def __init__(self, rates, version):
+        self.rates_by_id = {}
+        self.round_rates_by_city = {}
+        for rate in rates:
+            self.rates_by_id[rate.id] = rate
+            self.round_rates_by_city.setdefault((rate.city_id, rate.round_id), {})[rate.item_id] = rate
+        self.version = version
+        self.city_names = list(dict.fromkeys(city_name for city_name, round_number in self.round_rates_by_city))
+
+    def round_rates(self, city_name, round_number):
+        """Return the rates of the city in the round, keyed by item name."""
+        return self.round_rates_by_city.get((city_name, round_number), {})
+
+    def prices(self, round_number):
+        """Return the buy and sell prices of every city in the round, keyed by city name and item name."""
+        return {
+            city_name: {
+                item_name: {'buy_price': rate.buy_price, 'sell_price': rate.sell_price}
+                for item_name, rate in self.round_rates(city_name, round_number).items()
+            }
+            for city_name in self.city_names
+        }
+
+    def get(self, city_name, round_number, item_name):
+        """Return the rate, a rate added since the matrix was loaded is read from the database."""
+        from .models import ItemExchangeRate
+        try:
+            return self.round_rates_by_city[(city_name, round_number)][item_name]
+        except KeyError:
+            return ItemExchangeRate.objects.get(city=city_name, round=round_number, item=item_name)
+
+    def get_by_id(self, rate_id):
+        return self.rates_by_id.get(rate_id)
+
+
+def _stored_version():
+    from .models import ExchangeRateVersion
+    return ExchangeRateVersion.objects.filter(pk=VERSION_ID).values_list('number', flat=True).first() or 0
+
+
+def get_rate_matrix():
+    """Return the rate matrix of this worker, loading it on the first call.
+
+    Every MERCHANT_GAME_RATES_TTL seconds the version of the rates is read, a single row, and the rates are loaded
+    again only if another worker changed them since. The matrix serves the reads: the current rates, the prices of
+    the valuation and the solver, and the rates of the ledger rows. The trades read their rate rows while the balances
+    are locked instead, see trading.
+    """
+    from .models import ItemExchangeRate
+    matrix, expires = _cache.get('matrix', (None, 0))
+    if expires <= time.monotonic():
+        version = _stored_version()
+        if matrix is None or matrix.version != version:
+            matrix = RateMatrix(ItemExchangeRate.objects.order_by('id').iterator(), version)
+        _cache['matrix'] = (matrix, time.monotonic() + settings.MERCHANT_GAME_RATES_TTL)
+    return matrix
+
+
+def invalidate():
+    """Bump the version of the rates, so every worker loads them again, and drop the rate matrix of this worker.
+
+    Saving or deleting an ItemExchangeRate calls it, writes that skip them, like bulk inserts, have to call it too.
+    A database migrated back before the version table only has the matrix of this worker dropped.
+    """
+    from .models import ExchangeRateVersion
+    try:
+        # A savepoint, so a missing table doesn't break the transaction of the caller
+        with atomic():
+            if not ExchangeRateVersion.objects.filter(pk=VERSION_ID).update(number=F('number') + 1):
+                ExchangeRateVersion.objects.get_or_create(pk=VERSION_ID, defaults={'number': 1})
+    except DatabaseError:
+        if ExchangeRateVersion._meta.db_table in connection.introspection.table_names():
+            raise
+    _cache.clear()
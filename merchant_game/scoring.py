@@ -0,0 +1,58 @@
+from collections import defaultdict
+
+from django.db.models import F
+
+from .game_clock import get_game_clock
+from .loans import get_loan_table
+from .models import Item, Loan, Player
+
+
+def score_players():
+    """Return the final standing of every player in the shape of the End response.
+
+    The money comes from the stored balances, the items are valued at Item.ending_price and the loans that are not
+    paid back yet are deducted with their interest up to the current round, if there is a game. The whole computation
+    takes a fixed number of queries whatever the number of players and loans is.
+    """
+    final_prices = dict(Item.objects.values_list('name', 'ending_price'))
+    players = Player.objects.annotate(balance_money=F('balance__money')).prefetch_related('inventory')
+    loans_of_players = defaultdict(list)
+    for loan in Loan.objects.select_related('payback').order_by('id'):
+        loans_of_players[loan.player_id].append(loan)
+    clock = get_game_clock()
+    loan_table = get_loan_table(clock) if clock is not None else None
+
+    result = {"final_prices": final_prices}
+    for player in players:
+        money = player.balance_money if player.balance_money is not None else player.money
+        score = result[player.code] = {
+            'money': money,
+            'final_money': money,
+            'items': {},
+            'loans': {},
+            'paybacks': {},
+        }
+        for item_name, amount in player.items.items():
+            value = final_prices[item_name] * amount
+            score['items'][item_name] = {
+                'amount': amount,
+                'value': value,
+            }
+            score['final_money'] += value
+        for loan in loans_of_players[player.code]:
+            score['loans'][loan.round_id] = {
+                "loan_amount": loan.amount,
+            }
+            if hasattr(loan, 'payback'):
+                score['paybacks'][loan.round_id] = {
+                    "payback_amount": loan.payback.payback_amount,
+                }
+                score['loans'][loan.round_id]['paid_back'] = True
+            else:
+                score['loans'][loan.round_id]['paid_back'] = False
+                # Without the GameData there is no round to pay the loan back in, so nothing is deducted
+                if loan_table is not None:
+                    payback_amount = loan_table.payback(loan.amount, loan.round_id, clock.current_round)
+                    score['loans'][loan.round_id]['payback_amount'] = payback_amount
+                    score['final_money'] -= payback_amount
+    return result
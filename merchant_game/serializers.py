@@ -1,5 +1,7 @@
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 
+from . import timing, transfers
 from .models import (
     Player,
     City,
@@ -8,14 +10,24 @@ from .models import (
     Round,
     Transaction,
     PlayerTransaction,
-    PlayerTransactionItemAmount,
-    Item,
     LoanPayback,
     GameData,
 )
 
 
-class LoanSerializer(serializers.ModelSerializer):
+class TimedSerializerMixin:
+    """Counts the validation and the representation in the serializer time of the Server-Timing header."""
+
+    def is_valid(self, raise_exception=False):
+        with timing.serializing():
+            return super(TimedSerializerMixin, self).is_valid(raise_exception=raise_exception)
+
+    def to_representation(self, instance):
+        with timing.serializing():
+            return super(TimedSerializerMixin, self).to_representation(instance)
+
+
+class LoanSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     pay_back_loan = serializers.HyperlinkedIdentityField(view_name='loan-pay-back-loan')
 
     class Meta:
@@ -24,12 +36,12 @@ class LoanSerializer(serializers.ModelSerializer):
         read_only_fields = ['payback']
 
     def validate(self, attrs):
-        if len(Loan.objects.filter(player=attrs['player'], round=attrs['round'])):
+        if Loan.objects.filter(player=attrs['player'], round=attrs['round']).exists():
             raise serializers.ValidationError("The player has already took a loan in the given round")
         return attrs
 
 
-class LoanPaybackSerializer(serializers.ModelSerializer):
+class LoanPaybackSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = LoanPayback
         fields = ['url', 'loan', 'payback_amount', 'round']
@@ -38,6 +50,7 @@ class LoanPaybackSerializer(serializers.ModelSerializer):
 
 class PlayerTransactionItemAmountField(serializers.Field):
     default_error_messages = {
+        "not_a_dict": "Expected a dictionary of item names and amounts",
         "negative_value": "Value is too low. Ensure it is higher than 0",
     }
 
@@ -45,24 +58,18 @@ class PlayerTransactionItemAmountField(serializers.Field):
         return instance.items.all()
 
     def to_representation(self, value):
-        return {item.item.name: item.amount for item in value}
+        return {item.item_id: item.amount for item in value}
 
     def to_internal_value(self, data):
-        items = []
-        for item_name, amount in data.items():
-            if amount < 0:
+        if not isinstance(data, dict):
+            self.fail("not_a_dict")
+        for amount in data.values():
+            if isinstance(amount, int) and amount < 0:
                 self.fail("negative_value")
-            item = PlayerTransactionItemAmount(
-                item=Item.objects.get(name=item_name),
-                transaction=self.parent.instance,
-                amount=amount,
-            )
-            item.save()
-            items.append(item)
-        return items
+        return data
 
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = [
@@ -76,7 +83,7 @@ class TransactionSerializer(serializers.ModelSerializer):
         ]
 
 
-class PlayerTransactionSerializer(serializers.ModelSerializer):
+class PlayerTransactionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     items = PlayerTransactionItemAmountField()
 
     class Meta:
@@ -89,8 +96,35 @@ class PlayerTransactionSerializer(serializers.ModelSerializer):
             'items',
         ]
 
+    def create(self, validated_data):
+        # money has a model default, DRF leaves it out when it isn't sent
+        return transfers.give(
+            validated_data['giver'],
+            validated_data['taker'],
+            validated_data.get('money', 0),
+            validated_data.get('items', {}),
+        )
+
+
+class PlayerListSerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
+    money = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Player
+        fields = [
+            'url',
+            'code',
+            'money',
+            'items',
+        ]
+
+    def get_money(self, instance):
+        # PlayerViewSet annotates the stored balance, fall back to Player.money for other querysets
+        money = getattr(instance, 'balance_money', None)
+        return money if money is not None else instance.money
+
 
-class PlayerSerializer(serializers.HyperlinkedModelSerializer):
+class PlayerSerializer(PlayerListSerializer):
     rob = serializers.HyperlinkedIdentityField(view_name='player-rob')
     gift = serializers.HyperlinkedIdentityField(view_name='player-gift')
     paybacks = serializers.SerializerMethodField()
@@ -112,53 +146,43 @@ class PlayerSerializer(serializers.HyperlinkedModelSerializer):
         ]
 
     def get_paybacks(self, instance):
-        paybacks = []
-        for loan in instance.loans.all():
-            if hasattr(loan, 'payback'):
-                paybacks.append(LoanPaybackSerializer(context=self.context).to_representation(loan.payback)['url'])
-        return paybacks
-
-
-class PlayerListSerializer(serializers.HyperlinkedModelSerializer):
-    class Meta:
-        model = Player
-        fields = [
-            'url',
-            'code',
-            'money',
-            'items',
+        return [
+            reverse('loanpayback-detail', kwargs={'pk': loan.payback.pk}, request=self.context['request'])
+            for loan in instance.loans.all()
+            if hasattr(loan, 'payback')
         ]
 
 
-class ItemExchangeRateSerializer(serializers.ModelSerializer):
+class ItemExchangeRateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = ItemExchangeRate
         fields = ['buy_price', 'sell_price']
 
 
-class CitySerializer(serializers.ModelSerializer):
+class CitySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     current = serializers.HyperlinkedIdentityField(view_name='city-current-rates')
     buy = serializers.HyperlinkedIdentityField(view_name='city-buy')
     sell = serializers.HyperlinkedIdentityField(view_name='city-sell')
+    trade = serializers.HyperlinkedIdentityField(view_name='city-trade')
 
     class Meta:
         model = City
-        fields = ['name', 'current', 'buy', 'sell', 'rates']
+        fields = ['name', 'current', 'buy', 'sell', 'trade', 'rates']
         depth = 1
 
 
-class CityListSerializer(serializers.HyperlinkedModelSerializer):
+class CityListSerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = City
         fields = ['url', 'name']
 
 
-class RoundSerializer(serializers.ModelSerializer):
+class RoundSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Round
 
 
-class GameDataSerializer(serializers.ModelSerializer):
+class GameDataSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = GameData
         fields = [
@@ -0,0 +1,37 @@
+"""Streamed responses with async content in ASGI mode.
+
+The ASGI handler of Django iterates streamed responses synchronously in the event loop, where the content can't run
+queries. AsyncStreamingHttpResponse holds an async iterator instead, which StreamingASGIHandler awaits chunk by
+chunk, so the content can query the database through sync_to_async and memory doesn't grow with its size.
+"""
+from django.core.handlers.asgi import ASGIHandler
+from django.http import StreamingHttpResponse
+
+
+class AsyncStreamingHttpResponse(StreamingHttpResponse):
+    """A streamed response of an async iterator of strings or bytes, sent by StreamingASGIHandler.
+
+    Only returned in ASGI mode, the synchronous content of the response is empty.
+    """
+
+    def __init__(self, async_content, *args, **kwargs):
+        super(AsyncStreamingHttpResponse, self).__init__((), *args, **kwargs)
+        self.async_content = async_content
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """The ASGI handler of Django that also sends the content of AsyncStreamingHttpResponse."""
+
+    async def send_response(self, response, send):
+        if not isinstance(response, AsyncStreamingHttpResponse):
+            await super(StreamingASGIHandler, self).send_response(response, send)
+            return
+
+        async def send_with_content(message):
+            # The handler sends the headers and closes the empty synchronous body, the content goes in between
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                async for part in response.async_content:
+                    await send({'type': 'http.response.body', 'body': response.make_bytes(part), 'more_body': True})
+            await send(message)
+
+        await super(StreamingASGIHandler, self).send_response(response, send_with_content)
@@ -0,0 +1,132 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .game_clock import get_game_clock
+from .rates import get_rate_matrix
+
+# Events a slow client may lag behind before it misses ticks
+SUBSCRIBER_QUEUE_SIZE = 16
+
+
+def _format_event(event, data):
+    return "event: {}\ndata: {}\n\n".format(event, json.dumps(data)).encode()
+
+
+def _read_game_state():
+    """Return the clock and the rate matrix of the game. Runs in a worker thread as it may query the database."""
+    try:
+        return get_game_clock(), get_rate_matrix()
+    finally:
+        close_old_connections()
+
+
+class RoundClockBroadcaster:
+    """Pushes the round clock of the game to every connected client from one shared timer.
+
+    Every MERCHANT_GAME_STREAM_TICK seconds a `tick` event with the current round and the remaining seconds is sent.
+    When the round or the rates change, a `round` event with the rates of every city in the new round is sent
+    first. The timer only runs while there are clients connected.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.round_event = None
+        self.timer = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        if self.round_event is not None:
+            queue.put_nowait(self.round_event)
+        self.subscribers.add(queue)
+        if self.timer is None or self.timer.done():
+            self.timer = asyncio.ensure_future(self.run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event):
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass
+
+    async def run(self):
+        round_version = None
+        while self.subscribers:
+            clock, matrix = await sync_to_async(_read_game_state, thread_sensitive=True)()
+            if clock is not None:
+                current_round = clock.current_round
+                state = {
+                    'current_round': current_round,
+                    'last_round': clock.last_round,
+                    'round_remaining_seconds': clock.round_remaining_seconds,
+                }
+                if round_version != (current_round, matrix.version):
+                    round_version = (current_round, matrix.version)
+                    self.round_event = _format_event('round', dict(state, rates=matrix.prices(current_round)))
+                    self.publish(self.round_event)
+                self.publish(_format_event('tick', state))
+            await asyncio.sleep(settings.MERCHANT_GAME_STREAM_TICK)
+        self.round_event = None
+
+
+broadcaster = RoundClockBroadcaster()
+
+
+def _is_authenticated(scope):
+    """EventSource can't set headers, so the access token of the client is passed in the `token` query parameter."""
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token', [''])[0]
+    try:
+        AccessToken(token)
+    except TokenError:
+        return False
+    return True
+
+
+async def round_clock_stream(scope, receive, send):
+    """ASGI application streaming the events of the broadcaster as server-sent events."""
+    cors_headers = [(b'access-control-allow-origin', settings.MERCHANT_GAME_CLIENT_ADDRESS.encode())]
+    if not _is_authenticated(scope):
+        await send({
+            'type': 'http.response.start',
+            'status': 401,
+            'headers': [(b'content-type', b'application/json')] + cors_headers,
+        })
+        await send({'type': 'http.response.body', 'body': json.dumps({'error': 'Invalid or missing token'}).encode()})
+        return
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+        ] + cors_headers,
+    })
+    queue = broadcaster.subscribe()
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        while True:
+            next_event = asyncio.ensure_future(queue.get())
+            await asyncio.wait([next_event, disconnected], return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                next_event.cancel()
+                break
+            await send({'type': 'http.response.body', 'body': next_event.result(), 'more_body': True})
+    finally:
+        broadcaster.unsubscribe(queue)
+        disconnected.cancel()
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
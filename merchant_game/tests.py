@@ -1,3 +1,1128 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import async_views, game_clock, price_schedules, rates, streams, timing, transfers
+from .exceptions import InvalidRequestException, TradeException
+from .models import (
+    City,
+    ExchangeRateVersion,
+    GameData,
+    Item,
+    ItemExchangeRate,
+    LedgerEvent,
+    Loan,
+    LoanPayback,
+    Player,
+    PlayerBalance,
+    PlayerInventory,
+    PlayerSnapshot,
+    PlayerTransaction,
+    Round,
+    Transaction,
+)
+from .loans import settle_loans
+from .middleware import RequestMetricsMiddleware, WhiteNoiseMiddleware
+from .serializers import CitySerializer
+from .streaming import StreamingASGIHandler
+from .trading import execute_trade, execute_trades, lock_balances
+from .views import TransactionViewSet
+
+
+class GameTestCase(TestCase):
+    """A game of two cities, two items and three rounds in its third round, with three players."""
+
+    def setUp(self):
+        GameData.objects.create(starting_time=timezone.now() - timedelta(minutes=2 * 15 + 1))
+        for number in range(1, 4):
+            Round.objects.create(number=number)
+        self.cities = [City.objects.create(name=name) for name in ('Budapest', 'Eger')]
+        Item.objects.create(name='ore', ending_price=10)
+        Item.objects.create(name='gem', ending_price=30)
+        for city_factor, city in enumerate(self.cities, start=1):
+            for number in range(1, 4):
+                for item_name, base_price in (('ore', 5), ('gem', 20)):
+                    buy_price = base_price * city_factor + number
+                    ItemExchangeRate.objects.create(
+                        city=city, round_id=number, item_id=item_name, buy_price=buy_price, sell_price=buy_price - 1,
+                    )
+        self.players = []
+        for code in ('111111', '222222', '333333'):
+            player = Player(code=code)
+            player.save()
+            self.players.append(player)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    @staticmethod
+    def rate(city_name, round_number, item_name):
+        return ItemExchangeRate.objects.get(city=city_name, round=round_number, item=item_name)
+
+    def assertLedgerConsistent(self):
+        """The stored balances, inventories and ledger events all agree with the ledger tables."""
+        money = PlayerBalance.from_ledger()
+        items = {key: amount for key, amount in PlayerInventory.from_ledger().items() if amount}
+        self.assertEqual(dict(PlayerBalance.objects.values_list('player', 'money')), money)
+        self.assertEqual(
+            {(code, item): amount for code, item, amount in
+             PlayerInventory.objects.exclude(amount=0).values_list('player', 'item', 'amount')},
+            items,
+        )
+        for code in money:
+            self.assertEqual(
+                PlayerSnapshot.state(code),
+                (money[code], {item: amount for (player, item), amount in items.items() if player == code}),
+            )
+
+
+class LedgerConsistencyTests(GameTestCase):
+
+    def test_trades(self):
+        player = self.players[0]
+        execute_trade(player, self.rate('Budapest', 1, 'ore'), 10)
+        execute_trade(player, self.rate('Eger', 2, 'ore'), -4)
+        execute_trade(player, self.rate('Eger', 3, 'gem'), 2)
+        self.assertEqual(player.money, 1000 - 10 * 6 + 4 * 11 - 2 * 43)
+        self.assertEqual(player.items, {'ore': 6, 'gem': 2})
+        self.assertLedgerConsistent()
+
+    def test_paying_back_more_than_the_money(self):
+        player, other = self.players[:2]
+        loan = Loan(player=player, round_id=1)
+        loan.save()
+        transfers.give(player, other, 1000, {})
+        url = '/merchant_game/api/loans/{}/pay_back_loan/'.format(loan.pk)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(LoanPayback.objects.exists())
+        self.assertEqual(player.money, 500)
+        transfers.give(other, player, 100, {})
+        self.assertEqual(self.client.post(url).status_code, 200)
+        self.assertEqual(self.client.post(url).status_code, 409)
+        self.assertEqual(player.money, 0)
+        self.assertLedgerConsistent()
+
+    def test_deletes(self):
+        player, other = self.players[:2]
+        trade = execute_trade(player, self.rate('Budapest', 1, 'ore'), 10)
+        execute_trade(player, self.rate('Eger', 1, 'ore'), 10)
+        execute_trade(other, self.rate('Eger', 1, 'ore'), 3)
+        gift = transfers.give(player, other, 50, {'ore': 5})
+        loan = Loan(player=player, round_id=1)
+        loan.save()
+        LoanPayback(loan=loan).save()
+
+        trade.delete()
+        self.assertLedgerConsistent()
+        # The payback, the items of the gift and the trades of the rate are deleted by the cascade
+        loan.delete()
+        self.assertLedgerConsistent()
+        gift.delete()
+        self.assertLedgerConsistent()
+        self.rate('Eger', 1, 'ore').delete()
+        self.assertLedgerConsistent()
+        self.assertEqual(player.money, 1000)
+        self.assertEqual(other.money, 1000)
+        self.assertFalse(Transaction.objects.exists())
+
+
+class RebuildCommandTests(GameTestCase):
+
+    def test_rebuild_balances(self):
+        execute_trade(self.players[0], self.rate('Budapest', 1, 'ore'), 10)
+        PlayerBalance.objects.filter(player=self.players[0]).update(money=5)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', '--check', stdout=StringIO())
+        output = StringIO()
+        call_command('rebuild_balances', stdout=output)
+        self.assertIn("1 were fixed", output.getvalue())
+        self.assertEqual(self.players[0].money, 1000 - 10 * 6)
+        call_command('rebuild_balances', '--check', stdout=StringIO())
+
+    def test_rebuild_inventories(self):
+        execute_trade(self.players[0], self.rate('Budapest', 1, 'ore'), 10)
+        PlayerInventory.objects.filter(player=self.players[0]).delete()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_inventories', '--check', stdout=StringIO())
+        call_command('rebuild_inventories', stdout=StringIO())
+        self.assertEqual(self.players[0].items, {'ore': 10})
+        call_command('rebuild_inventories', '--check', stdout=StringIO())
+
+
+class TradeTests(GameTestCase):
+
+    def test_buying_more_than_the_money(self):
+        with self.assertRaises(TradeException):
+            execute_trade(self.players[0], self.rate('Budapest', 1, 'gem'), 50)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(self.players[0].money, 1000)
+
+    def test_selling_more_than_the_items(self):
+        execute_trade(self.players[0], self.rate('Budapest', 1, 'ore'), 2)
+        with self.assertRaises(TradeException):
+            execute_trade(self.players[0], self.rate('Budapest', 1, 'ore'), -3)
+        self.assertEqual(self.players[0].items, {'ore': 2})
+
+    def test_buy_and_sell_actions(self):
+        url = '/merchant_game/api/cities/Budapest/{}/'
+        response = self.client.post(url.format('buy'), {'player': '111111', 'item': 'gem', 'amount': 40}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['transaction']['price'], -40 * 23)
+        response = self.client.post(url.format('buy'), {'player': '111111', 'item': 'gem', 'amount': 4}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'error': "Not enough money"})
+        response = self.client.post(
+            url.format('sell'), {'player': '111111', 'item': 'gem', 'amount': 41}, format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url.format('sell'), {'player': '111111', 'item': 'gem', 'amount': 0}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            url.format('sell'), {'player': '111111', 'item': 'gem', 'amount': 40}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.players[0].money, 1000 - 40 * 23 + 40 * 22)
+        self.assertLedgerConsistent()
+
+    def test_locking_missing_and_unknown_balances(self):
+        PlayerBalance.objects.filter(player=self.players[0]).delete()
+        self.assertEqual(lock_balances(['111111', '222222']), {'111111': 1000, '222222': 1000})
+        with self.assertRaises(InvalidRequestException):
+            lock_balances(['111111', '999999'])
+
+
+class TradeBatchTests(GameTestCase):
+
+    def test_lines_are_applied_in_order(self):
+        player = self.players[0]
+        execute_trade(player, self.rate('Budapest', 1, 'ore'), 10)
+        transactions, errors = execute_trades(player, self.cities[1], 3, [('gem', 2), ('ore', -6), ('ore', -4)])
+        self.assertEqual(errors, [None, None, None])
+        self.assertEqual(player.money, 1000 - 10 * 6 - 2 * 43 + 10 * 12)
+        self.assertEqual(player.items, {'ore': 0, 'gem': 2})
+        self.assertLedgerConsistent()
+
+    def test_lines_see_the_previous_lines(self):
+        transactions, errors = execute_trades(self.players[0], self.cities[0], 1, [('gem', 45), ('ore', 10)])
+        self.assertEqual(transactions, [])
+        self.assertEqual(errors, [None, "Not enough money"])
+        self.assertFalse(Transaction.objects.exists())
+        self.assertLedgerConsistent()
+
+    def test_inserted_trades_have_their_ids(self):
+        execute_trade(self.players[1], self.rate('Eger', 3, 'ore'), 1)
+        transactions, errors = execute_trades(self.players[0], self.cities[1], 3, [('gem', 2), ('ore', 3)])
+        stored = Transaction.objects.filter(player=self.players[0]).order_by('id')
+        self.assertEqual(
+            [(transaction.pk, transaction.item, transaction.item_amount) for transaction in transactions],
+            [(transaction.pk, transaction.item, transaction.item_amount) for transaction in stored],
+        )
+        self.assertEqual(
+            set(LedgerEvent.objects.filter(kind=LedgerEvent.TRADE, player=self.players[0]).values_list('entry_id')),
+            {(transaction.pk,) for transaction in transactions},
+        )
+
+    def test_queries_dont_grow_with_the_lines(self):
+        def count_queries(player, lines):
+            with CaptureQueriesContext(connection) as queries:
+                transactions, errors = execute_trades(player, self.cities[0], 3, lines)
+            self.assertEqual(len(transactions), len(lines))
+            return len(queries)
+
+        self.assertEqual(
+            count_queries(self.players[0], [('ore', 1)]),
+            count_queries(self.players[1], [('ore', 1), ('gem', 1), ('ore', 2), ('gem', 2), ('ore', 3)]),
+        )
+
+    def test_trade_action(self):
+        url = '/merchant_game/api/cities/Eger/trade/'
+        response = self.client.post(url, {'player': '111111', 'lines': [
+            {'action': 'buy', 'item': 'ore', 'amount': 5},
+            {'action': 'sell', 'item': 'ore', 'amount': 2},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [line['transaction']['price'] for line in response.data['lines']], [-5 * 13, 2 * 12],
+        )
+        response = self.client.post(url, {'player': '111111', 'lines': [
+            {'action': 'sell', 'item': 'ore', 'amount': 3},
+            {'action': 'sell', 'item': 'ore', 'amount': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['lines'], [{'status': 'valid'}, {'error': "Not enough item"}])
+        self.assertEqual(self.players[0].items, {'ore': 3})
+
+    def test_invalid_lines(self):
+        url = '/merchant_game/api/cities/Eger/trade/'
+        for line in (
+            {'action': 'buy', 'item': ['ore'], 'amount': 1},
+            {'action': 'buy', 'item': {'ore': 1}, 'amount': 1},
+            {'action': 'buy', 'item': 'ore', 'amount': 0},
+            {'action': 'buy', 'item': 'ore', 'amount': '1'},
+            {'action': 'give', 'item': 'ore', 'amount': 1},
+            ['ore', 1],
+        ):
+            response = self.client.post(url, {'player': '111111', 'lines': [line]}, format='json')
+            self.assertEqual(response.status_code, 400, line)
+        response = self.client.post(
+            '/merchant_game/api/cities/Eger/buy/', {'player': '111111', 'item': ['ore'], 'amount': 1}, format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Transaction.objects.exists())
+
+
+class TransferTests(GameTestCase):
+
+    def test_gift_and_rob(self):
+        giver, taker, robber = self.players
+        execute_trade(giver, self.rate('Budapest', 1, 'gem'), 3)
+        transfers.give(giver, taker, 100, {'gem': 2})
+        transfers.rob(robber, taker, True)
+        transfers.rob(robber, giver, False)
+        self.assertEqual(taker.money, 0)
+        self.assertEqual(robber.money, 2100)
+        self.assertEqual(robber.items, {'gem': 1})
+        self.assertEqual(taker.items, {'gem': 2})
+        self.assertLedgerConsistent()
+
+    def test_giving_more_than_the_giver_has(self):
+        giver, taker = self.players[:2]
+        with self.assertRaises(InvalidRequestException):
+            transfers.give(giver, taker, 1001, {})
+        with self.assertRaises(InvalidRequestException):
+            transfers.give(giver, taker, 0, {'ore': 1})
+        response = self.client.post('/merchant_game/api/player-transactions/', {
+            'giver': giver.code, 'taker': taker.code, 'money': 2000, 'items': {},
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PlayerTransaction.objects.exists())
+        self.assertEqual(giver.money, 1000)
+
+    def test_gift_and_rob_actions(self):
+        giver, taker = self.players[:2]
+        execute_trade(giver, self.rate('Budapest', 3, 'ore'), 2)
+        response = self.client.post(
+            '/merchant_game/api/players/{}/gift/'.format(giver.code), {'taker': taker.code, 'items': {'ore': 1}},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['player_transaction']['money'], 0)
+        response = self.client.post(
+            '/merchant_game/api/players/{}/rob/'.format(taker.code), {'robbed': giver.code, 'rob_money': False},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(taker.items, {'ore': 2})
+        response = self.client.post(
+            '/merchant_game/api/players/{}/gift/'.format(giver.code), {'taker': taker.code, 'money': 5000},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertLedgerConsistent()
+
+
+class RateMatrixTests(GameTestCase):
+
+    @override_settings(MERCHANT_GAME_RATES_TTL=0)
+    def test_reloaded_only_when_the_version_changes(self):
+        matrix = rates.get_rate_matrix()
+        self.assertEqual(matrix.get('Eger', 2, 'gem').buy_price, 42)
+        # Another worker changes the rate and bumps the version, this one only checks the version
+        ItemExchangeRate.objects.filter(city='Eger', round=2, item='gem').update(buy_price=50)
+        with self.assertNumQueries(1):
+            self.assertIs(rates.get_rate_matrix(), matrix)
+        ExchangeRateVersion.objects.update(number=F('number') + 1)
+        reloaded = rates.get_rate_matrix()
+        self.assertNotEqual(reloaded.version, matrix.version)
+        self.assertEqual(reloaded.get('Eger', 2, 'gem').buy_price, 50)
+
+    def test_saving_a_rate_bumps_the_version(self):
+        version = rates.get_rate_matrix().version
+        rate = self.rate('Budapest', 1, 'ore')
+        rate.sell_price = 2
+        rate.save()
+        matrix = rates.get_rate_matrix()
+        self.assertNotEqual(matrix.version, version)
+        self.assertEqual(matrix.get('Budapest', 1, 'ore').sell_price, 2)
+
+    def test_invalidate_without_the_version_table(self):
+        rates.get_rate_matrix()
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE {}'.format(ExchangeRateVersion._meta.db_table))
+        rates.invalidate()
+        self.assertFalse(rates._cache)
+
+    def test_ledger_rows_read_their_rates_from_the_matrix(self):
+        execute_trade(self.players[0], self.rate('Budapest', 1, 'ore'), 2)
+        rates.get_rate_matrix()
+        transaction = Transaction.objects.get()
+        with self.assertNumQueries(0):
+            self.assertEqual((transaction.item, transaction.rate), ('ore', 6))
+
+
+class AllCurrentRatesTests(GameTestCase):
+    url = '/merchant_game/api/cities/current_rates/'
+
+    def test_rates_of_every_city(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['Eger']['gem'], {'buy_price': 43, 'sell_price': 42})
+        self.assertEqual(set(response.data), {'Budapest', 'Eger'})
+        max_age = int(response['Cache-Control'].split('max-age=')[1].split(',')[0])
+        self.assertTrue(0 < max_age <= 15 * 60 - 60)
+
+    def test_unchanged_rates_answer_304(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        rate = self.rate('Eger', 3, 'gem')
+        rate.buy_price = 50
+        rate.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['Eger']['gem']['buy_price'], 50)
+
+    def test_next_round_changes_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        GameData.objects.update(starting_time=timezone.now() - timedelta(minutes=15 + 1))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['Eger']['gem'], {'buy_price': 42, 'sell_price': 41})
+
+
+@override_settings(MERCHANT_GAME_CACHE_TTL=60)
+class GameClockTests(GameTestCase):
+
+    def test_cached_within_the_ttl(self):
+        game_clock.get_game_clock()
+        with self.assertNumQueries(0):
+            clock = game_clock.get_game_clock()
+        self.assertEqual((clock.current_round, clock.last_round), (3, 3))
+
+    def test_game_data_writes_invalidate_the_clock(self):
+        game_data = game_clock.get_game_clock().game_data
+        game_data.round_duration = 20
+        game_data.save()
+        self.assertEqual(game_clock.get_game_clock().game_data.round_duration, 20)
+        GameData.objects.update(round_duration=30)
+        self.assertEqual(game_clock.get_game_clock().game_data.round_duration, 30)
+        Round.objects.create(number=4)
+        self.assertEqual(game_clock.get_game_clock().last_round, 4)
+        game_clock.get_game_clock().game_data.delete()
+        self.assertIsNone(game_clock.get_game_clock())
+
+
+@override_settings(MERCHANT_GAME_STREAM_TICK=0.01)
+class RoundClockStreamTests(GameTestCase):
+
+    def stream(self, query_string, events):
+        """Connect to the stream and disconnect after the number of events, return the sent messages."""
+        messages = []
+        received_events = asyncio.Event()
+
+        async def receive():
+            await received_events.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+            if sum(1 for message in messages if message.get('more_body')) >= events:
+                received_events.set()
+
+        async def stream():
+            scope = {'type': 'http', 'path': '/merchant_game/api/stream/', 'query_string': query_string}
+            await asyncio.wait_for(streams.round_clock_stream(scope, receive, send), 10)
+
+        # The broadcaster reads the game in another thread, which can't see the rows of the test transaction
+        game_clock.get_game_clock()
+        rates.get_rate_matrix()
+        async_to_sync(stream)()
+        return messages
+
+    def test_round_and_ticks(self):
+        token = AccessToken.for_user(User.objects.get(username='admin'))
+        messages = self.stream('token={}'.format(token).encode(), 3)
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), messages[0]['headers'])
+        events = [message['body'].decode() for message in messages[1:-1]]
+        self.assertEqual([event.split('\n')[0] for event in events], ['event: round', 'event: tick', 'event: tick'])
+        round_event = json.loads(events[0].split('\n')[1][len('data: '):])
+        self.assertEqual(round_event['current_round'], 3)
+        self.assertEqual(round_event['rates']['Eger']['gem'], {'buy_price': 43, 'sell_price': 42})
+        self.assertEqual(messages[-1], {'type': 'http.response.body', 'body': b'', 'more_body': False})
+        self.assertEqual(streams.broadcaster.subscribers, set())
+
+    def test_without_a_token(self):
+        messages = self.stream(b'token=invalid', 0)
+        self.assertEqual(messages[0]['status'], 401)
+        self.assertEqual(len(messages), 2)
+
+
+class AsyncMiddlewareTests(TestCase):
+
+    @staticmethod
+    async def get_response(request):
+        return HttpResponse('async')
+
+    def test_middlewares_are_awaited_in_an_async_chain(self):
+        for middleware_class in (RequestMetricsMiddleware, WhiteNoiseMiddleware):
+            middleware = middleware_class(self.get_response)
+            self.assertTrue(asyncio.iscoroutinefunction(middleware))
+            response = async_to_sync(middleware)(RequestFactory().get('/merchant_game/api/check/'))
+            self.assertEqual(response.content, b'async')
+
+    def test_middlewares_stay_sync_in_a_sync_chain(self):
+        for middleware_class in (RequestMetricsMiddleware, WhiteNoiseMiddleware):
+            middleware = middleware_class(lambda request: HttpResponse('sync'))
+            self.assertFalse(asyncio.iscoroutinefunction(middleware))
+            self.assertEqual(middleware(RequestFactory().get('/merchant_game/api/check/')).content, b'sync')
+
+
+class AsyncViewTests(TransactionTestCase):
+    """The async views run their queries in other threads, which only see committed rows."""
+
+    def setUp(self):
+        GameData.objects.create(starting_time=timezone.now() - timedelta(minutes=1))
+        Round.objects.create(number=1)
+        City.objects.create(name='Eger')
+        Item.objects.create(name='gem', ending_price=30)
+        ItemExchangeRate.objects.create(city_id='Eger', round_id=1, item_id='gem', buy_price=21, sell_price=20)
+        Player(code='111111').save()
+        self.token = AccessToken.for_user(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    def get(self, view, path, authorized=True, **kwargs):
+        headers = {'HTTP_AUTHORIZATION': 'Bearer {}'.format(self.token)} if authorized else {}
+        response = async_to_sync(view)(RequestFactory().get(path, **headers), **kwargs)
+        return response.status_code, json.loads(response.content)
+
+    def test_city_current_rates(self):
+        path = '/merchant_game/api/cities/Eger/current_rates/'
+        status, data = self.get(async_views.city_current_rates, path, pk='Eger')
+        self.assertEqual(status, 200)
+        self.assertEqual(data['gem']['buy_price'], 21)
+        self.assertEqual(data['gem']['sell_price'], 20)
+        self.assertEqual(self.get(async_views.city_current_rates, path, authorized=False, pk='Eger')[0], 403)
+        self.assertEqual(self.get(async_views.city_current_rates, path, pk='Pecs')[0], 404)
+
+    def test_game_data_and_players(self):
+        status, data = self.get(async_views.game_data_list, '/merchant_game/api/game-data/', authorized=False)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(data), 1)
+        status, data = self.get(async_views.player_list, '/merchant_game/api/players/')
+        self.assertEqual(status, 200)
+        self.assertEqual([player['code'] for player in data], ['111111'])
+
+    def test_api_check_without_credentials(self):
+        status, data = self.get(async_views.api_check, '/merchant_game/api/check/', authorized=False)
+        self.assertEqual(status, 200)
+        self.assertIn('api_root', data)
+
+
+class ServerTimingTests(GameTestCase):
+
+    def setUp(self):
+        super(ServerTimingTests, self).setUp()
+        timing.reset_route_stats()
+
+    @override_settings(MERCHANT_GAME_SERVER_TIMING=True)
+    def test_header_and_route_stats(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/merchant_game/api/players/111111/')
+        # The next request resets the query log of the connection
+        query_count = len(queries)
+        self.assertEqual(response.status_code, 200)
+        header = {metric.split(';')[0]: metric for metric in response['Server-Timing'].split(', ')}
+        self.assertEqual(sorted(header), ['db', 'serializer', 'total', 'view'])
+        self.assertIn('desc="{} queries"'.format(query_count), header['db'])
+        self.assertGreater(float(header['serializer'].split('dur=')[1]), 0)
+
+        stats = self.client.get('/merchant_game/api/stats/').data
+        self.assertEqual(stats['player-detail']['GET']['requests'], 1)
+        self.assertEqual(stats['player-detail']['GET']['mean_queries'], query_count)
+        self.assertEqual(sum(stats['player-detail']['GET']['duration_histogram_ms'].values()), 1)
+        self.assertEqual(self.client.delete('/merchant_game/api/stats/').status_code, 204)
+        # The reset request itself is recorded after the reset
+        self.assertEqual(list(self.client.get('/merchant_game/api/stats/').data), ['stats'])
+
+    def test_turned_off_by_default(self):
+        response = self.client.get('/merchant_game/api/players/111111/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get('/merchant_game/api/stats/').data, {})
+
+    def test_serializers_are_timed_once_with_their_nested_serializers(self):
+        request_timing, token = timing.start_request()
+        try:
+            data = CitySerializer(self.cities[0], context={'request': RequestFactory().get('/')}).data
+        finally:
+            timing.finish_request(request_timing, token)
+        self.assertEqual(len(data['rates']), 6)
+        self.assertGreater(request_timing.serializer_seconds, 0)
+        self.assertLessEqual(request_timing.serializer_seconds, request_timing.total_seconds)
+        self.assertFalse(request_timing.serializing)
+
+
+class MetricsTests(GameTestCase):
+
+    @staticmethod
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    @staticmethod
+    def run_on_commit_callbacks():
+        """Run the callbacks waiting for the commit of the test transaction, which is rolled back instead."""
+        callbacks = [callback for savepoint_ids, callback in connection.run_on_commit]
+        connection.run_on_commit = []
+        for callback in callbacks:
+            callback()
+
+    def test_endpoint(self):
+        self.client.get('/merchant_game/api/players/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        lines = response.content.decode().split('\n')
+        self.assertIn('merchant_game_active_players 3.0', lines)
+        self.assertIn('merchant_game_current_round 3.0', lines)
+        self.assertTrue(any(
+            line.startswith('merchant_game_request_duration_seconds_count{method="GET",route="player-list"}')
+            for line in lines
+        ))
+        self.assertEqual(APIClient().get('/metrics').status_code, 403)
+
+    def test_trades_loans_and_gifts_are_counted_when_committed(self):
+        labels = {'city': 'Eger', 'item': 'gem', 'round': '3', 'action': 'buy'}
+        trades = self.sample('merchant_game_trades_total', **labels)
+        items = self.sample('merchant_game_traded_items_total', **labels)
+        money = self.sample('merchant_game_traded_money_total', **labels)
+        loans = self.sample('merchant_game_loans_issued_total', round='3')
+        gifts = self.sample('merchant_game_player_transaction_money_total', kind='gift')
+
+        execute_trade(self.players[0], self.rate('Eger', 3, 'gem'), 2)
+        Loan.objects.create(player=self.players[0], round_id=3)
+        transfers.give(self.players[0], self.players[1], 5, {})
+        self.assertEqual(self.sample('merchant_game_trades_total', **labels), trades)
+        self.run_on_commit_callbacks()
+
+        self.assertEqual(self.sample('merchant_game_trades_total', **labels), trades + 1)
+        self.assertEqual(self.sample('merchant_game_traded_items_total', **labels), items + 2)
+        self.assertEqual(self.sample('merchant_game_traded_money_total', **labels), money + 2 * 43)
+        self.assertEqual(self.sample('merchant_game_loans_issued_total', round='3'), loans + 1)
+        self.assertEqual(self.sample('merchant_game_player_transaction_money_total', kind='gift'), gifts + 5)
+
+
+class PriceScheduleTests(GameTestCase):
+
+    def setUp(self):
+        super(PriceScheduleTests, self).setUp()
+        execute_trade(self.players[0], self.rate('Eger', 3, 'gem'), 2)
+
+    def populate(self, file_name, content):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, file_name)
+            with open(path, 'w') as schedule_file:
+                schedule_file.write(content)
+            call_command('populate', schedule=path, stdout=StringIO())
+
+    def assertPopulated(self):
+        self.assertEqual(sorted(City.objects.values_list('name', flat=True)), ['Eger', 'Pecs'])
+        self.assertEqual(dict(Item.objects.values_list('name', 'ending_price')), {'ore': 12, 'gem': 40})
+        self.assertEqual(
+            sorted(ItemExchangeRate.objects.values_list('city', 'round', 'item', 'buy_price', 'sell_price')),
+            [('Eger', 1, 'gem', 30, 25), ('Eger', 1, 'ore', 6, 5), ('Pecs', 2, 'ore', None, 7)],
+        )
+        # The trades of the removed items are removed with them
+        self.assertEqual(self.players[0].money, 1000)
+        self.assertLedgerConsistent()
+
+    def test_csv(self):
+        self.populate('prices.csv', (
+            "city,round,item,buy_price,sell_price,ending_price\n"
+            "Eger,1,ore,6,5,12\n"
+            "Eger,1,gem,30,25,40\n"
+            "Pecs,2,ore,,7,\n"
+        ))
+        self.assertPopulated()
+
+    def test_json(self):
+        self.populate('prices.json', json.dumps({
+            'prices': {
+                'Eger': {'1': {'ore': [6, 5], 'gem': [30, 25]}},
+                'Pecs': {'2': {'ore': [None, 7]}},
+            },
+            'ending_prices': {'ore': 12, 'gem': 40},
+        }))
+        self.assertPopulated()
+
+    def test_malformed_schedules(self):
+        for file_name, content, message in [
+            ('prices.txt', '', "Unknown schedule format '.txt'"),
+            ('prices.csv', "city,round,item,buy_price\n", "The CSV schedule has no sell_price column"),
+            ('prices.csv', "city,round,item,buy_price,sell_price\nEger,first,ore,6,5\n", "line 2: 'first'"),
+            ('prices.csv', "city,round,item,buy_price,sell_price\nEger,1,ore,6,x\n", "line 2: 'x' is not a price"),
+            ('prices.csv', "city,round,item,buy_price,sell_price\nEger,1,ore,5,6\n", "Eger round 1 ore: the sell"),
+            ('prices.json', '[]', "The JSON schedule has no \"prices\" object"),
+            ('prices.json', '{"prices": {"Eger": [1]}}', "Eger: the prices should be an object of round"),
+            ('prices.json', '{"prices": {"Eger": {"one": {}}}}', "Eger: 'one' is not a round"),
+            ('prices.json', '{"prices": {"Eger": {"1": [6, 5]}}}', "Eger round 1: the prices should be an object"),
+            ('prices.json', '{"prices": {"Eger": {"1": {"ore": 6}}}}', "Eger round 1 ore: 6 is not a [buy price"),
+            ('prices.json', '{"prices": {"Eger": {"1": {"ore": [6, -1]}}}}', "Eger round 1 ore: the price can't"),
+            ('prices.json', '{"prices": {}, "ending_prices": [1]}', "The ending prices should be an object"),
+        ]:
+            with self.subTest(content=content), self.assertRaisesMessage(CommandError, message):
+                self.populate(file_name, content)
+        self.assertEqual(City.objects.count(), 2)
+
+
+class GenerateMarketTests(GameTestCase):
+
+    def test_generated_market(self):
+        output = StringIO()
+        call_command('generate_market', cities=3, items=4, rounds=2, seed=7, not_traded=0.2, stdout=output)
+        self.assertEqual(City.objects.count(), 3)
+        self.assertEqual(Item.objects.count(), 4)
+        self.assertEqual(ItemExchangeRate.objects.count(), 3 * 4 * 2)
+        self.assertFalse(ItemExchangeRate.objects.filter(sell_price__gt=F('buy_price')).exists())
+        self.assertFalse(ItemExchangeRate.objects.filter(buy_price__lt=1).exists())
+        # The game data has a third round, which the market has no rates for
+        self.assertIn("1 rounds after the last round of the schedule are kept", output.getvalue())
+
+    def test_seeded_prices(self):
+        def prices(seed):
+            schedule = price_schedules.generate(5, 5, 5, seed)
+            return schedule.items, list(schedule.rates)
+        self.assertEqual(prices(1), prices(1))
+        self.assertNotEqual(prices(1), prices(2))
+
+    def test_invalid_options(self):
+        for options, message in [
+            ({'cities': 0}, "The number of cities should be between 1 and 99999"),
+            ({'not_traded': 1.5}, "--not-traded should be a probability between 0 and 1"),
+            ({'batch_size': 0}, "--batch-size should be positive"),
+        ]:
+            with self.subTest(options=options), self.assertRaisesMessage(CommandError, message):
+                call_command('generate_market', stdout=StringIO(), **options)
+        self.assertEqual(City.objects.count(), 2)
+
+
+class ValuationTests(GameTestCase):
+
+    def setUp(self):
+        super(ValuationTests, self).setUp()
+        execute_trade(self.players[0], self.rate('Eger', 3, 'gem'), 2)
+        Loan.objects.create(player=self.players[0], round_id=1)
+        execute_trade(self.players[1], self.rate('Budapest', 3, 'ore'), 10)
+
+    def value(self, **params):
+        response = self.client.get('/merchant_game/api/valuation/', params)
+        self.assertEqual(response.status_code, 200)
+        return {valuation['player']: valuation for valuation in response.data['players']}
+
+    def test_ending_prices(self):
+        valuations = self.value()
+        self.assertEqual(valuations['111111'], {
+            'player': '111111', 'money': 1000 - 2 * 43 + 500, 'items_value': 2 * 30, 'loans': 600,
+            'total': 1000 - 2 * 43 + 500 + 2 * 30 - 600, 'rank': 3,
+        })
+        self.assertEqual(valuations['222222']['total'], 1000 - 10 * 8 + 10 * 10)
+        self.assertEqual(valuations['222222']['rank'], 1)
+        self.assertEqual(valuations['333333']['total'], 1000)
+        self.assertEqual(valuations['333333']['rank'], 2)
+
+    def test_sell_prices_of_a_city_in_a_round(self):
+        valuations = self.value(city='Eger', round=2)
+        self.assertEqual(valuations['111111']['items_value'], 2 * 41)
+        self.assertEqual(valuations['111111']['loans'], 550)
+        self.assertEqual(valuations['222222']['items_value'], 10 * 11)
+
+    def test_paid_back_loans_are_not_deducted(self):
+        self.client.post('/merchant_game/api/loans/{}/pay_back_loan/'.format(Loan.objects.get().pk))
+        valuations = self.value()
+        self.assertEqual(valuations['111111']['loans'], 0)
+        self.assertEqual(valuations['111111']['money'], 1000 - 2 * 43 + 500 - 600)
+
+    def test_invalid_parameters(self):
+        for params, message in [
+            ({'round': 4}, "round should be between 1 and 3"),
+            ({'round': 'last'}, "round should be a number"),
+            ({'city': 'Pecs'}, "Pecs has no exchange rates"),
+        ]:
+            response = self.client.get('/merchant_game/api/valuation/', params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(message, str(response.data))
+
+
+class ArbitrageTests(GameTestCase):
+
+    def setUp(self):
+        super(ArbitrageTests, self).setUp()
+        # Without loans, ore doubles between the first two rounds in Budapest, gem gains a fifth by the end in Eger
+        GameData.objects.update(starting_loan=0, loan_increase=0)
+        ItemExchangeRate.objects.all().delete()
+        for city_name, round_number, item_name, buy_price, sell_price in [
+            ('Budapest', 1, 'ore', 10, None),
+            ('Budapest', 2, 'ore', None, 20),
+            ('Eger', 1, 'gem', 25, None),
+            ('Eger', 3, 'gem', None, 30),
+        ]:
+            ItemExchangeRate.objects.create(
+                city_id=city_name, round_id=round_number, item_id=item_name, buy_price=buy_price, sell_price=sell_price,
+            )
+        rates.invalidate()
+
+    def test_hand_solved_market(self):
+        response = self.client.get('/merchant_game/api/arbitrage/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['route_score'], 2000)
+        self.assertEqual(response.data['upper_bound'], 2000)
+        self.assertEqual(response.data['loan_paybacks'], 0)
+        self.assertEqual(
+            [(step.get('city'), step['bought'], step['sold'], step['money']) for step in response.data['rounds']][:2],
+            [
+                ('Budapest', {'ore': {'amount': 100, 'price': 10}}, {}, 0),
+                ('Budapest', {}, {'ore': {'amount': 100, 'price': 20}}, 2000),
+            ],
+        )
+        output = StringIO()
+        call_command('solve_market', stdout=output)
+        self.assertIn("Route score from 1000 money: 2000, no route scores more than 2000", output.getvalue())
+
+    def test_rounding_to_whole_items(self):
+        response = self.client.get('/merchant_game/api/arbitrage/', {'money': 1005})
+        # The 5 left over after buying ore would double too if it could buy half an ore
+        self.assertEqual(response.data['route_score'], 2005)
+        self.assertEqual(response.data['upper_bound'], 2010)
+
+    def test_loan_paid_back_early(self):
+        # Ore gains a fifth in Budapest in the second round only, the loan of the first round costs 550 back then
+        GameData.objects.update(starting_loan=500, loan_increase=100)
+        Item.objects.filter(name='ore').update(ending_price=0)
+        ItemExchangeRate.objects.all().delete()
+        ItemExchangeRate.objects.create(city_id='Budapest', round_id=1, item_id='ore', buy_price=10, sell_price=None)
+        ItemExchangeRate.objects.create(city_id='Budapest', round_id=2, item_id='ore', buy_price=None, sell_price=12)
+        rates.invalidate()
+        response = self.client.get('/merchant_game/api/arbitrage/')
+        self.assertEqual(response.data['route_score'], 1250)
+        self.assertEqual(response.data['upper_bound'], 1250)
+        self.assertEqual(response.data['loan_paybacks'], 0)
+        self.assertEqual(
+            [(step['loan'], step['paid_back'], step['money']) for step in response.data['rounds']],
+            [(500, 0, 0), (0, 550, 1250), (0, 0, 1250)],
+        )
+
+    def test_invalid_money(self):
+        self.assertEqual(self.client.get('/merchant_game/api/arbitrage/', {'money': -1}).status_code, 400)
+        self.assertEqual(self.client.get('/merchant_game/api/arbitrage/', {'money': 'all'}).status_code, 400)
+
+
+class LoanTests(GameTestCase):
+
+    def test_loans_and_paybacks(self):
+        player = self.players[0]
+        loan = Loan(player=player, round_id=1)
+        loan.save()
+        self.assertEqual(loan.amount, 500)
+        response = self.client.post('/merchant_game/api/loans/{}/pay_back_loan/'.format(loan.pk))
+        self.assertEqual(response.status_code, 200)
+        # Paid back in the third round, with the interest of two rounds
+        self.assertEqual(LoanPayback.objects.get(loan=loan).payback_amount, 600)
+        Loan.objects.create(player=player, round_id=2)
+        self.client.post('/merchant_game/api/end/')
+        self.assertEqual(LoanPayback.objects.get(loan__round=2).payback_amount, 660)
+        self.assertEqual(player.money, 1000 + 500 - 600 + 600 - 660)
+        self.assertLedgerConsistent()
+
+    def test_loans_of_changed_game_data_keep_their_amount(self):
+        loan = Loan.objects.create(player=self.players[0], round_id=1)
+        game_data = GameData.objects.get()
+        game_data.starting_loan = 1000
+        game_data.save()
+        self.assertEqual(Loan.objects.create(player=self.players[1], round_id=1).amount, 1000)
+        self.client.post('/merchant_game/api/loans/{}/pay_back_loan/'.format(loan.pk))
+        self.assertEqual(LoanPayback.objects.get(loan=loan).payback_amount, 500 + 2 * 50)
+
+
+class IssueLoansTests(GameTestCase):
+
+    def issue(self, data):
+        return self.client.post('/merchant_game/api/loans/issue/', data, format='json')
+
+    def test_every_player_in_the_current_round(self):
+        Loan.objects.create(player=self.players[1], round_id=3)
+        response = self.issue({})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['round'], 3)
+        self.assertEqual(response.data['issued'], {'111111': 700, '333333': 700})
+        self.assertEqual(response.data['skipped'], ['222222'])
+        self.assertEqual([player.money for player in self.players], [1700, 1700, 1700])
+        self.assertLedgerConsistent()
+
+    def test_listed_players_in_a_round(self):
+        response = self.issue({'players': ['333333', '111111', '333333'], 'round': 2})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['issued'], {'333333': 600, '111111': 600})
+        self.assertEqual(sorted(Loan.objects.values_list('player', 'round', 'amount')), [
+            ('111111', 2, 600), ('333333', 2, 600),
+        ])
+        self.assertEqual(self.issue({'players': ['111111'], 'round': 2}).data['skipped'], ['111111'])
+
+    def test_queries_dont_grow_with_the_players(self):
+        # The first request fills the caches
+        self.issue({'round': 1})
+        with CaptureQueriesContext(connection) as queries:
+            self.issue({'round': 2})
+        for number in range(20):
+            Player(code='9{:05d}'.format(number)).save()
+        with CaptureQueriesContext(connection) as more_queries:
+            response = self.issue({'round': 3})
+        self.assertEqual(len(response.data['issued']), 23)
+        self.assertEqual(len(more_queries), len(queries))
+        self.assertLedgerConsistent()
+
+    def test_invalid_requests(self):
+        for data, message in [
+            ({'players': '111111'}, "players should be a list of player codes"),
+            ({'players': [1]}, "players should be a list of player codes"),
+            ({'players': ['111111', '999999']}, "Unknown players: 999999"),
+            ({'round': 'first'}, "round should be a number"),
+            ({'round': 4}, "round should be between 1 and 3"),
+        ]:
+            response = self.issue(data)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(message, str(response.data))
+        self.assertFalse(Loan.objects.exists())
+        self.client.force_authenticate(None)
+        self.assertEqual(self.issue({}).status_code, 403)
+
+
+class ExplainLedgerQueriesTests(TransactionTestCase):
+
+    def test_smoke(self):
+        output = StringIO()
+        call_command('explain_ledger_queries', transactions=200, players=5, repeat=1, stdout=output)
+        self.assertIn("before - money traded by a player", output.getvalue())
+        self.assertIn("after - money traded by a player", output.getvalue())
+        self.assertIn("Migrating to 0033_ledger_indexes took", output.getvalue())
+
+
+class PlayerQueryTests(GameTestCase):
+
+    def test_queries_do_not_grow_with_the_players(self):
+        rate = self.rate('Budapest', 1, 'ore')
+        for player_count in (5, 50):
+            for number in range(Player.objects.count(), player_count):
+                player = Player(code='{:06}'.format(number))
+                player.save()
+                execute_trade(player, rate, 2)
+                Loan(player=player, round_id=1).save()
+            with self.subTest(player_count=player_count):
+                with self.assertNumQueries(2):
+                    response = self.client.get('/merchant_game/api/players/')
+                self.assertEqual(len(response.data), player_count)
+                with self.assertNumQueries(7):
+                    response = self.client.get('/merchant_game/api/players/000004/')
+                self.assertEqual(response.data['items'], {'ore': 2})
+
+
+class EndTests(GameTestCase):
+
+    @staticmethod
+    def per_player_end():
+        """The End response computed player by player from the ledger tables, like End did before the balances."""
+        final_prices = {item.name: item.ending_price for item in Item.objects.all()}
+        game_data = GameData.objects.last()
+        money = PlayerBalance.from_ledger()
+        items = PlayerInventory.from_ledger()
+        result = {"final_prices": final_prices}
+        for player in Player.objects.all():
+            score = result[player.code] = {
+                'money': money[player.code],
+                'final_money': money[player.code],
+                'items': {},
+                'loans': {},
+                'paybacks': {},
+            }
+            for (code, item_name), amount in sorted(items.items()):
+                if code == player.code:
+                    score['items'][item_name] = {'amount': amount, 'value': final_prices[item_name] * amount}
+                    score['final_money'] += score['items'][item_name]['value']
+            for loan in player.loans.all():
+                score['loans'][loan.round.number] = {"loan_amount": loan.amount}
+                if hasattr(loan, 'payback'):
+                    score['paybacks'][loan.round.number] = {"payback_amount": loan.payback.payback_amount}
+                    score['loans'][loan.round.number]['paid_back'] = True
+                else:
+                    payback_amount = loan.amount + (
+                        (game_data.current_round - loan.round.number) * int(loan.amount * game_data.loan_interest / 100)
+                    )
+                    score['loans'][loan.round.number]['paid_back'] = False
+                    score['loans'][loan.round.number]['payback_amount'] = payback_amount
+                    score['final_money'] -= payback_amount
+        return result
+
+    def play(self):
+        first, second, third = self.players
+        execute_trade(first, self.rate('Budapest', 1, 'ore'), 20)
+        execute_trade(first, self.rate('Eger', 2, 'ore'), -5)
+        execute_trade(second, self.rate('Eger', 1, 'gem'), 10)
+        transfers.give(second, third, 30, {'gem': 4})
+        for player, round_number in ((first, 1), (first, 2), (third, 3)):
+            Loan(player=player, round_id=round_number).save()
+        LoanPayback(loan=Loan.objects.get(player=first, round=1)).save()
+
+    def test_matches_the_per_player_computation(self):
+        self.play()
+        response = self.client.get('/merchant_game/api/end/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.per_player_end())
+
+    def test_settling_matches_the_per_player_computation(self):
+        self.play()
+        response = self.client.post('/merchant_game/api/end/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Loan.objects.filter(payback__isnull=True).exists())
+        self.assertEqual(response.data, self.per_player_end())
+        self.assertLedgerConsistent()
+
+    def test_repaid_loans_are_skipped(self):
+        self.play()
+        self.assertEqual(len(settle_loans()), 2)
+        self.assertEqual(settle_loans(), [])
+        self.assertEqual(self.client.post('/merchant_game/api/end/').status_code, 200)
+        self.assertLedgerConsistent()
+
+    def test_without_game_data(self):
+        Loan.objects.create(player=self.players[0], round_id=1)
+        game_clock.get_game_clock()
+        # A queryset delete, like the bulk delete of the admin, invalidates the cached clock too
+        GameData.objects.all().delete()
+        self.assertIsNone(game_clock.get_game_clock())
+        response = self.client.post('/merchant_game/api/end/')
+        self.assertEqual(response.status_code, 200)
+        # Without a game there is no round to pay the loan back in
+        self.assertEqual(response.data['111111']['money'], 1500)
+        self.assertEqual(response.data['111111']['final_money'], 1500)
+        self.assertEqual(response.data['111111']['loans'], {1: {'loan_amount': 500, 'paid_back': False}})
+        self.assertFalse(LoanPayback.objects.exists())
+
+    def test_queries_dont_grow_with_the_loans(self):
+        def count_queries(codes):
+            for code in codes:
+                player = Player(code=code)
+                player.save()
+                Loan(player=player, round_id=1).save()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(len(settle_loans()), len(codes))
+            return len(queries)
+
+        self.assertEqual(count_queries(['400000']), count_queries(['5{:05d}'.format(number) for number in range(20)]))
+        self.assertLedgerConsistent()
+
+
+class LedgerListTests(GameTestCase):
+
+    def setUp(self):
+        super(LedgerListTests, self).setUp()
+        first, second = self.players[:2]
+        for city in self.cities:
+            for round_number in range(1, 4):
+                execute_trades(first, city, round_number, [('ore', 1), ('gem', 1)])
+                execute_trades(second, city, round_number, [('ore', 2)])
+        transfers.give(first, second, 10, {'gem': 1})
+        transfers.give(second, self.players[2], 5, {})
+
+    def get_all_pages(self, url, params):
+        ids, response = [], self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [int(row['url'].rstrip('/').rsplit('/', 1)[1]) for row in response.data['results']]
+            if response.data['next'] is None:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_pages_follow_the_ids(self):
+        ids = self.get_all_pages('/merchant_game/api/transactions/', {'page_size': 4})
+        self.assertEqual(ids, list(Transaction.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_filters(self):
+        url = '/merchant_game/api/transactions/'
+        since_id = Transaction.objects.order_by('id')[5].id
+        for params, expected in (
+            ({'player': '222222'}, Transaction.objects.filter(player='222222')),
+            ({'city': 'Eger'}, Transaction.objects.filter(exchange_rate__city='Eger')),
+            ({'round': 2}, Transaction.objects.filter(exchange_rate__round=2)),
+            (
+                {'item': 'gem', 'player': '111111'},
+                Transaction.objects.filter(exchange_rate__item='gem', player='111111'),
+            ),
+            ({'since_id': since_id}, Transaction.objects.filter(id__gt=since_id)),
+        ):
+            self.assertEqual(
+                self.get_all_pages(url, dict(params, page_size=3)),
+                [transaction.id for transaction in expected.order_by('id')],
+            )
+        self.assertEqual(self.client.get(url, {'round': 'x'}).status_code, 400)
+
+    def test_player_transaction_filters(self):
+        url = '/merchant_game/api/player-transactions/'
+        self.assertEqual(len(self.get_all_pages(url, {'player': '222222'})), 2)
+        self.assertEqual(len(self.get_all_pages(url, {'player': '333333'})), 1)
+        gem_gifts = self.client.get(url, {'item': 'gem'}).data['results']
+        self.assertEqual([(gift['giver'], gift['items']) for gift in gem_gifts], [('111111', {'gem': 1})])
+
+    def test_export_matches_the_pages(self):
+        response = self.client.get('/merchant_game/api/transactions/export/', {'city': 'Budapest'})
+        self.assertEqual(response.status_code, 200)
+        exported = [row['url'] for row in json.loads(b''.join(response.streaming_content))]
+        page = self.client.get('/merchant_game/api/transactions/', {'city': 'Budapest'}).data
+        self.assertIsNone(page['next'])
+        self.assertEqual(exported, [row['url'] for row in page['results']])
+
+    @override_settings(MERCHANT_GAME_ASYNC_VIEWS=True)
+    def test_async_export_is_streamed_in_batches(self):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        token = AccessToken.for_user(User.objects.get(username='admin'))
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/merchant_game/api/transactions/export/',
+            'query_string': b'city=Budapest',
+            'headers': [(b'host', b'testserver'), (b'authorization', 'Bearer {}'.format(token).encode())],
+        }
+        with mock.patch.object(TransactionViewSet, 'export_batch_size', 4):
+            async_to_sync(StreamingASGIHandler())(scope, receive, send)
+        self.assertEqual(messages[0]['status'], 200)
+        bodies = [message['body'] for message in messages[1:] if message.get('more_body')]
+        # The brackets and 9 trades in batches of 4
+        self.assertEqual(len(bodies), 2 + 3)
+        exported = [row['url'] for row in json.loads(b''.join(bodies))]
+        page = self.client.get('/merchant_game/api/transactions/', {'city': 'Budapest'}).data
+        self.assertEqual(exported, [row['url'] for row in page['results']])
+        self.assertFalse(messages[-1].get('more_body', False))
 
-# Create your tests here.
@@ -0,0 +1,158 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+# Upper bounds of the request duration buckets of the route histograms in milliseconds, the last one is open
+DURATION_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+# The timing of the request being served, the threads of sync_to_async get a copy of the context
+_request_timing = contextvars.ContextVar('request_timing', default=None)
+
+_route_stats = {}
+_route_stats_lock = threading.Lock()
+
+
+class RequestTiming:
+    """The queries, the SQL time, the serializer time and the view time of a request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.view_seconds = 0.0
+        self.total_seconds = 0.0
+        self.serializing = False
+
+    def finish(self):
+        finished = time.perf_counter()
+        if self.view_started is not None:
+            self.view_seconds = finished - self.view_started
+        self.total_seconds = finished - self.started
+
+    def server_timing(self):
+        return 'db;dur={:.2f};desc="{} queries", serializer;dur={:.2f}, view;dur={:.2f}, total;dur={:.2f}'.format(
+            self.sql_seconds * 1000,
+            self.queries,
+            self.serializer_seconds * 1000,
+            self.view_seconds * 1000,
+            self.total_seconds * 1000,
+        )
+
+
+def start_request():
+    """Start timing the request, returns the timing and the token to pass to `finish_request`."""
+    timing = RequestTiming()
+    return timing, _request_timing.set(timing)
+
+
+def finish_request(timing, token):
+    _request_timing.reset(token)
+    timing.finish()
+
+
+def start_view():
+    timing = _request_timing.get()
+    if timing is not None:
+        timing.view_started = time.perf_counter()
+
+
+def time_query(execute, sql, params, many, context):
+    """Execute wrapper counting the queries of the request being served and their time."""
+    timing = _request_timing.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.queries += 1
+        timing.sql_seconds += time.perf_counter() - started
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """Receiver of connection_created, adds the execute wrapper to every new connection."""
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+@contextlib.contextmanager
+def serializing():
+    """Count the time of the block in the serializer time of the request being served.
+
+    Nested serializers are part of the time of their parent, the queries they run are included.
+    """
+    timing = _request_timing.get()
+    if timing is None or timing.serializing:
+        yield
+        return
+    timing.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.serializing = False
+        timing.serializer_seconds += time.perf_counter() - started
+
+
+class RouteStats:
+    """Aggregated timings of the requests of a route, with a histogram of their durations."""
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.view_seconds = 0.0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.duration_counts = [0] * (len(DURATION_BUCKETS) + 1)
+
+    def add(self, timing):
+        self.requests += 1
+        self.queries += timing.queries
+        self.sql_seconds += timing.sql_seconds
+        self.serializer_seconds += timing.serializer_seconds
+        self.view_seconds += timing.view_seconds
+        self.total_seconds += timing.total_seconds
+        self.max_seconds = max(self.max_seconds, timing.total_seconds)
+        self.duration_counts[bisect.bisect_left(DURATION_BUCKETS, timing.total_seconds * 1000)] += 1
+
+    def to_dict(self):
+        def mean_ms(seconds):
+            return round(seconds * 1000 / self.requests, 2)
+        return {
+            'requests': self.requests,
+            'mean_queries': round(self.queries / self.requests, 2),
+            'mean_sql_ms': mean_ms(self.sql_seconds),
+            'mean_serializer_ms': mean_ms(self.serializer_seconds),
+            'mean_view_ms': mean_ms(self.view_seconds),
+            'mean_total_ms': mean_ms(self.total_seconds),
+            'max_total_ms': round(self.max_seconds * 1000, 2),
+            'duration_histogram_ms': {
+                ('<={}'.format(bound) if bound is not None else '>{}'.format(DURATION_BUCKETS[-1])): count
+                for bound, count in zip(DURATION_BUCKETS + [None], self.duration_counts)
+            },
+        }
+
+
+def record(route, method, timing):
+    with _route_stats_lock:
+        _route_stats.setdefault((route, method), RouteStats()).add(timing)
+
+
+def get_route_stats():
+    """Return the aggregated timings of this worker process by route name and method."""
+    route_stats = {}
+    with _route_stats_lock:
+        for (route, method), stats in sorted(_route_stats.items()):
+            route_stats.setdefault(route, {})[method] = stats.to_dict()
+    return route_stats
+
+
+def reset_route_stats():
+    with _route_stats_lock:
+        _route_stats.clear()
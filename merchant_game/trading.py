@@ -0,0 +1,102 @@
+from django.db.transaction import atomic
+
+from .exceptions import InvalidRequestException, TradeException
+from .models import ItemExchangeRate, PlayerBalance, PlayerInventory, Transaction
+
+
+def lock_balances(player_codes):
+    """Lock the balance rows of the players until the end of the transaction and return their money.
+
+    The rows are locked in the order of the player codes, so concurrent requests touching the same players cannot
+    deadlock. Every request that changes money or items of a player holds this lock while it validates and writes.
+    Missing balance rows are rebuilt from the ledger, raises InvalidRequestException for unknown players.
+    """
+    balances = PlayerBalance.objects.select_for_update().order_by('player')
+    money = dict(balances.filter(player__in=player_codes).values_list('player', 'money'))
+    missing = [code for code in player_codes if code not in money]
+    if missing:
+        PlayerBalance.rebuild(missing)
+        money.update(balances.filter(player__in=missing).values_list('player', 'money'))
+        unknown = [code for code in missing if code not in money]
+        if unknown:
+            raise InvalidRequestException("Unknown players: {}".format(', '.join(unknown)))
+    return money
+
+
+def _check_trade(rate, item_amount, money, held_amount):
+    """Return the price of the trade, raise TradeException if the player can't afford it."""
+    price = rate.buy_price if item_amount >= 0 else rate.sell_price
+    if price is None:
+        raise TradeException("{} can't be {} here in this round".format(
+            rate.item_id, "bought" if item_amount >= 0 else "sold",
+        ))
+    if item_amount >= 0 and money - price * item_amount < 0:
+        raise TradeException("Not enough money")
+    if item_amount < 0 and held_amount + item_amount < 0:
+        raise TradeException("Not enough item")
+    return -1 * item_amount * price
+
+
+def execute_trade(player, rate, item_amount):
+    """Buy (positive item_amount) or sell (negative item_amount) items of the rate for the player.
+
+    The validation and the insert run in one transaction while the balance row of the player is locked, so
+    concurrent trades of the same player are serialized and each one sees the money and items left by the previous.
+    The prices are read from the rate row in the transaction, the rate matrix of this worker may be older.
+    """
+    with atomic():
+        money = lock_balances([player.code])[player.code]
+        locked_rate = ItemExchangeRate.objects.filter(
+            city=rate.city_id, round=rate.round_id, item=rate.item_id,
+        ).first()
+        if locked_rate is None:
+            raise TradeException("{} is not traded in {}".format(rate.item_id, rate.city_id))
+        rate = locked_rate
+        held_amount = 0
+        if item_amount < 0:
+            held_amount = PlayerInventory.objects.filter(
+                player=player, item=rate.item_id,
+            ).values_list('amount', flat=True).first() or 0
+        _check_trade(rate, item_amount, money, held_amount)
+        transaction = Transaction(player=player, exchange_rate=rate, item_amount=item_amount)
+        transaction.save()
+    return transaction
+
+
+def execute_trades(player, city, round_number, lines):
+    """Execute several buys and sells of the player in the city at once.
+
+    lines is a list of (item name, item amount) pairs, positive amounts are bought and negative ones are sold. The
+    lines are checked in order against one locked snapshot of the player's money and items, every line sees the
+    money and items left by the previous ones. Returns the created transactions and the error message of every line
+    (None for the valid ones). If any line is invalid nothing is written and no transactions are returned.
+    """
+    item_names = {item_name for item_name, item_amount in lines}
+    with atomic():
+        money = lock_balances([player.code])[player.code]
+        # Like execute_trade, the prices are read in the transaction instead of the rate matrix
+        rates = {
+            rate.item_id: rate
+            for rate in ItemExchangeRate.objects.filter(city=city.name, round=round_number, item__in=item_names)
+        }
+        held_amounts = dict(
+            PlayerInventory.objects.filter(player=player, item__in=item_names).values_list('item', 'amount')
+        )
+        transactions, errors = [], []
+        for item_name, item_amount in lines:
+            rate = rates.get(item_name)
+            try:
+                if rate is None:
+                    raise TradeException("{} is not traded in {}".format(item_name, city.name))
+                price = _check_trade(rate, item_amount, money, held_amounts.get(item_name, 0))
+            except TradeException as ex:
+                errors.append(ex.detail)
+                continue
+            money += price
+            held_amounts[item_name] = held_amounts.get(item_name, 0) + item_amount
+            transactions.append(Transaction(player=player, exchange_rate=rate, item_amount=item_amount, price=price))
+            errors.append(None)
+        if any(errors):
+            return [], errors
+        transactions = Transaction.create_in_bulk(transactions)
+    return transactions, errors
@@ -0,0 +1,62 @@
+from django.db.transaction import atomic, on_commit
+
+from .exceptions import InvalidRequestException
+from .metrics import record_player_transaction
+from .models import PlayerInventory, PlayerTransaction
+from .trading import lock_balances
+
+
+def _check_amount(amount, name):
+    if isinstance(amount, bool) or not isinstance(amount, int):
+        raise InvalidRequestException("{} should be an integer".format(name))
+    if amount < 0:
+        raise InvalidRequestException("{} shouldn't be lower than 0".format(name))
+
+
+def _lock(giver, taker):
+    """Lock the balances of both players and return the money of the giver and the amounts of its items."""
+    money = lock_balances(sorted({giver.code, taker.code}))[giver.code]
+    held_amounts = dict(PlayerInventory.objects.filter(player=giver).exclude(amount=0).values_list('item', 'amount'))
+    return money, held_amounts
+
+
+def _transfer(kind, giver, taker, money, items):
+    transaction = PlayerTransaction.create_with_items(giver, taker, money, items)
+    on_commit(lambda: record_player_transaction(kind, money, items))
+    return transaction
+
+
+def give(giver, taker, money, items):
+    """Move money and items, a dict of item names and amounts, from the giver to the taker.
+
+    Like the trades, the request is checked against the money and items of the giver read once while the balances of
+    both players are locked, and the transaction and its items are written before the locks are released. Raises
+    InvalidRequestException if the giver doesn't have what it gives.
+    """
+    _check_amount(money, "money")
+    if not isinstance(items, dict):
+        raise InvalidRequestException("items should be a dictionary of item names and amounts")
+    for amount in items.values():
+        _check_amount(amount, "item amounts")
+    items = {item_name: amount for item_name, amount in items.items() if amount}
+    with atomic():
+        held_money, held_amounts = _lock(giver, taker)
+        if money > held_money:
+            raise InvalidRequestException("given money should be not higher than the giver's money")
+        for item_name, amount in items.items():
+            if amount > held_amounts.get(item_name, 0):
+                raise InvalidRequestException("given item amount should not be higher than giver's item amount")
+        return _transfer('gift', giver, taker, money, items)
+
+
+def rob(robber, robbed, rob_money):
+    """Move all the money, or all the items, of the robbed player to the robber.
+
+    What is taken is read while the balances of both players are locked, so it is exactly what the robbed player
+    has when the robbery is written.
+    """
+    with atomic():
+        held_money, held_amounts = _lock(robbed, robber)
+        if rob_money:
+            return _transfer('rob', robbed, robber, held_money, {})
+        return _transfer('rob', robbed, robber, 0, held_amounts)
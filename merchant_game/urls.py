@@ -1,9 +1,10 @@
+from django.conf import settings
 from django.conf.urls import url
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
-from . import views
+from . import async_views, views
 
 
 router = DefaultRouter()
@@ -20,7 +21,20 @@ urlpatterns = [
     path('api/', views.api_root, name='api'),
     path('api/check/', views.api_check, name='api-check'),
     path('api/end/', views.End.as_view(), name='end'),
+    path('api/stats/', views.RequestStats.as_view(), name='stats'),
+    path('api/valuation/', views.Valuation.as_view(), name='valuation'),
+    path('api/arbitrage/', views.Arbitrage.as_view(), name='arbitrage'),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     url(r'^api/', include(router.urls)),
 ]
+
+if settings.MERCHANT_GAME_ASYNC_VIEWS:
+    # Matched before the DRF views, which still serve every other method and format of these endpoints
+    urlpatterns[:0] = [
+        path('api/check/', async_views.api_check, name='api-check'),
+        path('api/players/', async_views.player_list, name='player-list'),
+        url(r'^api/cities/(?P<pk>[^/.]+)/current_rates/$', async_views.city_current_rates, name='city-current-rates'),
+        path('api/game-data/', async_views.game_data_list, name='gamedata-list'),
+        url(r'^api/game-data/(?P<pk>[^/.]+)/$', async_views.game_data_detail, name='gamedata-detail'),
+    ]
@@ -0,0 +1,107 @@
+"""What-if valuation of the players: their money plus their items at a set of prices, minus their loans.
+
+The prices are a column of a city x round x item tensor of the sell prices, or the ending prices of the items. The
+holdings of the players are a dense player x item matrix, so valuing every player takes one pass over flat arrays
+and a fixed number of queries.
+"""
+from array import array
+from operator import mul
+
+from .exceptions import InvalidRequestException
+from .game_clock import get_game_clock
+from .loans import get_loan_table
+from .rates import get_rate_matrix
+
+_cache = {}
+
+
+class PriceTensor:
+    """The sell prices of the rate matrix in a flat array indexed by (city, round, item), 0 where items can't be
+    sold."""
+
+    def __init__(self, matrix, item_names, round_count):
+        self.item_names = item_names
+        self.city_index = {city_name: index for index, city_name in enumerate(matrix.city_names)}
+        self.round_count = round_count
+        item_index = {item_name: index for index, item_name in enumerate(item_names)}
+        self.prices = array('q', bytes(8 * len(self.city_index) * round_count * len(item_names)))
+        for rate in matrix.rates_by_id.values():
+            if rate.sell_price is not None and rate.item_id in item_index and 1 <= rate.round_id <= round_count:
+                self.prices[self._offset(rate.city_id, rate.round_id) + item_index[rate.item_id]] = rate.sell_price
+
+    def _offset(self, city_name, round_number):
+        return (self.city_index[city_name] * self.round_count + round_number - 1) * len(self.item_names)
+
+    def column(self, city_name, round_number):
+        """Return the sell prices of the city in the round in the order of the items, without copying them."""
+        offset = self._offset(city_name, round_number)
+        return memoryview(self.prices)[offset:offset + len(self.item_names)]
+
+
+def get_price_tensor(item_names, round_count):
+    """Return the price tensor of the current rate matrix, it is built again when the rates or the items change."""
+    matrix = get_rate_matrix()
+    key = (matrix.version, tuple(item_names), round_count)
+    tensor = _cache.get(key)
+    if tensor is None:
+        _cache.clear()
+        tensor = _cache[key] = PriceTensor(matrix, item_names, round_count)
+    return tensor
+
+
+def value_players(city_name=None, round_number=None):
+    """Rank the players by their money plus the value of their items minus what paying back their loans would cost.
+
+    The items are valued at the sell prices of the city in the round, or at their ending prices without a city like
+    at the end of the game. The loans are paid back in the round, the current one by default.
+    """
+    from .models import Item, Loan, PlayerBalance, PlayerInventory
+    clock = get_game_clock()
+    if clock is None or not clock.last_round:
+        raise InvalidRequestException("There is no game to value")
+    if round_number is None:
+        round_number = clock.current_round
+    if not 1 <= round_number <= clock.last_round:
+        raise InvalidRequestException("round should be between 1 and {}".format(clock.last_round))
+
+    ending_prices = dict(Item.objects.order_by('name').values_list('name', 'ending_price'))
+    item_names = list(ending_prices)
+    if city_name is None:
+        prices = array('q', ending_prices.values())
+    else:
+        tensor = get_price_tensor(item_names, clock.last_round)
+        if city_name not in tensor.city_index:
+            raise InvalidRequestException("{} has no exchange rates".format(city_name))
+        prices = tensor.column(city_name, round_number)
+
+    money = dict(PlayerBalance.objects.values_list('player', 'money'))
+    codes = sorted(money)
+    player_index = {code: index for index, code in enumerate(codes)}
+    item_index = {item_name: index for index, item_name in enumerate(item_names)}
+    item_count = len(item_names)
+    holdings = array('q', bytes(8 * len(codes) * item_count))
+    for code, item_name, amount in PlayerInventory.objects.exclude(amount=0).values_list('player', 'item', 'amount'):
+        if code in player_index:
+            holdings[player_index[code] * item_count + item_index[item_name]] = amount
+
+    debts = dict.fromkeys(codes, 0)
+    loan_table = get_loan_table(clock)
+    for code, loan_round, amount in Loan.objects.filter(payback__isnull=True).values_list('player', 'round', 'amount'):
+        if code in debts:
+            debts[code] += loan_table.payback(amount, loan_round, max(round_number, loan_round))
+
+    rows = memoryview(holdings)
+    valuations = []
+    for index, code in enumerate(codes):
+        items_value = sum(map(mul, rows[index * item_count:(index + 1) * item_count], prices))
+        valuations.append({
+            'player': code,
+            'money': money[code],
+            'items_value': items_value,
+            'loans': debts[code],
+            'total': money[code] + items_value - debts[code],
+        })
+    valuations.sort(key=lambda valuation: -valuation['total'])
+    for rank, valuation in enumerate(valuations, start=1):
+        valuation['rank'] = rank
+    return valuations
@@ -1,15 +1,44 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core import exceptions
 from django.db import IntegrityError
+from django.db.models import F, Prefetch, Q
+from django.db.transaction import atomic
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import permissions, viewsets, mixins, status
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.views import APIView
 
 from scout.settings import MERCHANT_GAME_CLIENT_ADDRESS, MERCHANT_GAME_CLIENT_BASE
-from .exceptions import InvalidRequestException
-from .models import Player, City, GameData, Loan, Transaction, PlayerTransaction, Item, LoanPayback
+from . import transfers
+from .arbitrage import solve as solve_arbitrage
+from .exceptions import InvalidRequestException, TradeException
+from .game_clock import get_game_clock
+from .loans import issue_loans, settle_loans
+from .metrics import generate_metrics
+from .rates import get_rate_matrix
+from .models import (
+    Player,
+    City,
+    GameData,
+    Loan,
+    Transaction,
+    PlayerTransaction,
+    PlayerTransactionItemAmount,
+    LoanPayback,
+)
+from .pagination import LedgerPagination
+from .scoring import score_players
+from .streaming import AsyncStreamingHttpResponse
+from .timing import get_route_stats, reset_route_stats
+from .trading import execute_trade, execute_trades, lock_balances
+from .valuation import value_players
 from .serializers import (
     PlayerSerializer,
     PlayerListSerializer,
@@ -29,6 +58,21 @@ class PlayerViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = PlayerSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def get_queryset(self):
+        if self.action in ('gift', 'rob'):
+            # The transfers read the money and the items of the players themselves
+            return super().get_queryset()
+        queryset = super().get_queryset().annotate(balance_money=F('balance__money')).prefetch_related('inventory')
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related(
+                Prefetch('transactions', queryset=Transaction.objects.only('id', 'player')),
+                Prefetch('giving_transactions', queryset=PlayerTransaction.objects.only('id', 'giver')),
+                Prefetch('taking_transactions', queryset=PlayerTransaction.objects.only('id', 'taker')),
+                Prefetch('loans', queryset=Loan.objects.only('id', 'player')),
+                Prefetch('loans__payback', queryset=LoanPayback.objects.only('id', 'loan')),
+            )
+        return queryset
+
     def get_serializer_class(self):
         if self.action == 'list':
             return PlayerListSerializer
@@ -49,43 +93,14 @@ class PlayerViewSet(viewsets.ReadOnlyModelViewSet):
         except exceptions.ObjectDoesNotExist as ex:
             return Response({'error': str(ex), 'robbed': robbed_code}, status=status.HTTP_404_NOT_FOUND)
 
-        robbed_money = robbed.money if rob_money else 0
-        robbed_items = robbed.items if not rob_money else {}
-
-        return self._serialize_player_transaction(
-            giver=robbed,
-            taker=robber,
-            money=robbed_money,
-            items=robbed_items,
-            request=request,
-        )
+        return self._player_transaction_response(transfers.rob(robber, robbed, rob_money), request)
 
     @staticmethod
-    def _serialize_player_transaction(giver, taker, money, items, request):
-        data = {
-            'giver': giver.code,
-            'taker': taker.code,
-            'money': money,
-            'items': items,
-        }
-        player_transaction = PlayerTransaction(giver=giver, taker=taker, money=money)
-        try:
-            player_transaction_serializer = PlayerTransactionSerializer(
-                instance=player_transaction,
-                data=data,
-                context={'request': request},
-            )
-            if player_transaction_serializer.is_valid():
-                transaction = player_transaction_serializer.save()
-                return Response({
-                    'status': 'Player transaction successful',
-                    'player_transaction': player_transaction_serializer.to_representation(transaction),
-                })
-            else:
-                return Response(player_transaction_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        except Exception as ex:
-            player_transaction.delete()
-            return Response({'status': str(ex)})
+    def _player_transaction_response(transaction, request):
+        return Response({
+            'status': 'Player transaction successful',
+            'player_transaction': PlayerTransactionSerializer(transaction, context={'request': request}).data,
+        })
 
     @action(methods=['POST'], detail=True)
     def gift(self, request, *args, **kwargs):
@@ -105,30 +120,10 @@ class PlayerViewSet(viewsets.ReadOnlyModelViewSet):
         given_items = given_items if given_items is not None else {}
 
         try:
-            self._check_gift_validity(given_money, given_items, giver)
+            transaction = transfers.give(giver, taker, given_money, given_items)
         except InvalidRequestException as ex:
             return Response(ex.get_full_details(), status=ex.status_code)
-
-        return self._serialize_player_transaction(
-            giver=giver,
-            taker=taker,
-            money=given_money,
-            items=given_items,
-            request=request,
-        )
-
-    @staticmethod
-    def _check_gift_validity(given_money, given_items, giver):
-        if given_money < 0:
-            raise InvalidRequestException("money shouldn't be lower than 0")
-        if given_money > giver.money:
-            raise InvalidRequestException("given money should be not higher than the giver's money")
-        if not isinstance(given_items, dict):
-            raise InvalidRequestException("items should be a dictionary of item names and amounts")
-        for item_name, given_amount in given_items.items():
-            giver_item_amount = giver.items.get(item_name)
-            if given_amount > giver_item_amount:
-                raise InvalidRequestException("given item amount should not be higher than giver's item amount")
+        return self._player_transaction_response(transaction, request)
 
 
 class CityViewSet(viewsets.ReadOnlyModelViewSet):
@@ -143,45 +138,91 @@ class CityViewSet(viewsets.ReadOnlyModelViewSet):
 
     @action(detail=True)
     def current_rates(self, request, *args, **kwargs):
-        city = self.get_object()
-        game_data = GameData.objects.last()
+        clock = get_game_clock()
+        city_rates = get_rate_matrix().round_rates(self.kwargs[self.lookup_field], clock.current_round) if clock else {}
+        if not city_rates:
+            # Unknown cities still answer 404
+            self.get_object()
         response = {
-            rate.item.name: ItemExchangeRateSerializer().to_representation(rate)
-            for rate in city.rates.filter(round=GameData.objects.last().current_round)
-        } if game_data else {}
+            item_name: ItemExchangeRateSerializer().to_representation(rate)
+            for item_name, rate in city_rates.items()
+        }
         return Response(response)
 
+    @action(detail=False, url_path='current_rates')
+    def all_current_rates(self, request, *args, **kwargs):
+        """The current rates of every city, keyed by city name.
+
+        The ETag changes with the round and the rates, so polling clients get a 304 until the next round and may cache
+        the response until the round ends.
+        """
+        clock = get_game_clock()
+        if clock is None:
+            return Response({})
+        current_round = clock.current_round
+        matrix = get_rate_matrix()
+        etag = quote_etag("{}-{}".format(current_round, matrix.version))
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(matrix.prices(current_round))
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=max(int(clock.round_remaining_seconds), 0))
+        return response
+
     def _validate_trade_data(self, request):
-        city = self.get_object()
         player_code = request.data.get('player', None)
         item_name = request.data.get('item', None)
         amount = request.data.get('amount', None)
         if player_code is None or item_name is None or amount is None:
             raise InvalidRequestException("player, item and amount are required")
+        self._validate_item_name(item_name)
+        self._validate_amount(amount)
 
-        current_round = GameData.objects.last().current_round
+        current_round = get_game_clock().current_round
 
         player = Player.objects.get(code=player_code)
-        rate = city.rates.get(round=current_round, item=item_name)
+        rate = get_rate_matrix().get(self.kwargs[self.lookup_field], current_round, item_name)
 
         return player, rate, item_name, amount
 
     @staticmethod
-    def _serialize_trade(player, amount, rate, request):
-        data = {
-            'player': player,
-            'item_amount': amount,
-            'exchange_rate': rate.id,
-        }
-        transaction_serializer = TransactionSerializer(data=data, context={"request": request})
-        if transaction_serializer.is_valid():
-            transaction = transaction_serializer.save()
-            return Response({
-                'status': 'Trade successful',
-                'transaction': transaction_serializer.to_representation(transaction),
-            })
-        else:
-            return Response(transaction_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    def _validate_item_name(item_name):
+        if not isinstance(item_name, str):
+            raise InvalidRequestException("item should be an item name")
+
+    @staticmethod
+    def _validate_amount(amount):
+        if not isinstance(amount, int) or isinstance(amount, bool) or amount <= 0:
+            raise InvalidRequestException("amount should be a positive integer")
+
+    def _validate_trade_lines(self, request):
+        player_code = request.data.get('player', None)
+        lines = request.data.get('lines', None)
+        if player_code is None or not isinstance(lines, list) or not lines:
+            raise InvalidRequestException("player and a list of lines are required")
+        trade_lines = []
+        for line in lines:
+            if not isinstance(line, dict) or line.get('action') not in ('buy', 'sell') or 'item' not in line:
+                raise InvalidRequestException("every line needs an item, an amount and a buy or sell action")
+            self._validate_item_name(line['item'])
+            self._validate_amount(line.get('amount'))
+            trade_lines.append((line['item'], line['amount'] if line['action'] == 'buy' else -1 * line['amount']))
+
+        player = Player.objects.get(code=player_code)
+
+        return player, trade_lines
+
+    @staticmethod
+    def _execute_trade(player, item_amount, rate, request):
+        try:
+            transaction = execute_trade(player, rate, item_amount)
+        except TradeException as ex:
+            return Response({'error': ex.detail}, status=ex.status_code)
+        return Response({
+            'status': 'Trade successful',
+            'transaction': TransactionSerializer(context={"request": request}).to_representation(transaction),
+        })
 
     @action(methods=['POST'], detail=True)
     def buy(self, request, *args, **kwargs):
@@ -192,10 +233,7 @@ class CityViewSet(viewsets.ReadOnlyModelViewSet):
         except exceptions.ObjectDoesNotExist as ex:
             return Response({'error': str(ex)}, status=status.HTTP_404_NOT_FOUND)
 
-        new_money = player.money - rate.buy_price * amount
-        if new_money < 0:
-            return Response({'error': 'Not enough money'}, status=status.HTTP_400_BAD_REQUEST)
-        return self._serialize_trade(player, amount, rate, request)
+        return self._execute_trade(player, amount, rate, request)
 
     @action(methods=['POST'], detail=True)
     def sell(self, request, *args, **kwargs):
@@ -206,27 +244,159 @@ class CityViewSet(viewsets.ReadOnlyModelViewSet):
         except exceptions.ObjectDoesNotExist as ex:
             return Response({'error': str(ex)}, status=status.HTTP_404_NOT_FOUND)
 
-        new_item_amount = player.items.get(item_name, 0) - amount
-        if new_item_amount < 0:
-            return Response({'error': 'Not enough item'}, status=status.HTTP_400_BAD_REQUEST)
-        return self._serialize_trade(player, -1 * amount, rate, request)
+        return self._execute_trade(player, -1 * amount, rate, request)
+
+    @action(methods=['POST'], detail=True)
+    def trade(self, request, *args, **kwargs):
+        city = self.get_object()
+        try:
+            player, lines = self._validate_trade_lines(request)
+        except InvalidRequestException as ex:
+            return Response(ex.get_full_details(), status=ex.status_code)
+        except exceptions.ObjectDoesNotExist as ex:
+            return Response({'error': str(ex)}, status=status.HTTP_404_NOT_FOUND)
+
+        transactions, errors = execute_trades(player, city, get_game_clock().current_round, lines)
+        if any(errors):
+            return Response({
+                'error': 'Trade failed',
+                'lines': [{'error': error} if error else {'status': 'valid'} for error in errors],
+            }, status=status.HTTP_400_BAD_REQUEST)
+        transaction_serializer = TransactionSerializer(context={"request": request})
+        return Response({
+            'status': 'Trade successful',
+            'lines': [
+                {'status': 'executed', 'transaction': transaction_serializer.to_representation(transaction)}
+                for transaction in transactions
+            ],
+        })
+
+
+def _number_param(params, name):
+    value = params.get(name, None)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidRequestException("{} should be a number".format(name))
+
+
+class LedgerViewSetMixin:
+    """Cursor pages of ledger rows filtered by the query parameters, and their export as one streamed JSON list.
+
+    since_id skips the rows up to an id, the other filters are applied by filter_ledger().
+    """
+    pagination_class = LedgerPagination
+    # Number of rows loaded and serialized at once by the export
+    export_batch_size = 1000
+
+    def filter_ledger(self, queryset, params):
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in ('list', 'export'):
+            since_id = _number_param(self.request.query_params, 'since_id')
+            if since_id is not None:
+                queryset = queryset.filter(id__gt=since_id)
+            queryset = self.filter_ledger(queryset, self.request.query_params)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        try:
+            return super().list(request, *args, **kwargs)
+        except InvalidRequestException as ex:
+            return Response(ex.get_full_details(), status=ex.status_code)
+
+    @action(detail=False)
+    def export(self, request, *args, **kwargs):
+        """Every filtered row without pages, streamed in batches so memory doesn't grow with their number.
+
+        With the async views the batches are queried in a thread while the response is sent from the event loop.
+        """
+        try:
+            queryset = self.filter_queryset(self.get_queryset())
+        except InvalidRequestException as ex:
+            return Response(ex.get_full_details(), status=ex.status_code)
+        if settings.MERCHANT_GAME_ASYNC_VIEWS:
+            return AsyncStreamingHttpResponse(self._async_export(queryset), content_type='application/json')
+        return StreamingHttpResponse(self._export(queryset), content_type='application/json')
+
+    def _export_batch(self, queryset, last_id):
+        """Return the JSON of the rows after last_id in a batch, without the brackets, and the id of its last row.
+
+        Both are None when there are no rows left.
+        """
+        batch = queryset if last_id is None else queryset.filter(id__gt=last_id)
+        batch = list(batch.order_by('id')[:self.export_batch_size])
+        if not batch:
+            return None, None
+        encoder = JSONEncoder()
+        rows = ','.join(encoder.encode(row) for row in self.get_serializer(batch, many=True).data)
+        return (rows if last_id is None else ',' + rows), batch[-1].id
+
+    def _export(self, queryset):
+        last_id = None
+        yield '['
+        while True:
+            rows, last_id = self._export_batch(queryset, last_id)
+            if rows is None:
+                break
+            yield rows
+        yield ']'
+
+    async def _async_export(self, queryset):
+        # Like the sync views, in the thread of the request, which has its database connection
+        export_batch = sync_to_async(self._export_batch, thread_sensitive=True)
+        last_id = None
+        yield '['
+        while True:
+            rows, last_id = await export_batch(queryset, last_id)
+            if rows is None:
+                break
+            yield rows
+        yield ']'
 
 
 class TransactionViewSet(
+    LedgerViewSetMixin,
     mixins.CreateModelMixin,
     viewsets.ReadOnlyModelViewSet,
 ):
-    queryset = Transaction.objects.all()
+    """Trades, filtered by ?player=, ?city=, ?round=, ?item= and ?since_id=."""
+    # The item and the rate of a trade are read from its exchange rate
+    queryset = Transaction.objects.select_related('exchange_rate')
     serializer_class = TransactionSerializer
 
+    def filter_ledger(self, queryset, params):
+        for param, lookup in (('player', 'player'), ('city', 'exchange_rate__city'), ('item', 'exchange_rate__item')):
+            if param in params:
+                queryset = queryset.filter(**{lookup: params[param]})
+        round_number = _number_param(params, 'round')
+        if round_number is not None:
+            queryset = queryset.filter(exchange_rate__round=round_number)
+        return queryset
+
 
 class PlayerTransactionViewSet(
+    LedgerViewSetMixin,
     mixins.CreateModelMixin,
     viewsets.ReadOnlyModelViewSet,
 ):
-    queryset = PlayerTransaction.objects.all()
+    """Gifts and robberies, filtered by ?player= (giving or taking), ?item= and ?since_id=."""
+    queryset = PlayerTransaction.objects.prefetch_related('items')
     serializer_class = PlayerTransactionSerializer
 
+    def filter_ledger(self, queryset, params):
+        if 'player' in params:
+            queryset = queryset.filter(Q(giver=params['player']) | Q(taker=params['player']))
+        if 'item' in params:
+            queryset = queryset.filter(id__in=PlayerTransactionItemAmount.objects.filter(
+                item=params['item'],
+            ).values('transaction'))
+        return queryset
+
 
 class LoanViewSet(
     mixins.CreateModelMixin,
@@ -236,17 +406,59 @@ class LoanViewSet(
     serializer_class = LoanSerializer
     permission_classes = [permissions.IsAdminUser]
 
+    @action(methods=['POST'], detail=False)
+    def issue(self, request, *args, **kwargs):
+        """Give the loan of the round to the players, every player without a players list.
+
+        The round is the current one by default, players that took its loan already are skipped.
+        """
+        if hasattr(request.data, 'getlist'):
+            # Form data repeats the players key for every player
+            player_codes = request.data.getlist('players') or None
+        else:
+            player_codes = request.data.get('players', None)
+        round_number = request.data.get('round', None)
+        try:
+            if player_codes is not None and (
+                    not isinstance(player_codes, list) or not all(isinstance(code, str) for code in player_codes)
+            ):
+                raise InvalidRequestException("players should be a list of player codes")
+            if round_number is not None:
+                try:
+                    round_number = int(round_number)
+                except (TypeError, ValueError):
+                    raise InvalidRequestException("round should be a number")
+            loans, skipped_codes = issue_loans(player_codes, round_number)
+        except InvalidRequestException as ex:
+            return Response(ex.get_full_details(), status=ex.status_code)
+        except IntegrityError:
+            return Response(
+                {'error': 'A player took a loan while the loans were issued, try again'},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return Response({
+            'round': round_number if round_number is not None else get_game_clock().current_round,
+            'issued': {loan.player_id: loan.amount for loan in loans},
+            'skipped': skipped_codes,
+        }, status=status.HTTP_201_CREATED)
+
     @action(methods=['POST'], detail=True)
     def pay_back_loan(self, request, *args, **kwargs):
         loan = self.get_object()
         payback = LoanPayback(loan=loan)
-        if loan.player.money - payback.payback_amount < 0:
-            return Response({'error': 'Not enough money'}, status=status.HTTP_400_BAD_REQUEST)
-        try:
-            payback.save()
-        except IntegrityError:
-            return Response({'error': 'This loan has been already repaid!'}, status=status.HTTP_409_CONFLICT)
-        LoanPaybackSerializer(context={'request': request}).to_representation(payback)
+        # Like the trades, the money is checked and paid while the balance of the player is locked
+        with atomic():
+            money = lock_balances([loan.player_id])[loan.player_id]
+            if LoanPayback.objects.filter(loan=loan).exists():
+                return Response({'error': 'This loan has been already repaid!'}, status=status.HTTP_409_CONFLICT)
+            payback.set_payback_amount()
+            if money - payback.payback_amount < 0:
+                return Response({'error': 'Not enough money'}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                payback.save()
+            except IntegrityError:
+                # Settling the loans at the end of the game locks the loans, not the balances
+                return Response({'error': 'This loan has been already repaid!'}, status=status.HTTP_409_CONFLICT)
         return Response(LoanPaybackSerializer(context={'request': request}).to_representation(payback))
 
 
@@ -270,48 +482,86 @@ class GameDataViewSet(
 @permission_classes((permissions.IsAdminUser, ))
 class End(APIView):
     def post(self, request, format=None):
-        players = Player.objects.all()
-        for player in players:
-            for loan in player.loans.all():
-                payback = LoanPayback(loan=loan)
-                payback.save()
+        settle_loans()
         return self.get(request, format)
 
     def get(self, request, format=None):
-        final_prices = {item.name: item.ending_price for item in Item.objects.all()}
-        result = {"final_prices": final_prices}
-        game_data = GameData.objects.last()
-        players = Player.objects.all()
-        for player in players:
-            result[player.code] = {}
-            result[player.code]['money'] = player.money
-            result[player.code]['final_money'] = player.money
-            result[player.code]['items'] = {}
-            for item_name, amount in player.items.items():
-                result[player.code]['items'][item_name] = {
-                    'amount': amount,
-                    'value': final_prices[item_name] * amount
-                }
-                result[player.code]['final_money'] += result[player.code]['items'][item_name]['value']
-            result[player.code]['loans'] = {}
-            result[player.code]['paybacks'] = {}
-            for loan in player.loans.all():
-                result[player.code]['loans'][loan.round.number] = {
-                    "loan_amount": loan.amount,
-                }
-                if hasattr(loan, 'payback'):
-                    result[player.code]['paybacks'][loan.round.number] = {
-                        "payback_amount": loan.payback.payback_amount,
-                    }
-                    result[player.code]['loans'][loan.round.number]['paid_back'] = True
-                else:
-                    result[player.code]['loans'][loan.round.number]['paid_back'] = False
-                    result[player.code]['loans'][loan.round.number]['payback_amount'] = loan.amount + (
-                            (game_data.current_round - loan.round.number) * int(
-                                loan.amount * game_data.loan_interest / 100)
-                    )
-                    result[player.code]['final_money'] -= result[player.code]['loans'][loan.round.number]['payback_amount']
-        return Response(data=result)
+        return Response(data=score_players())
+
+
+@permission_classes((permissions.IsAuthenticated, ))
+class Valuation(APIView):
+    """What every player would be worth, ranked: the money plus the items sold in the city in the round, or valued at
+    their ending prices without a city, minus the loans paid back in the round.
+
+    The round is the current one by default.
+    """
+
+    def get(self, request, format=None):
+        city_name = request.query_params.get('city', None)
+        round_number = request.query_params.get('round', None)
+        try:
+            if round_number is not None:
+                try:
+                    round_number = int(round_number)
+                except ValueError:
+                    raise InvalidRequestException("round should be a number")
+            valuations = value_players(city_name, round_number)
+        except InvalidRequestException as ex:
+            return Response(ex.get_full_details(), status=ex.status_code)
+        return Response({
+            'city': city_name,
+            'round': round_number if round_number is not None else get_game_clock().current_round,
+            'prices': 'sell' if city_name is not None else 'ending',
+            'players': valuations,
+        })
+
+
+@permission_classes((permissions.IsAdminUser, ))
+class Arbitrage(APIView):
+    """A greedy trading route of the market with the loans of the game data and the upper bound of the score of every
+    route, to check its balance before the game.
+
+    The route starts with the starting money of the players, or with ?money=.
+    """
+
+    def get(self, request, format=None):
+        starting_money = request.query_params.get('money', None)
+        try:
+            if starting_money is not None:
+                try:
+                    starting_money = int(starting_money)
+                except ValueError:
+                    raise InvalidRequestException("money should be a number")
+                if starting_money < 0:
+                    raise InvalidRequestException("money shouldn't be lower than 0")
+            return Response(solve_arbitrage(starting_money))
+        except InvalidRequestException as ex:
+            return Response(ex.get_full_details(), status=ex.status_code)
+
+
+@permission_classes((permissions.IsAdminUser, ))
+class RequestStats(APIView):
+    """Timings of the requests served by this worker process, by route name and method.
+
+    Collected when MERCHANT_GAME_SERVER_TIMING is turned on, DELETE resets them.
+    """
+
+    def get(self, request, format=None):
+        return Response(get_route_stats())
+
+    def delete(self, request, format=None):
+        reset_route_stats()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@permission_classes((permissions.IsAdminUser, ))
+class Metrics(APIView):
+    """Prometheus metrics of the game and of the requests of every worker process."""
+
+    def get(self, request, format=None):
+        content_type, content = generate_metrics()
+        return HttpResponse(content, content_type=content_type)
 
 
 @api_view(['GET'])
@@ -322,6 +572,9 @@ def api_root(request, format=None):
         'cities': reverse('city-list', request=request, format=format),
         'loans': reverse('loan-list', request=request, format=format),
         'end': reverse('end', request=request, format=format),
+        'stats': reverse('stats', request=request, format=format),
+        'valuation': reverse('valuation', request=request, format=format),
+        'arbitrage': reverse('arbitrage', request=request, format=format),
     })
 
 
@@ -0,0 +1,34 @@
+"""
+ASGI config for scout project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+The round clock stream is served directly, every other request goes to Django with the async read views turned on.
+Run it with the uvicorn workers of gunicorn: gunicorn scout.asgi -c scout/gunicorn_asgi.py
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
+"""
+
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'scout.settings')
+os.environ.setdefault('MERCHANT_GAME_ASYNC_VIEWS', 'True')
+
+django.setup(set_prefix=False)
+
+from merchant_game.streaming import StreamingASGIHandler  # noqa: E402 needs the configured settings
+from merchant_game.streams import round_clock_stream  # noqa: E402 needs the configured settings
+
+# Like get_asgi_application(), with a handler that also sends the async streamed responses
+django_application = StreamingASGIHandler()
+
+STREAM_PATH = '/merchant_game/api/stream/'
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == STREAM_PATH:
+        await round_clock_stream(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
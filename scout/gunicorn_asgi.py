@@ -0,0 +1,23 @@
+"""
+Gunicorn config for serving scout.asgi with uvicorn workers.
+
+    gunicorn scout.asgi -c scout/gunicorn_asgi.py
+"""
+
+import os
+
+worker_class = 'uvicorn.workers.UvicornWorker'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', 8000))
+accesslog = '-'
+# Round clock streams never finish, don't wait for them on restarts
+graceful_timeout = 5
+
+
+def on_starting(server):
+    """Remove the metrics of the workers of a previous run, see merchant_game.metrics."""
+    directory = os.environ.get('prometheus_multiproc_dir')
+    if directory and os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith('.db'):
+                os.remove(os.path.join(directory, name))
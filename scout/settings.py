@@ -26,6 +26,20 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', '#k$kgkzff)cc0d!@pn5^2jf*ak+zqjef4@86dgyu_^i-!-m+hj')
 MERCHANT_GAME_CLIENT_ADDRESS = os.environ.get('MERCHANT_GAME_CLIENT_ADDRESS', 'http://localhost:4200')
 MERCHANT_GAME_CLIENT_BASE = os.environ.get('MERCHANT_GAME_CLIENT_BASE', '')
+# Seconds a worker may serve the cached game data before reading it again
+MERCHANT_GAME_CACHE_TTL = float(os.environ.get('MERCHANT_GAME_CACHE_TTL', 5))
+# Seconds between two checks of the version of the exchange rates by a worker, it reloads them when they changed
+MERCHANT_GAME_RATES_TTL = float(os.environ.get('MERCHANT_GAME_RATES_TTL', 5))
+# Seconds between the countdown ticks of the round clock stream
+MERCHANT_GAME_STREAM_TICK = float(os.environ.get('MERCHANT_GAME_STREAM_TICK', 1))
+# Serve the hot read-only endpoints with async views, scout/asgi.py turns it on
+MERCHANT_GAME_ASYNC_VIEWS = os.environ.get('MERCHANT_GAME_ASYNC_VIEWS', '') == 'True'
+# Time every request, report it in a Server-Timing header and aggregate it by route for api/stats/
+MERCHANT_GAME_SERVER_TIMING = os.environ.get('MERCHANT_GAME_SERVER_TIMING', '') == 'True'
+# Number of ledger events of a player between two snapshots of its money and items
+MERCHANT_GAME_SNAPSHOT_INTERVAL = int(os.environ.get('MERCHANT_GAME_SNAPSHOT_INTERVAL', 50))
+# Number of rows in a page of the transactions and player transactions, clients can ask for up to 1000
+MERCHANT_GAME_LEDGER_PAGE_SIZE = int(os.environ.get('MERCHANT_GAME_LEDGER_PAGE_SIZE', 100))
 
 # SECURITY WARNING: don't run with debug turned on in production!
 # DEBUG = True
@@ -49,9 +63,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'merchant_game.middleware.RequestMetricsMiddleware',
+    'merchant_game.middleware.ServerTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'merchant_game.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -16,6 +16,7 @@ Including another URLconf
 from django.contrib import admin
 from django.shortcuts import redirect
 from django.urls import include, path
+from merchant_game.views import Metrics
 
 
 def redirect_to_merchant_game(request):
@@ -26,5 +27,6 @@ urlpatterns = [
     path('api-auth/', include('rest_framework.urls')),
     path('merchant_game/', include('merchant_game.urls')),
     path('admin/', admin.site.urls),
+    path('metrics', Metrics.as_view(), name='metrics'),
     path('', redirect_to_merchant_game),
 ]